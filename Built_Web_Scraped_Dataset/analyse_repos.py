@@ -1,6 +1,11 @@
 import os
-import pickle, time, random, csv
-from web_scraping_utils import make_request, generate_avg_stats
+import pickle, csv, sys, multiprocessing
+from web_scraping_utils import fetch_all_pages, generate_avg_stats, enable_http_cache, close_http_cache
+from repo_queue import RepoQueue, LeaseHeartbeat, DEFAULT_QUEUE_FILEPATH, worker_name
+
+# Maximum number of pages (of 100 commits) read from the commit history of each repository
+# Set to 1, instead of 9 (which would allow 900 commits) for testing and speed purposes
+COMMIT_PAGE_LIMIT = 1
 
 def save_flagged(repo_name, filename, flagged_array):
     """
@@ -48,54 +53,24 @@ def read_open_issues(repo_name):
     """
     url = "https://api.github.com/repos/" + repo_name + "/issues"
 
-    # Start with page 1
-    page = 1
-    # Set the empty page boolean to False
-    empty_page = False
-
     # Initialise arrays to store the issues, flagged issues, and a counter of issues with pull requests
     issues = []
     flagged = []
     pr_counter = 0
 
-    # Search until the page is empty
-    while not empty_page:
-        # Specify filters to include in the request
-        filters = {
-            "is":"issue",
-            "state":"open",
-            "per_page": 100,
-            "page": page
-        }
-
-        # Make a request to the GitHub API to access issues for a certain page
-        response = make_request(url, filters)
-
-        if response.status_code == 200:
-            # If data is returned, extract the issues on this page
-            issues_found = response.json()
-
-            # If 0 issues are found, there are no more pages and we can move on
-            if len(issues_found) == 0:
-                # Change boolean to prevent the program from entering the loop again
-                empty_page = True
-                # Skip to the end of this loop
-                continue
-
-            # If we are here, there are issues to process
-            for issue in issues_found:
-                if "pull_request" in issue:
-                    pr_counter += 1
-                else:
-                    issues.append(issue)
+    # Specify filters to include in the request
+    filters = {
+        "is":"issue",
+        "state":"open",
+        "per_page": 100
+    }
+
+    # Read every page of issues (the pages after the first are requested concurrently)
+    for issue in fetch_all_pages(url, filters):
+        if "pull_request" in issue:
+            pr_counter += 1
         else:
-            # If the status is not 200, there was an error, display the status code
-            print("Error reading repositories - Status: " + str(response.status_code))
-
-        # Increment the page variable to search the next page
-        page += 1
-        # Random sleep between 5 and 10 seconds to prevent requests from being rejected
-        time.sleep(random.uniform(5, 10))
+            issues.append(issue)
 
     # Hard Coded Keyword Arrays
     java8_keywords = ["java8", "jdk8", "8", "1.8"]
@@ -143,48 +118,11 @@ def read_release_notes(repo_name):
     # Request to the GitHub API to see release notes
     url = "https://api.github.com/repos/" + repo_name + "/releases"
 
-    # Start with page 1
-    page = 1
-    # Set the empty page boolean to False
-    empty_page = False
-
-    # Initialise arrays to store the releases and flagged releases
-    releases = []
+    # Initialise an array to store the flagged releases
     flagged = []
 
-    # Search until the page is empty
-    while not empty_page:
-        # Specify filters to include in the request
-        filters = {
-            "per_page": 100,
-            "page": page
-        }
-
-        # Make a request to the GitHub API to access releases in a certain page
-        response = make_request(url, filters)
-
-        if response.status_code == 200:
-            # If data is returned, extract the issues on this page
-            releases_found = response.json()
-
-            # If 0 issues are found, there are no more pages and we can move on
-            if len(releases_found) == 0:
-                # Change boolean to prevent the program from entering the loop again
-                empty_page = True
-                # Skip to the end of this loop
-                continue
-
-            # If we are here, there are commits to process
-            releases += releases_found
-        else:
-            # If the status is not 200, there was an error, display the status code
-            print("Error reading repositories - Status: " + str(response.status_code))
-
-        # Increment the page variable to search the next page
-        page += 1
-
-        # Random sleep between 5 and 10 seconds to prevent requests from being rejected
-        time.sleep(random.uniform(5, 10))
+    # Read every page of releases (the pages after the first are requested concurrently)
+    releases = fetch_all_pages(url, {"per_page": 100})
 
     # Hard Coded Keyword Arrays
     java8_keywords = ["java8", "jdk8", "8", "1.8"]
@@ -220,60 +158,21 @@ def read_release_notes(repo_name):
     return len(releases), flagged
 
 
-def read_commit_history(repo_name):
+def read_commit_history(repo_name, max_pages=COMMIT_PAGE_LIMIT):
     """
     Function to read the commit history of a repo
     :param repo_name: The name of the repository to search
+    :param max_pages: Maximum number of pages of 100 commits to read (None to read the whole history)
     :return: The number of commits and the flagged commits themselves
     """
     # Request to the GitHub API to see the commit history
     url = "https://api.github.com/repos/" + repo_name + "/commits"
 
-    # Start with page 1
-    page = 1
-    # Set the empty page boolean to False
-    empty_page = False
-
-    # Initialise arrays to store the commits and flagged commits
-    commits = []
+    # Initialise an array to store the flagged commits
     flagged = []
 
-    # Search until the page is empty
-    while not empty_page:
-        # Specify filters to include in the request
-        filters = {
-            "per_page": 100,
-            "page": page
-        }
-
-        # Make a request to the GitHub API to access commits for a certain page
-        response = make_request(url, filters)
-
-        if response.status_code == 200:
-            # If data is returned, extract the issues on this page
-            commits_found = response.json()
-
-            # If 0 issues are found, there are no more pages and we can move on
-            if len(commits_found) == 0:
-                # Change boolean to prevent the program from entering the loop again
-                empty_page = True
-                # Skip to the end of this loop
-                continue
-
-            # If we are here, there are commits to process
-            commits += commits_found
-        else:
-            # If the status is not 200, there was an error, display the status code
-            print("Error reading repositories - Status: " + str(response.status_code))
-
-        # Increment the page variable to search the next page
-        page += 1
-        # line below is set to 2, instead of 10(which would allow 900 commits) for testing and speed purposes
-        if page == 2:
-            empty_page = True
-            continue
-        # Random sleep between 5 and 10 seconds to prevent request from being rejected
-        time.sleep(random.uniform(5, 10))
+    # Read the commit history, up to the page limit (the pages after the first are requested concurrently)
+    commits = fetch_all_pages(url, {"per_page": 100}, max_pages=max_pages)
 
     # Hard Coded Keyword Arrays
     java8_keywords = ["java8", "jdk8", "8", "1.8"]
@@ -305,7 +204,95 @@ def read_commit_history(repo_name):
     return len(commits), flagged
 
 
-def main(continue_scraping=False):
+def analyse_repo(repo_name, commit_page_limit=COMMIT_PAGE_LIMIT):
+    """
+    Function to analyse a single repository
+    :param repo_name: The name of the repository to analyse
+    :param commit_page_limit: Maximum number of pages of 100 commits to read
+    :return: The statistics row for repo_stats.csv and the array of flagged items
+    """
+    # Call functions to search commit history, open issues and release notes
+    num_commits, flagged_commits = read_commit_history(repo_name, commit_page_limit)
+    num_issues, flagged_issues = read_open_issues(repo_name)
+    num_releases, flagged_releases = read_release_notes(repo_name)
+
+    combined_flagged = flagged_issues + flagged_releases + flagged_commits
+    statistics = [repo_name,
+                  num_commits, len(flagged_commits),
+                  num_issues, len(flagged_issues),
+                  num_releases, len(flagged_releases)]
+    return statistics, combined_flagged
+
+
+def run_worker(queue_filepath=DEFAULT_QUEUE_FILEPATH, commit_page_limit=COMMIT_PAGE_LIMIT, use_http_cache=False):
+    """
+    Function to analyse repositories from the queue until there are none left to claim
+    Several workers (processes or machines sharing the queue database) can run at the same time
+    :param queue_filepath: Filepath of the queue database
+    :param commit_page_limit: Maximum number of pages of 100 commits to read per repository
+    :param use_http_cache: Whether this worker should enable the on-disk cache of the GitHub responses itself (and report it at the end),
+        the cache directory is shared with the other workers
+    :return: Number of repositories analysed by this worker
+    """
+    queue = RepoQueue(queue_filepath)
+    worker = worker_name()
+    http_cache = enable_http_cache() if use_http_cache else None
+    analysed = 0
+
+    while True:
+        claimed = queue.claim(worker)
+        if claimed is None:
+            break
+        position, repo_name = claimed
+        print("\n\nScraping Repo: " + str(position) + " (" + worker + ")")
+        print("Repo Name: " + str(repo_name))
+
+        try:
+            # Keep the lease alive while the repository is analysed, the rate limit can pause the requests for up to an hour
+            with LeaseHeartbeat(queue_filepath, position, worker, queue.lease_seconds):
+                statistics, combined_flagged = analyse_repo(repo_name, commit_page_limit)
+        except Exception as error:
+            # Put the repository back into the queue (or leave it as failed after its last attempt) and move on
+            print("Error analysing " + repo_name + ": " + repr(error))
+            queue.fail(position, worker, repr(error))
+            continue
+
+        # Store the statistics and flagged items, and mark the repository as done, in one transaction
+        if queue.complete(position, worker, statistics, combined_flagged):
+            analysed += 1
+            # Output some Information
+            print("Number of Flagged Items: " + str(len(combined_flagged)))
+        else:
+            print("Lease on " + repo_name + " expired before it was finished, another worker has taken it over")
+
+    queue.close()
+    if http_cache is not None:
+        http_cache.report()
+    return analysed
+
+
+def export_results(queue, stats_filepath="./repo_stats.csv", flagged_filepath="./flagged_repos.txt"):
+    """
+    Function to write the results of the analysed repositories to repo_stats.csv and flagged_repos.txt in the original repository order
+    :param queue: RepoQueue holding the results
+    :param stats_filepath: Filepath of the statistics csv file (replaced)
+    :param flagged_filepath: Filepath of the flagged items text file (replaced)
+    :return: Number of repositories exported
+    """
+    # Delete the flagged_repos and repo_stats files if they already exist
+    for filepath in (stats_filepath, flagged_filepath):
+        if os.path.exists(filepath):
+            os.remove(filepath)
+
+    results = queue.done_results()
+    for repo_name, statistics, flagged in results:
+        save_flagged(repo_name, flagged_filepath, flagged)
+        save_statistics(stats_filepath, statistics)
+    print("Exported the results of " + str(len(results)) + " repositories to " + stats_filepath + " and " + flagged_filepath)
+    return len(results)
+
+
+def main(continue_scraping=False, commit_page_limit=COMMIT_PAGE_LIMIT, workers=1, queue_filepath=DEFAULT_QUEUE_FILEPATH):
     # Read in the repo names if the file exists
     repos_filepath = "./all_repositories.pkl"
     if os.path.exists(repos_filepath):
@@ -319,54 +306,46 @@ def main(continue_scraping=False):
         print("all_repositories.pkl does not exist - run 'gather_repos.py' first")
         quit(1)
 
-    try:
-        # find the last scraped repo name in repo_stats.csv
-        with open("./repo_stats.csv", mode='r', newline='') as my_file:
-            last_repo = list(csv.reader(my_file))[-1][0]
-        # remove the completed repositories
-        scraped = repo_names.index(last_repo)+1
-        repo_names = repo_names[scraped:]
-        print("\nFound existing repo_stats.csv")
-
-    except FileNotFoundError:
-        print("\nNo existing repo_stats.csv")
-        scraped = 0
-
-        # Delete the flagged_repos and repo_stats files if they already exist
-        if os.path.exists("./flagged_repos.txt"):
-            os.remove("./flagged_repos.txt")
-        if os.path.exists("./repo_stats.csv"):
-            os.remove("./repo_stats.csv")
-
-
-    print("Scraping from repository " + str(scraped))
-    # Analyse each repository to see if it is useful or not
-    for repo_name in repo_names:
-        print("\n\nScraping Repo: " + str(scraped) + "/" + str(number_of_repos))
-        print("Repo Name: " + str(repo_name))
-
-        # Call functions to search commit history, open issues and release notes
-        num_commits, flagged_commits = read_commit_history(repo_name)
-        num_issues, flagged_issues = read_open_issues(repo_name)
-        num_releases, flagged_releases = read_release_notes(repo_name)
-
-        combined_flagged = flagged_issues + flagged_releases + flagged_commits
-
-        # Save data from the three arrays into the output file
-        save_flagged(repo_name, "./flagged_repos.txt", combined_flagged)
-
-        # Save Repo Statistics to CSV file
-        save_statistics("./repo_stats.csv", [repo_name,
-                                           num_commits, len(flagged_commits),
-                                           num_issues, len(flagged_issues),
-                                           num_releases, len(flagged_releases)])
-
-        # Output some Information
-        print("Number of Flagged Items: " + str(len(combined_flagged)))
+    # Queue every repository, the queue remembers which repositories are done so an interrupted run continues where it stopped
+    new_queue = not os.path.exists(queue_filepath)
+    queue = RepoQueue(queue_filepath)
+    if not continue_scraping:
+        queue.reset()
+    queue.add_repos(repo_names)
+    if continue_scraping and new_queue and os.path.exists("./repo_stats.csv"):
+        # Continue a run from before the queue was used
+        print("\nFound existing repo_stats.csv, marked " + str(queue.import_legacy_results("./repo_stats.csv", "./flagged_repos.txt"))
+              + " repositories as done")
+    queue.report()
+    # Close the connections before starting the workers, a SQLite connection must not be carried into a forked process
+    queue.close()
+    close_http_cache()
+
+    # Analyse the repositories with the given number of worker processes
+    if workers == 1:
+        run_worker(queue_filepath, commit_page_limit)
+    else:
+        processes = [multiprocessing.Process(target=run_worker, args=(queue_filepath, commit_page_limit, True)) for _ in range(workers)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
 
-        scraped += 1
+    # Reopen the queue to export the results of every worker
+    queue = RepoQueue(queue_filepath)
+    queue.report()
+    export_results(queue)
+    queue.close()
 
 
 if __name__ == '__main__':
-    main(True)
-    generate_avg_stats("./repo_stats.csv")
\ No newline at end of file
+    # Usage: python analyse_repos.py [number of worker processes]
+    #        python analyse_repos.py worker (joins the workers of a run that is already going, e.g. from another machine)
+    if len(sys.argv) >= 2 and sys.argv[1] == "worker":
+        run_worker(use_http_cache=True)
+    else:
+        # Cache the GitHub responses on disk, so re-running only downloads the pages which have changed
+        http_cache = enable_http_cache()
+        main(True, workers=int(sys.argv[1]) if len(sys.argv) >= 2 else 1)
+        http_cache.report()
+        generate_avg_stats("./repo_stats.csv")
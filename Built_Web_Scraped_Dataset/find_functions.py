@@ -1,8 +1,8 @@
 import os
 import javalang
 import base64
-import time, random, pickle, sys
-from web_scraping_utils import make_request
+import pickle, sys
+from web_scraping_utils import make_request, enable_http_cache
 from tqdm import tqdm
 
 def read_candidate_functions(filepath):
@@ -63,7 +63,7 @@ def find_java_files(repo_url):
     :return: Array of java files where each file is represented by a dictionary
     """
     # Get the sha of the branch
-    response_json = utils.make_request(repo_url + "?recursive=1").json()
+    response_json = make_request(repo_url + "?recursive=1").json()
     sha = response_json['commit']['sha']
 
     # Use the sha to get the tree representation of the branch
@@ -405,9 +405,6 @@ def main():
                 # Append functions to the candidate_function arrays
                 candidate_functions_same_params = candidate_functions_same_params + extracted_functions_same_params
                 candidate_functions_different_params = candidate_functions_different_params + extracted_functions_different_params
-
-                # Time delay due to GitHub API Limitations
-                time.sleep(random.uniform(5, 10))
             except javalang.parser.JavaSyntaxError:
                 pass
 
@@ -427,6 +424,9 @@ def main():
 
 if __name__ == '__main__':
     print("")
+    # Cache the GitHub responses on disk, so re-running only downloads the trees and files which have changed
+    http_cache = enable_http_cache()
     main()
+    http_cache.report()
     read_candidate_functions("./../Shared_Files/web_scraped_ds_same_params.pkl")
     read_candidate_functions("./../Shared_Files/web_scraped_ds_diff_params.pkl")
@@ -1,7 +1,5 @@
 import os
-import time
 import pickle
-import random
 from web_scraping_utils import make_request
 
 def get_java_repos(minimum_stars, results_per_page):
@@ -57,9 +55,6 @@ def get_java_repos(minimum_stars, results_per_page):
             # If the status is not 200, there was an error, display the status code
             print("Error reading repositories - Status: " + str(response.status_code))
 
-        # Random sleep between 10 and 15 seconds to prevent request from being rejected
-        time.sleep(random.uniform(10,15))
-
     # Return the repository names that were found
     return all_repositories
 
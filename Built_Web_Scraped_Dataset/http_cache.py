@@ -0,0 +1,191 @@
+"""
+This python file holds the on-disk HTTP cache used by make_request for the GitHub API
+Each response is stored in its own pkl file (named by a hash of the full request URL) together with its ETag and Last-Modified headers.
+A cached response which is still fresh (within its Cache-Control max-age) is returned without a request, otherwise a conditional
+request (If-None-Match / If-Modified-Since) is sent. GitHub answers unchanged resources with 304, which does not count against
+the primary rate limit, and the cached body is returned. Re-running the scrapers only downloads what has changed
+The entries are kept by the DiskLRUCache in Shared_Files/disk_cache.py, so the worker processes of analyse_repos.py share one cache directory
+"""
+import os, sys, hashlib, threading, time, re
+import requests
+from requests.structures import CaseInsensitiveDict
+# The scraping scripts are run from their own directory, so the repository root is added to the path for Shared_Files
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Shared_Files.disk_cache import DiskLRUCache
+
+# Default directory of the cache (next to the scraping scripts)
+DEFAULT_CACHE_DIRECTORY = "./http_cache"
+
+
+def request_url(url, filters=None):
+    """
+    Function to build the full URL of a GET request, including its query string
+    :param url: URL to send the request to
+    :param filters: Any filters to send with the request
+    :return: String URL
+    """
+    return requests.Request("GET", url, params=filters).prepare().url
+
+
+def max_age_seconds(headers):
+    """
+    Function to read how long a response stays fresh from its Cache-Control header
+    :param headers: Headers of the response
+    :return: Seconds (0 if the response has to be revalidated every time)
+    """
+    cache_control = headers.get("Cache-Control", "")
+    if "no-cache" in cache_control or "no-store" in cache_control:
+        return 0
+    match = re.search(r"max-age=(\d+)", cache_control)
+    return int(match.group(1)) if match else 0
+
+
+class HTTPCache:
+    """
+    Thread-safe, persistent cache of GitHub API responses with least recently used eviction once the size limit is reached
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIRECTORY, max_bytes=1024 * 1024 * 1024):
+        """
+        :param directory: Directory to store the cached responses in (created if it does not exist, it can be shared by several worker processes)
+        :param max_bytes: Maximum total size of the cached responses before the least recently used are evicted
+        """
+        self.directory = directory
+        self.store = DiskLRUCache(directory, max_bytes)
+        self.lock = threading.Lock()
+
+        # Counters used for the report (of this process): fresh hits (no request sent), 304 revalidations, and misses (full download)
+        self.hits = 0
+        self.not_modified = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(url):
+        """
+        Function to build the cache key for a request
+        :param url: Full URL of the request (built with request_url)
+        :return: Hex string of the SHA-256 hash of the URL
+        """
+        return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+    def lookup(self, url):
+        """
+        Function to read the cached entry of a request
+        :param url: Full URL of the request
+        :return: The cached entry dictionary, or None if the request is not cached
+        """
+        return self.store.get(self.make_key(url))
+
+    @staticmethod
+    def is_fresh(entry):
+        """
+        Function to check whether a cached entry can be used without asking GitHub
+        :param entry: Cached entry dictionary
+        :return: Boolean
+        """
+        return time.time() - entry['stored_at'] < entry['max_age']
+
+    @staticmethod
+    def conditional_headers(entry):
+        """
+        Function to build the headers of a conditional request for a cached entry
+        :param entry: Cached entry dictionary (or None)
+        :return: Dictionary of headers (empty if there is nothing to validate against)
+        """
+        headers = {}
+        if entry is not None:
+            if entry['headers'].get("ETag"):
+                headers["If-None-Match"] = entry['headers']["ETag"]
+            if entry['headers'].get("Last-Modified"):
+                headers["If-Modified-Since"] = entry['headers']["Last-Modified"]
+        return headers
+
+    @staticmethod
+    def to_response(entry):
+        """
+        Function to rebuild a response from a cached entry
+        :param entry: Cached entry dictionary
+        :return: requests.Response (status_code, headers, links, content and json() behave as for the original response)
+        """
+        response = requests.Response()
+        response.status_code = entry['status_code']
+        response.headers = CaseInsensitiveDict(entry['headers'])
+        response._content = entry['content']
+        response.url = entry['url']
+        response.encoding = "utf-8"
+        return response
+
+    def fresh_response(self, url):
+        """
+        Function to get a cached response which is still fresh, so no request has to be sent
+        :param url: Full URL of the request
+        :return: Tuple of the response (None if a request has to be sent) and the cached entry to validate against (or None)
+        """
+        entry = self.lookup(url)
+        if entry is not None and self.is_fresh(entry):
+            with self.lock:
+                self.hits += 1
+            return self.to_response(entry), entry
+        return None, entry
+
+    def handle_response(self, url, entry, response):
+        """
+        Function to store a downloaded response, or to return the cached response if GitHub answered 304 Not Modified
+        :param url: Full URL of the request
+        :param entry: Cached entry the conditional request was sent for (or None)
+        :param response: Response from GitHub (requests or httpx)
+        :return: The response to use (the cached response for a 304, otherwise the response from GitHub)
+        """
+        if response.status_code == 304 and entry is not None:
+            with self.lock:
+                self.not_modified += 1
+            # The cached body is still valid, start a new freshness period
+            entry['stored_at'] = time.time()
+            entry['max_age'] = max_age_seconds(response.headers)
+            self._store(url, entry)
+            return self.to_response(entry)
+
+        with self.lock:
+            self.misses += 1
+        # Only successful responses which can be validated later are cached
+        if response.status_code == 200 and ("ETag" in response.headers or "Last-Modified" in response.headers):
+            self._store(url, {
+                'url': url,
+                'status_code': response.status_code,
+                # The rate limit headers are not stored, they describe the budget at the time of the request
+                # (httpx lower cases the header names, so they are looked up without case)
+                'headers': CaseInsensitiveDict({name: value for name, value in response.headers.items() if not name.lower().startswith("x-ratelimit")}),
+                'content': response.content,
+                'stored_at': time.time(),
+                'max_age': max_age_seconds(response.headers)
+            })
+        return response
+
+    def _store(self, url, entry):
+        """
+        Function to write an entry to the cache, evicting the least recently used entries if needed
+        :param url: Full URL of the request
+        :param entry: Entry dictionary to store
+        :return: None
+        """
+        self.store.put(self.make_key(url), entry)
+
+    def close(self):
+        """
+        Function to close the connection to the index of the cache (it is opened again when the cache is next used)
+        Called before forking worker processes, so a SQLite connection is never carried into a forked process
+        :return: None
+        """
+        self.store.close()
+
+    def report(self):
+        """
+        Function to output the hit/304/miss statistics of the cache to the console
+        :return: None
+        """
+        lookups = self.hits + self.not_modified + self.misses
+        saved = ((self.hits + self.not_modified) / lookups * 100) if lookups else 0
+        entries, total_bytes = self.store.usage()
+        print("HTTP cache: " + str(self.hits) + " fresh hits, " + str(self.not_modified) + " not modified (304), " + str(self.misses)
+              + " misses (" + str(round(saved, 2)) + "% served from the cache), " + str(self.store.evictions) + " evictions, "
+              + str(entries) + " entries using " + str(round(total_bytes / 1024 / 1024, 2)) + " MB")
@@ -0,0 +1,287 @@
+"""
+This python file holds the SQLite work queue used to analyse the repositories with several workers
+Every repository is a row with its position in all_repositories.pkl and a state (pending, in_progress, done or failed).
+A worker claims a pending repository with a lease, so if the worker dies the repository is handed to another worker once the lease
+expires (a heartbeat renews the lease while the worker is busy, e.g. waiting for the rate limit), and stores the statistics and flagged items of the repository in the same transaction that marks it as done.
+Several worker processes (or machines sharing the database file) can work through the queue at the same time,
+and the results are exported to repo_stats.csv and flagged_repos.txt in the original repository order
+Usage: python repo_queue.py status [repo_queue.db]
+       python repo_queue.py retry [repo_queue.db] (puts the failed repositories back into the queue)
+"""
+import os, sys, csv, json, re, sqlite3, socket, time, threading
+
+# Default filepath of the queue database
+DEFAULT_QUEUE_FILEPATH = "./repo_queue.db"
+# Seconds a worker may work on a repository before another worker is allowed to take it over
+DEFAULT_LEASE_SECONDS = 30 * 60
+# Number of times a repository is attempted before it is left as failed
+DEFAULT_MAX_ATTEMPTS = 3
+
+# Repository states
+PENDING = "pending"
+IN_PROGRESS = "in_progress"
+DONE = "done"
+FAILED = "failed"
+
+
+def worker_name():
+    """
+    Function to build a name for the current worker, unique across processes and machines
+    :return: String 'hostname:pid'
+    """
+    return socket.gethostname() + ":" + str(os.getpid())
+
+
+class RepoQueue:
+    """
+    Durable queue of repositories to analyse, stored in a SQLite database with one row per repository
+    """
+
+    def __init__(self, filepath=DEFAULT_QUEUE_FILEPATH, lease_seconds=DEFAULT_LEASE_SECONDS, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        """
+        :param filepath: Filepath of the SQLite database (created if it does not exist)
+        :param lease_seconds: Seconds a claimed repository stays with its worker before it can be claimed again
+        :param max_attempts: Number of times a repository is attempted before it is left as failed
+        """
+        self.filepath = filepath
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        # Autocommit mode, every change is made in an explicit transaction below
+        self.connection = sqlite3.connect(filepath, timeout=60, isolation_level=None)
+        # Write ahead logging lets workers read the queue while another worker is writing to it
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS repos (
+                position INTEGER PRIMARY KEY,
+                name TEXT UNIQUE NOT NULL,
+                state TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                worker TEXT,
+                lease_expires REAL,
+                error TEXT,
+                statistics TEXT,
+                flagged TEXT
+            )""")
+
+    def close(self):
+        """
+        Function to close the connection to the database
+        :return: None
+        """
+        self.connection.close()
+
+    def add_repos(self, repo_names):
+        """
+        Function to add repositories to the queue (repositories which are already in the queue are left as they are)
+        :param repo_names: Array of repository names, in the order they should be exported
+        :return: Number of repositories added
+        """
+        with self.connection:
+            self.connection.execute("BEGIN IMMEDIATE")
+            before = self.connection.execute("SELECT COUNT(*) FROM repos").fetchone()[0]
+            self.connection.executemany("INSERT OR IGNORE INTO repos (position, name) VALUES (?, ?)", enumerate(repo_names))
+            return self.connection.execute("SELECT COUNT(*) FROM repos").fetchone()[0] - before
+
+    def reset(self):
+        """
+        Function to remove every repository and its results from the queue
+        :return: None
+        """
+        with self.connection:
+            self.connection.execute("DELETE FROM repos")
+
+    def claim(self, worker):
+        """
+        Function to claim the next repository to analyse: the first pending repository, or one whose lease has expired
+        :param worker: Name of the worker claiming the repository
+        :return: Tuple of (position, repository name), or None if there is nothing left to claim
+        """
+        now = time.time()
+        with self.connection:
+            # BEGIN IMMEDIATE takes the write lock, so two workers can never claim the same repository
+            self.connection.execute("BEGIN IMMEDIATE")
+            while True:
+                row = self.connection.execute(
+                    "SELECT position, name, attempts FROM repos WHERE state = ? OR (state = ? AND lease_expires < ?) ORDER BY position LIMIT 1",
+                    (PENDING, IN_PROGRESS, now)).fetchone()
+                if row is None:
+                    return None
+                position, name, attempts = row
+                if attempts < self.max_attempts:
+                    break
+                # The lease of the last attempt expired (the worker died), give up on the repository
+                self.connection.execute("UPDATE repos SET state = ?, error = ?, lease_expires = NULL WHERE position = ?",
+                                        (FAILED, "lease expired on the last attempt", position))
+            self.connection.execute("UPDATE repos SET state = ?, worker = ?, lease_expires = ?, attempts = attempts + 1 WHERE position = ?",
+                                    (IN_PROGRESS, worker, now + self.lease_seconds, position))
+            return position, name
+
+    def renew(self, position, worker):
+        """
+        Function to extend the lease of a claimed repository (for repositories which take longer than the lease)
+        :param position: Position of the repository
+        :param worker: Name of the worker holding the lease
+        :return: Boolean - False if the worker no longer holds the lease
+        """
+        with self.connection:
+            cursor = self.connection.execute("UPDATE repos SET lease_expires = ? WHERE position = ? AND state = ? AND worker = ?",
+                                             (time.time() + self.lease_seconds, position, IN_PROGRESS, worker))
+            return cursor.rowcount == 1
+
+    def complete(self, position, worker, statistics, flagged):
+        """
+        Function to store the results of a repository and mark it as done, in a single transaction
+        :param position: Position of the repository
+        :param worker: Name of the worker holding the lease
+        :param statistics: Array of the statistics row (as written to repo_stats.csv)
+        :param flagged: Array of the flagged items of the repository
+        :return: Boolean - False if the lease was lost to another worker (the results are then discarded)
+        """
+        with self.connection:
+            cursor = self.connection.execute(
+                "UPDATE repos SET state = ?, statistics = ?, flagged = ?, error = NULL, lease_expires = NULL "
+                "WHERE position = ? AND state = ? AND worker = ?",
+                (DONE, json.dumps(statistics), json.dumps(flagged), position, IN_PROGRESS, worker))
+            return cursor.rowcount == 1
+
+    def fail(self, position, worker, error):
+        """
+        Function to record an error for a repository, it is put back into the queue unless it has used all of its attempts
+        :param position: Position of the repository
+        :param worker: Name of the worker holding the lease
+        :param error: Description of the error
+        :return: None
+        """
+        with self.connection:
+            self.connection.execute(
+                "UPDATE repos SET state = CASE WHEN attempts >= ? THEN ? ELSE ? END, error = ?, lease_expires = NULL "
+                "WHERE position = ? AND state = ? AND worker = ?",
+                (self.max_attempts, FAILED, PENDING, error, position, IN_PROGRESS, worker))
+
+    def retry_failed(self):
+        """
+        Function to put the failed repositories back into the queue with a fresh set of attempts
+        :return: Number of repositories put back
+        """
+        with self.connection:
+            return self.connection.execute("UPDATE repos SET state = ?, attempts = 0 WHERE state = ?", (PENDING, FAILED)).rowcount
+
+    def counts(self):
+        """
+        Function to count the repositories in each state
+        :return: Dictionary of state -> number of repositories
+        """
+        counts = {PENDING: 0, IN_PROGRESS: 0, DONE: 0, FAILED: 0}
+        for state, count in self.connection.execute("SELECT state, COUNT(*) FROM repos GROUP BY state"):
+            counts[state] = count
+        return counts
+
+    def done_results(self):
+        """
+        Function to read the results of the analysed repositories
+        :return: Array of (repository name, statistics row, flagged items) tuples, in the original repository order
+        """
+        rows = self.connection.execute("SELECT name, statistics, flagged FROM repos WHERE state = ? ORDER BY position", (DONE,))
+        return [(name, json.loads(statistics), json.loads(flagged)) for name, statistics, flagged in rows]
+
+    def import_legacy_results(self, stats_filepath, flagged_filepath):
+        """
+        Function to mark the repositories already in repo_stats.csv (from a run before the queue was used) as done
+        The flagged items are read back from flagged_repos.txt (their text is not stored there, so only the keyword, id and place remain)
+        :param stats_filepath: Filepath of the existing repo_stats.csv
+        :param flagged_filepath: Filepath of the existing flagged_repos.txt
+        :return: Number of repositories marked as done
+        """
+        flagged = {}
+        if os.path.exists(flagged_filepath):
+            repo_name = None
+            with open(flagged_filepath, "r") as my_file:
+                for line in my_file:
+                    match = re.match(r"    '(.*)' found in (\w+): (.*)$", line.rstrip("\n"))
+                    if match:
+                        flagged.setdefault(repo_name, []).append([match.group(1), None, match.group(3), match.group(2)])
+                    elif line.strip():
+                        repo_name = line.strip()
+
+        imported = 0
+        with open(stats_filepath, mode='r', newline='', encoding='utf-8') as my_file:
+            rows = list(csv.reader(my_file))[1:]
+        with self.connection:
+            self.connection.execute("BEGIN IMMEDIATE")
+            for row in rows:
+                statistics = [row[0]] + [int(value) for value in row[1:]]
+                imported += self.connection.execute(
+                    "UPDATE repos SET state = ?, statistics = ?, flagged = ? WHERE name = ? AND state != ?",
+                    (DONE, json.dumps(statistics), json.dumps(flagged.get(row[0], [])), row[0], DONE)).rowcount
+        return imported
+
+    def report(self):
+        """
+        Function to output the number of repositories in each state to the console
+        :return: None
+        """
+        counts = self.counts()
+        print("Repository queue: " + ", ".join(str(count) + " " + state for state, count in counts.items()))
+        for name, error in self.connection.execute("SELECT name, error FROM repos WHERE state = ? ORDER BY position", (FAILED,)):
+            print("    Failed: " + name + " - " + str(error))
+
+
+class LeaseHeartbeat:
+    """
+    Background thread which keeps renewing the lease of a claimed repository while its worker is analysing it, so a repository which takes
+    longer than the lease (e.g. while the worker sleeps until the GitHub rate limit resets) is not taken over by another worker
+    Usage: with LeaseHeartbeat(queue_filepath, position, worker) as heartbeat: ... (heartbeat.lost is True if the lease was taken over)
+    """
+
+    def __init__(self, queue_filepath, position, worker, lease_seconds=DEFAULT_LEASE_SECONDS, interval=None):
+        """
+        :param queue_filepath: Filepath of the queue database (the thread opens its own connection, SQLite connections are not shared between threads)
+        :param position: Position of the claimed repository
+        :param worker: Name of the worker holding the lease
+        :param lease_seconds: Seconds each renewal extends the lease by
+        :param interval: Seconds between renewals (defaults to a third of the lease, so two renewals can fail before it expires)
+        """
+        self.queue_filepath = queue_filepath
+        self.position = position
+        self.worker = worker
+        self.lease_seconds = lease_seconds
+        self.interval = interval if interval is not None else lease_seconds / 3
+        self.renewals = 0
+        self.lost = False
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        queue = RepoQueue(self.queue_filepath, lease_seconds=self.lease_seconds)
+        try:
+            while not self.stopped.wait(self.interval):
+                try:
+                    if not queue.renew(self.position, self.worker):
+                        # Another worker has taken the repository over, there is nothing left to renew
+                        self.lost = True
+                        return
+                    self.renewals += 1
+                except sqlite3.Error as error:
+                    # The database is busy, try again at the next interval (the lease still has time left)
+                    print("Could not renew the lease of repository " + str(self.position) + ": " + repr(error))
+        finally:
+            queue.close()
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.thread.join()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) >= 2 and sys.argv[1] in ("status", "retry"):
+        queue = RepoQueue(sys.argv[2] if len(sys.argv) >= 3 else DEFAULT_QUEUE_FILEPATH)
+        if sys.argv[1] == "retry":
+            print("Put " + str(queue.retry_failed()) + " failed repositories back into the queue")
+        queue.report()
+        queue.close()
+    else:
+        print(__doc__)
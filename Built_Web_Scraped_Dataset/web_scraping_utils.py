@@ -1,17 +1,467 @@
-import requests, os, csv
+import requests, os, csv, threading, asyncio, time, math
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse, parse_qs
+import httpx
+from requests.adapters import HTTPAdapter
+from http_cache import HTTPCache, DEFAULT_CACHE_DIRECTORY, request_url
 
-def make_request(url, filters={}):
+# Default (connect, read) timeouts in seconds for requests to the GitHub API
+DEFAULT_TIMEOUT = (10, 60)
+# Default number of keep-alive connections kept open per host
+DEFAULT_POOL_SIZE = 8
+
+# Seconds to wait after a secondary rate limit which does not say how long to wait (GitHub asks for at least a minute)
+SECONDARY_LIMIT_WAIT = 60
+# Number of times a rate limited request is sent again before its response is returned as it is
+MAX_RATE_LIMIT_RETRIES = 5
+
+# Shared session used by make_request (created on first use), so connections are reused between requests
+_session = None
+_session_timeout = DEFAULT_TIMEOUT
+_session_lock = threading.Lock()
+
+# Shared limiter of the async requests (created on first use), so every batch of concurrent requests stays under one limit
+_async_limiter = None
+_async_limiter_lock = threading.Lock()
+
+# Shared on-disk HTTP cache (None until enable_http_cache is called)
+_http_cache = None
+
+
+def github_headers():
+    """
+    Function to build the headers sent with every request to the github api
+    :return: Dictionary of headers (the token is read from the 'GITHUB_KEY' environment variable)
+    """
+    return {
+        "Authorization": "token " + os.environ["GITHUB_KEY"],
+        "User-Agent": "Mozilla/5.0"
+    }
+
+
+def rate_limit_resource(url):
+    """
+    Function to find which github api rate limit a request counts against (the search api has its own, much smaller, limit)
+    :param url: URL of the request
+    :return: 'search' or 'core'
+    """
+    return "search" if "/search/" in url else "core"
+
+
+def retry_after_seconds(value):
+    """
+    Function to read the number of seconds to wait from a Retry-After header, which is either a number of seconds or an HTTP date
+    :param value: Value of the Retry-After header
+    :return: Number of seconds to wait, or None if the value cannot be read
+    """
+    try:
+        seconds = float(value)
+        # A value such as 'inf' or 'nan' is not a usable wait
+        return max(0.0, seconds) if math.isfinite(seconds) else None
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class GitHubRateLimitScheduler:
+    """
+    Thread-safe scheduler which decides when a request to the github api may be sent, from the rate limit headers of earlier responses
+    Requests are sent as fast as the remaining budget allows, and only wait when a limit has been used up
+    (until its X-RateLimit-Reset time) or when github asked for a pause with Retry-After (secondary rate limits)
+    """
+
+    def __init__(self, reserve=0, secondary_wait=SECONDARY_LIMIT_WAIT, max_retries=MAX_RATE_LIMIT_RETRIES):
+        """
+        :param reserve: Number of requests to leave unused in each limit (e.g. for other tools sharing the token)
+        :param secondary_wait: Seconds to wait after a secondary rate limit without a Retry-After header (doubled each time in a row)
+        :param max_retries: Number of times a rate limited request is retried
+        """
+        self.reserve = reserve
+        self.secondary_wait = secondary_wait
+        self.max_retries = max_retries
+        # Resource name -> (remaining requests, epoch time the limit resets)
+        self.limits = {}
+        # Epoch time before which no request may be sent (set by Retry-After / secondary rate limits)
+        self.paused_until = 0
+        self.secondary_limits_in_a_row = 0
+        self.waited_seconds = 0
+        self.rate_limited_responses = 0
+        self.lock = threading.Lock()
+
+    def delay(self, url):
+        """
+        Function to work out how long to wait before a request may be sent, reserving a request from the remaining budget
+        :param url: URL of the request
+        :return: Seconds to wait (0 if the request can be sent straight away)
+        """
+        resource = rate_limit_resource(url)
+        with self.lock:
+            now = time.time()
+            wait = max(0, self.paused_until - now)
+            if resource in self.limits:
+                remaining, reset = self.limits[resource]
+                if reset <= now:
+                    # The limit has reset since the last response, the next response will report the new budget
+                    del self.limits[resource]
+                elif remaining <= self.reserve:
+                    # The budget is used up, wait until it resets (plus a second for clock differences)
+                    wait = max(wait, reset - now + 1)
+                else:
+                    # Count this request against the budget, so concurrent requests do not all spend the last request
+                    self.limits[resource] = (remaining - 1, reset)
+            self.waited_seconds += wait
+            return wait
+
+    def wait(self, url):
+        """
+        Function to block until a request may be sent
+        :param url: URL of the request
+        :return: None
+        """
+        wait = self.delay(url)
+        if wait > 0:
+            print("Waiting " + str(round(wait)) + " seconds for the GitHub " + rate_limit_resource(url) + " rate limit")
+            time.sleep(wait)
+
+    def update(self, url, response):
+        """
+        Function to record the rate limit headers of a response
+        :param url: URL of the request
+        :param response: Response (requests or httpx)
+        :return: True if the request was rejected by a rate limit and should be sent again, False otherwise
+        """
+        headers = response.headers
+        with self.lock:
+            now = time.time()
+            if "X-RateLimit-Remaining" in headers and "X-RateLimit-Reset" in headers:
+                resource = headers.get("X-RateLimit-Resource", rate_limit_resource(url))
+                self.limits[resource] = (int(headers["X-RateLimit-Remaining"]), int(headers["X-RateLimit-Reset"]))
+
+            if response.status_code not in (403, 429):
+                self.secondary_limits_in_a_row = 0
+                return False
+            retry_after = retry_after_seconds(headers["Retry-After"]) if "Retry-After" in headers else None
+            if retry_after is not None:
+                # Secondary rate limit with an explicit pause
+                self.paused_until = max(self.paused_until, now + retry_after)
+            elif headers.get("X-RateLimit-Remaining") == "0":
+                # Primary rate limit, delay() waits for the reset time recorded above
+                pass
+            elif response.status_code == 429 or "Retry-After" in headers or "rate limit" in response.text.lower():
+                # Secondary rate limit without a (readable) Retry-After header, back off exponentially
+                self.paused_until = max(self.paused_until, now + self.secondary_wait * 2 ** self.secondary_limits_in_a_row)
+                self.secondary_limits_in_a_row += 1
+            else:
+                # A 403 which is not a rate limit (e.g. a forbidden repository), do not retry
+                return False
+            self.rate_limited_responses += 1
+            return True
+
+
+# Scheduler shared by make_request and the async client, so every scraper stays under the same limits
+rate_limit_scheduler = GitHubRateLimitScheduler()
+
+
+def configure_session(timeout=DEFAULT_TIMEOUT, pool_size=DEFAULT_POOL_SIZE):
+    """
+    Function to (re)create the shared session used by make_request
+    :param timeout: (connect, read) timeout in seconds, or a single number used for both
+    :param pool_size: Number of keep-alive connections kept open per host (raise this when requesting from several threads)
+    :return: The shared requests.Session
+    """
+    global _session, _session_timeout
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+        _session = requests.Session()
+        _session.headers.update(github_headers())
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        _session.mount("https://", adapter)
+        _session.mount("http://", adapter)
+        _session_timeout = timeout
+    return _session
+
+
+def close_session():
+    """
+    Function to close the shared session and its connections (a new one is created by the next make_request)
+    :return: None
+    """
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
+
+
+def enable_http_cache(directory=DEFAULT_CACHE_DIRECTORY, max_bytes=1024 * 1024 * 1024):
+    """
+    Function to cache the responses of make_request and the async client on disk, and to send conditional requests for cached responses
+    :param directory: Directory to store the cached responses in
+    :param max_bytes: Maximum total size of the cached responses before the least recently used are evicted
+    :return: The shared HTTPCache (call report() on it to output the hit/304/miss counts)
+    """
+    global _http_cache
+    _http_cache = HTTPCache(directory, max_bytes)
+    return _http_cache
+
+
+def close_http_cache():
+    """
+    Function to close the connection to the index of the shared HTTP cache before forking worker processes (the cache stays enabled)
+    :return: None
+    """
+    if _http_cache is not None:
+        _http_cache.close()
+
+
+def make_request(url, filters={}, timeout=None):
     """
     function to make the request to the github api and return results
     :param url: URL to send the request to
     :param filters: Any filters to send with the request (defaults to no filters)
+    :param timeout: (connect, read) timeout in seconds for this request (defaults to the timeout of the shared session)
     :return: Request result
     """
-    headers = {
-        "Authorization": "token " + os.environ["GITHUB_KEY"],
-        "User-Agent": "Mozilla/5.0"
-    }
-    return requests.get(url, headers=headers, params=filters)
+    session = _session if _session is not None else configure_session()
+
+    # Return a fresh cached response straight away, otherwise ask GitHub whether the cached response has changed
+    cache = _http_cache
+    entry = None
+    if cache is not None:
+        full_url = request_url(url, filters)
+        cached_response, entry = cache.fresh_response(full_url)
+        if cached_response is not None:
+            return cached_response
+    headers = HTTPCache.conditional_headers(entry)
+
+    for attempt in range(rate_limit_scheduler.max_retries + 1):
+        # Wait only if a rate limit has been used up, and send the request again if it was rejected by a rate limit
+        rate_limit_scheduler.wait(url)
+        response = session.get(url, params=filters, headers=headers, timeout=timeout if timeout is not None else _session_timeout)
+        if not rate_limit_scheduler.update(url, response):
+            break
+        print("Rate limited by GitHub (status " + str(response.status_code) + "), retrying " + url)
+
+    if cache is not None:
+        # Store the new response, or swap a 304 Not Modified for the cached response
+        response = cache.handle_response(full_url, entry, response)
+    return response
+
+
+class AsyncRequestLimiter:
+    """
+    Limit for the async clients: at most 'max_in_flight' requests at once and at most 'requests_per_second' started per second
+    Every make_requests call runs its own event loop (and fetch_all_pages may be called from several threads), so the limiter
+    uses thread locks instead of asyncio primitives and one limiter keeps every client of the process under the same limit
+    """
+
+    def __init__(self, max_in_flight=DEFAULT_POOL_SIZE, requests_per_second=None, poll_interval=0.01):
+        """
+        :param max_in_flight: Maximum number of requests waiting for a response at the same time
+        :param requests_per_second: Maximum number of requests started per second (None for no limit)
+        :param poll_interval: Seconds a request waits (without blocking its event loop) before checking again for a free slot
+        """
+        self.max_in_flight = max_in_flight
+        self.interval = 1 / requests_per_second if requests_per_second else 0
+        self.poll_interval = poll_interval
+        self.in_flight = 0
+        self.next_start = 0
+        self.lock = threading.Lock()
+
+    async def __aenter__(self):
+        # Wait for a free slot
+        while True:
+            with self.lock:
+                if self.in_flight < self.max_in_flight:
+                    self.in_flight += 1
+                    break
+            await asyncio.sleep(self.poll_interval)
+        if self.interval:
+            # Reserve the next start slot, then wait for it outside the lock
+            with self.lock:
+                now = time.monotonic()
+                wait = self.next_start - now
+                self.next_start = max(now, self.next_start) + self.interval
+            if wait > 0:
+                await asyncio.sleep(wait)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        with self.lock:
+            self.in_flight -= 1
+
+
+def configure_async_limiter(max_in_flight=DEFAULT_POOL_SIZE, requests_per_second=None):
+    """
+    Function to set the limits shared by every async request of the process (make_requests, fetch_all_pages and AsyncGitHubClient)
+    :param max_in_flight: Maximum number of requests in flight at once across the process
+    :param requests_per_second: Maximum number of requests started per second across the process (None for no limit)
+    :return: The shared AsyncRequestLimiter
+    """
+    global _async_limiter
+    with _async_limiter_lock:
+        _async_limiter = AsyncRequestLimiter(max_in_flight, requests_per_second)
+    return _async_limiter
+
+
+def get_async_limiter():
+    """
+    Function to get the limiter shared by every async request of the process (created with the default limits on first use)
+    :return: The shared AsyncRequestLimiter
+    """
+    with _async_limiter_lock:
+        if _async_limiter is not None:
+            return _async_limiter
+    return configure_async_limiter()
+
+
+class AsyncGitHubClient:
+    """
+    Async client for the github api, many requests can be in flight at once (over pooled keep-alive connections) under a global limiter
+    Usage: async with AsyncGitHubClient() as client: responses = await client.request_all([(url, filters), ...])
+    """
+
+    def __init__(self, max_in_flight=None, requests_per_second=None, timeout=DEFAULT_TIMEOUT, limiter=None, scheduler=None, cache=None):
+        """
+        :param max_in_flight: Maximum number of requests in flight for this client only (None to use the limiter shared by the process)
+        :param requests_per_second: Maximum number of requests started per second for this client only (None to use the shared limiter)
+        :param timeout: (connect, read) timeout in seconds, or a single number used for both
+        :param limiter: AsyncRequestLimiter to use (defaults to the limiter shared by the process, see configure_async_limiter,
+            unless limits for this client are given above)
+        :param scheduler: GitHubRateLimitScheduler following the github rate limit headers (defaults to the one shared with make_request)
+        :param cache: HTTPCache to use (defaults to the one shared with make_request, if enable_http_cache was called)
+        """
+        self.scheduler = scheduler if scheduler is not None else rate_limit_scheduler
+        self.cache = cache if cache is not None else _http_cache
+        connect_timeout, read_timeout = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+        if limiter is None:
+            if max_in_flight is not None or requests_per_second is not None:
+                limiter = AsyncRequestLimiter(max_in_flight or DEFAULT_POOL_SIZE, requests_per_second)
+            else:
+                limiter = get_async_limiter()
+        self.limiter = limiter
+        # The connection pool only needs as many connections as the limiter lets requests be in flight
+        self.client = httpx.AsyncClient(
+            headers=github_headers(),
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=limiter.max_in_flight, max_keepalive_connections=limiter.max_in_flight),
+            # requests follows redirects by default, keep the same behaviour as make_request
+            follow_redirects=True
+        )
+
+    async def request(self, url, filters=None):
+        """
+        Function to make a single request to the github api once the limiter and the rate limit scheduler allow it
+        :param url: URL to send the request to
+        :param filters: Any filters to send with the request
+        :return: httpx.Response, or requests.Response if it came from the cache (both have status_code, headers, links and json())
+        """
+        # Return a fresh cached response straight away, otherwise ask GitHub whether the cached response has changed
+        entry = None
+        if self.cache is not None:
+            full_url = request_url(url, filters)
+            cached_response, entry = self.cache.fresh_response(full_url)
+            if cached_response is not None:
+                return cached_response
+        headers = HTTPCache.conditional_headers(entry)
+
+        for attempt in range(self.scheduler.max_retries + 1):
+            # Wait (without blocking the event loop) only if a rate limit has been used up
+            wait = self.scheduler.delay(url)
+            if wait > 0:
+                await asyncio.sleep(wait)
+            async with self.limiter:
+                response = await self.client.get(url, params=filters, headers=headers)
+            if not self.scheduler.update(url, response):
+                break
+
+        if self.cache is not None:
+            response = self.cache.handle_response(full_url, entry, response)
+        return response
+
+    async def request_all(self, url_filters):
+        """
+        Function to make many requests concurrently
+        :param url_filters: Array of (url, filters) tuples
+        :return: Array of responses, in the same order as the requests
+        """
+        return await asyncio.gather(*(self.request(url, filters) for url, filters in url_filters))
+
+    async def close(self):
+        """
+        Function to close the connections of the client
+        :return: None
+        """
+        await self.client.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+
+def make_requests(url_filters, timeout=DEFAULT_TIMEOUT, limiter=None):
+    """
+    Function to make many requests to the github api concurrently from synchronous code
+    :param url_filters: Array of (url, filters) tuples
+    :param timeout: (connect, read) timeout in seconds
+    :param limiter: AsyncRequestLimiter to use (defaults to the limiter shared by the process, so concurrent calls stay under one limit)
+    :return: Array of responses, in the same order as the requests
+    """
+    async def request_all():
+        async with AsyncGitHubClient(timeout=timeout, limiter=limiter) as client:
+            return await client.request_all(url_filters)
+    return asyncio.run(request_all())
+
+
+def last_page_number(response):
+    """
+    Function to read the number of pages of a paginated github api response from its Link header
+    :param response: Response to the request for page 1
+    :return: Number of the last page (1 if the response has no rel="last" link, i.e. there is only one page)
+    """
+    if "last" not in response.links:
+        return 1
+    return int(parse_qs(urlparse(response.links["last"]["url"]).query)["page"][0])
+
+
+def fetch_all_pages(url, filters, max_pages=None, limiter=None):
+    """
+    Function to read every page of a paginated github api endpoint
+    Page 1 is requested first to learn the number of pages from its Link header, the remaining pages are then requested concurrently
+    :param url: URL of the endpoint
+    :param filters: Filters to send with every request (the 'page' filter is added)
+    :param max_pages: Maximum number of pages to read (None for every page)
+    :param limiter: AsyncRequestLimiter of the page requests (defaults to the limiter shared by the process)
+    :return: Array of the items of every page, in page order
+    """
+    # Request the first page and find the number of pages
+    response = make_request(url, dict(filters, page=1))
+    if response.status_code != 200:
+        # If the status is not 200, there was an error, display the status code
+        print("Error reading repositories - Status: " + str(response.status_code))
+        return []
+    items = response.json()
+    last_page = last_page_number(response)
+    if max_pages is not None:
+        last_page = min(last_page, max_pages)
+
+    # Request the remaining pages concurrently, keeping the items in page order
+    responses = []
+    if last_page > 1:
+        responses = make_requests([(url, dict(filters, page=page)) for page in range(2, last_page + 1)], limiter=limiter)
+    for response in responses:
+        if response.status_code == 200:
+            items += response.json()
+        else:
+            print("Error reading repositories - Status: " + str(response.status_code))
+    return items
+
 
 def generate_avg_stats(filepath):
     """
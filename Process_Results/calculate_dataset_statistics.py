@@ -7,6 +7,9 @@ from categorize import categorize
 from deprecated_terms import initial_deprecated_search_terms, secondary_deprecated_search_terms
 # pip install numpy, matplotlib
 
+# Columns of the dataset used by calc_length_and_keyword_stats (the function names are not needed)
+STATISTICS_COLUMNS = ['java_8_function.length', 'java_8_function.string', 'java_11_function.length', 'java_11_function.string']
+
 def extract_function_parameters(function_string):
     """
     Function to extract function parameters from a java function
@@ -233,7 +236,7 @@ if __name__ == "__main__":
     # Process the secondary dataset
     print("Processing the Secondary Dataset")
     # Read the dataset from the pickle file
-    secondary_dataset = read_dataset("./../Shared_Files/secondary_dataset.pkl")
+    secondary_dataset = read_dataset("./../Shared_Files/secondary_dataset.pkl", columns=STATISTICS_COLUMNS)
     # Output the total number of functions
     print("Total Number of Functions: " + str(len(secondary_dataset)))
     # Calculate the statistics using the calc_length_and_keyword_stats function
@@ -249,8 +252,8 @@ if __name__ == "__main__":
     # Process the full dataset
     print("\n\n\nProcessing the Full Dataset")
     # Read the same param and different param dataset pickle files
-    same_param_functions = read_dataset("./../Shared_Files/web_scraped_ds_same_params.pkl")
-    different_param_functions = read_dataset("./../Shared_Files/web_scraped_ds_diff_params.pkl")
+    same_param_functions = read_dataset("./../Shared_Files/web_scraped_ds_same_params.pkl", columns=STATISTICS_COLUMNS)
+    different_param_functions = read_dataset("./../Shared_Files/web_scraped_ds_diff_params.pkl", columns=STATISTICS_COLUMNS)
     # Combine the two datasets into one
     combined_dataset = same_param_functions + different_param_functions
     # Output the total number of functions across both datasets and for each dataset
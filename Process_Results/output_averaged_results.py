@@ -5,9 +5,14 @@ from categorize import categorize
 from deprecated_terms import secondary_deprecated_search_terms
 import matplotlib.pyplot as plt
 
+# Columns of the results dataset used by get_avg_stats and calc_keyword_removal_success
+AVERAGE_STATS_COLUMNS = ['name', 'java_8_11_comparison', 'java_11_11_comparison']
+KEYWORD_REMOVAL_COLUMNS = ['java_8_function.string', 'generated_java_11_string']
 
-def read_results(filepath):
-    return read_dataset(filepath)
+
+def read_results(filepath, columns=None):
+    # Only the projected columns are read (the results are converted to the columnar format on the first read)
+    return read_dataset(filepath, columns=columns)
 
 def plot_keyword_removal_bar_chart(keyword_analysis):
     """
@@ -74,7 +79,7 @@ def calc_keyword_removal_success(filepath, deprecated_search_terms):
     :return: None
     """
     # Read the results dataset from the pkl file
-    data_array = read_results(filepath)
+    data_array = read_results(filepath, KEYWORD_REMOVAL_COLUMNS)
 
     # Initialise counters for the total number of functions and successfully migrated functions
     total_count = 0
@@ -162,7 +167,7 @@ def get_avg_stats(model_name, filepaths):
     # Read the results dataset from the pickle file
     data_array = []
     for path in filepaths:
-        data_array = data_array + read_results(path)
+        data_array = data_array + read_results(path, AVERAGE_STATS_COLUMNS)
 
     # Initialise arrays to store prefect match functions, or functions where codebleu measurements were not available
     complete_match_functions = []
@@ -0,0 +1,86 @@
+"""
+This python file computes the baseline CodeBLEU scores (Java 8 function vs true Java 11 function) for a dataset
+The baseline does not depend on the model being evaluated, so it is computed once per dataset version and stored
+next to the dataset, where the prompting pipeline reuses it instead of recalculating it on every run
+"""
+import os, pickle, hashlib
+from codebleu import calc_codebleu
+from Shared_Files.utils import read_dataset, pair_key
+
+
+def baseline_scores_filepath(dataset_filepath):
+    """
+    Function to get the filepath the baseline scores of a dataset are stored to
+    :param dataset_filepath: Filepath of the dataset pkl file
+    :return: Filepath of the baseline scores pkl file (stored next to the dataset)
+    """
+    return os.path.splitext(dataset_filepath)[0] + "_baseline_scores.pkl"
+
+
+def dataset_version(dataset):
+    """
+    Function to calculate a version hash of a dataset from the content of its function pairs
+    :param dataset: Dataset (that has already been de-serialized)
+    :return: Hex string of the SHA-256 hash of all the function pairs, in dataset order
+    """
+    version = hashlib.sha256()
+    for data_item in dataset:
+        version.update(pair_key(data_item).encode("utf-8"))
+    return version.hexdigest()
+
+
+def compute_baseline_score(data_item):
+    """
+    Function to calculate the CodeBLEU comparison between the Java 8 function and the true Java 11 function
+    :param data_item: Data item from the dataset
+    :return: Dictionary of CodeBLEU metrics
+    """
+    return calc_codebleu(predictions=[data_item['java_8_function']['string']],
+                         references=[data_item['java_11_function']['string']], lang="java")
+
+
+def load_baseline_scores(dataset, dataset_filepath):
+    """
+    Function to load the stored baseline scores of a dataset, computing (and storing) any that are missing
+    Scores are keyed by the content hash of the function pair, so edited items are recomputed and unchanged items are reused
+    :param dataset: Dataset (that has already been de-serialized)
+    :param dataset_filepath: Filepath of the dataset pkl file (the scores are stored next to it)
+    :return: Dictionary of pair key -> CodeBLEU metrics for every item in the dataset
+    """
+    scores_filepath = baseline_scores_filepath(dataset_filepath)
+    version = dataset_version(dataset)
+
+    # Read the stored scores if they exist
+    scores = {}
+    if os.path.exists(scores_filepath):
+        with open(scores_filepath, "rb") as my_file:
+            stored = pickle.load(my_file)
+        scores = stored['scores']
+        if stored['dataset_version'] == version:
+            print("Loaded baseline scores for " + str(len(dataset)) + " data items from " + scores_filepath)
+            return scores
+        print("Dataset has changed since " + scores_filepath + " was stored, updating the baseline scores")
+
+    # Compute the scores for any function pairs which are not already stored
+    computed = 0
+    for data_item in dataset:
+        key = pair_key(data_item)
+        if key not in scores:
+            scores[key] = compute_baseline_score(data_item)
+            computed += 1
+    print("Computed " + str(computed) + " baseline scores")
+
+    # Only keep the scores of the current dataset version and store them next to the dataset
+    scores = {pair_key(data_item): scores[pair_key(data_item)] for data_item in dataset}
+    with open(scores_filepath, "wb") as my_file:
+        pickle.dump({'dataset_version': version, 'scores': scores}, my_file)
+        print("Stored baseline scores to " + scores_filepath)
+    return scores
+
+
+if __name__ == '__main__':
+    # Compute the baseline scores for every dataset so that the prompting pipeline can reuse them
+    for filepath in ['./../Shared_Files/synthetic_dataset.pkl',
+                     './../Shared_Files/web_scraped_ds_same_params.pkl',
+                     './../Shared_Files/web_scraped_ds_diff_params.pkl']:
+        load_baseline_scores(read_dataset(filepath, silent=False), filepath)
@@ -0,0 +1,228 @@
+"""
+This python file runs the prompting pipeline in two offline phases using provider batch endpoints (cheaper and with higher limits)
+Phase 1 exports the prompt of every data item to a JSONL batch request file, each request has a stable custom_id built from the function
+Phase 2 ingests the JSONL response file of the finished batch job and joins the responses back to the data items by their custom_id,
+the generated code is then extracted, scored and stored by run_program in the same way as a synchronous run
+Requests which failed inside the batch job are left out of the results and written to a new request file for resubmission
+run_fake_batch_job is a local file-based stand-in for the batch endpoint, so both phases can be run end to end offline
+Usage: python batch_jobs.py export dataset.pkl requests.jsonl
+       python batch_jobs.py ingest dataset.pkl responses.jsonl results.pkl
+       python batch_jobs.py fake requests.jsonl responses.jsonl
+"""
+import sys, os, json, hashlib, time
+from Shared_Files.utils import read_dataset
+from llm_clients import LLMRequestError
+from prompting_pipeline import get_prompt_messages, extract_java_code, run_program
+from metrics import get_active_record
+
+
+class BatchRequestFailed(LLMRequestError):
+    """
+    Exception raised for a data item whose request failed inside the batch job (the job has finished, so it is not retried here,
+    the request has to be resubmitted in a new batch job)
+    """
+    # Looking up a stored response again gives the same failure, so RetryPolicy never retries it (whatever its status code)
+    retryable = False
+
+
+def custom_id(java_8_string, function_name):
+    """
+    Function to build the stable custom_id of a batch request
+    The id only depends on the function, so it is the same every time the dataset is exported
+    :param java_8_string: The Java 8 string included in the prompt
+    :param function_name: Name of the function being migrated
+    :return: String custom_id (function name followed by a hash of the Java 8 code)
+    """
+    return function_name + "-" + hashlib.sha256(java_8_string.encode("utf-8")).hexdigest()[:16]
+
+
+def export_batch_requests(dataset, filepath, temperature=0, max_tokens=2048, template="default"):
+    """
+    Function to write the prompt of every data item to a JSONL batch request file (in the Mistral batch format)
+    The model is chosen when the batch job is created, so it is not included in the requests
+    :param dataset: Dataset (that has already been de-serialized)
+    :param filepath: Filepath of the JSONL batch request file
+    :param temperature: Sampling temperature
+    :param max_tokens: Maximum number of tokens to generate
+    :param template: Name of the prompt template to use (a key of PROMPT_TEMPLATES)
+    :return: Number of requests written
+    """
+    written = set()
+    with open(filepath, "w", encoding="utf-8") as my_file:
+        for data_item in dataset:
+            java_8_string = data_item['java_8_function']['string']
+            request_id = custom_id(java_8_string, data_item['name'])
+            # Identical functions share a request (custom_ids must be unique within a batch)
+            if request_id in written:
+                continue
+            written.add(request_id)
+            my_file.write(json.dumps({
+                "custom_id": request_id,
+                "body": {
+                    "messages": get_prompt_messages(java_8_string, template),
+                    "temperature": temperature,
+                    "max_tokens": max_tokens
+                }
+            }) + "\n")
+    print("Exported " + str(len(written)) + " batch requests (" + str(len(dataset)) + " data items) to " + filepath)
+    return len(written)
+
+
+def load_batch_responses(filepath):
+    """
+    Function to read a JSONL batch response file
+    :param filepath: Filepath of the JSONL batch response file
+    :return: Dictionary of custom_id -> response dictionary (in the same shape as LLMBackend.complete) or the error of the request
+    """
+    responses = {}
+    with open(filepath, "r", encoding="utf-8") as my_file:
+        for line in my_file:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            response = entry.get("response") or {}
+            status_code = response.get("status_code")
+            if entry.get("error") or status_code != 200:
+                # Keep the failure, so the data item is reported as failed instead of missing
+                responses[entry["custom_id"]] = BatchRequestFailed("Batch request failed: " + json.dumps(entry.get("error") or response.get("body")), status_code)
+                continue
+            body = response["body"]
+            usage = body.get("usage") or {}
+            responses[entry["custom_id"]] = {
+                'content': body["choices"][0]["message"]["content"],
+                'finish_reason': body["choices"][0].get("finish_reason"),
+                'prompt_tokens': usage.get("prompt_tokens"),
+                'completion_tokens': usage.get("completion_tokens"),
+                'status_code': status_code
+            }
+    print("Loaded " + str(len(responses)) + " batch responses from " + filepath)
+    return responses
+
+
+def make_batch_prompt_function(responses):
+    """
+    Function to build a prompt function (for run_program) which answers with the responses of a finished batch job
+    :param responses: Dictionary of custom_id -> response (from load_batch_responses)
+    :return: Function which takes the Java 8 string and function name and returns the generated Java 11 string
+    """
+    def prompt_function(java_8_string, function_name):
+        request_id = custom_id(java_8_string, function_name)
+        if request_id not in responses:
+            raise BatchRequestFailed("No batch response for " + request_id, 404)
+        response = responses[request_id]
+        record = get_active_record()
+        if isinstance(response, BatchRequestFailed):
+            if record is not None:
+                record['status_code'] = response.status_code
+            raise response
+        # Record the token usage and status of the request
+        if record is not None:
+            record['prompt_tokens'] = response['prompt_tokens']
+            record['completion_tokens'] = response['completion_tokens']
+            record['status_code'] = response['status_code']
+        return extract_java_code(response['content'])
+    return prompt_function
+
+
+def ingest_batch_responses(dataset, responses_filepath, output_filepath, resubmit_filepath=None, **run_options):
+    """
+    Function to join a JSONL batch response file back to the dataset, then score and store the results with run_program
+    Data items whose batch request failed (or has no response) are left out of the results instead of stopping the ingest,
+    and their requests are written to a new batch request file so they can be resubmitted
+    :param dataset: Dataset which was exported with export_batch_requests
+    :param responses_filepath: Filepath of the JSONL batch response file
+    :param output_filepath: filepath to store the results dataset to
+    :param resubmit_filepath: Filepath of the batch request file for the failed requests (defaults to the responses filepath
+        with '_resubmit' added)
+    :param run_options: Keyword arguments passed on to run_program (e.g. baseline_scores, scoring_workers)
+    :return: Array of the custom_ids of the failed requests
+    """
+    run_options.setdefault("skip_failed", True)
+    failed = run_program(dataset, make_batch_prompt_function(load_batch_responses(responses_filepath)), output_filepath, **run_options)
+    if not failed:
+        return []
+
+    failed_items = [data_item for index, data_item, error in failed]
+    failed_ids = sorted(set(custom_id(data_item['java_8_function']['string'], data_item['name']) for data_item in failed_items))
+    if resubmit_filepath is None:
+        resubmit_filepath = os.path.splitext(responses_filepath)[0] + "_resubmit.jsonl"
+    export_batch_requests(failed_items, resubmit_filepath)
+    print("Failed batch requests (resubmit " + resubmit_filepath + ", then ingest its responses with the same output filepath): "
+          + ", ".join(failed_ids))
+    return failed_ids
+
+
+def run_fake_batch_job(requests_filepath, responses_filepath, backend, model="fake-model"):
+    """
+    Function which acts as a local batch endpoint, answering every request of a JSONL batch request file with a backend
+    :param requests_filepath: Filepath of the JSONL batch request file
+    :param responses_filepath: Filepath to write the JSONL batch response file to (in the Mistral batch format)
+    :param backend: Backend to answer the requests with (e.g. a FakeBackend)
+    :param model: Name of the model the batch job was created with
+    :return: None
+    """
+    with open(requests_filepath, "r", encoding="utf-8") as requests_file, open(responses_filepath, "w", encoding="utf-8") as responses_file:
+        for line in requests_file:
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            body = request["body"]
+            entry = {"id": "batch-" + request["custom_id"], "custom_id": request["custom_id"], "response": None, "error": None}
+            try:
+                response = backend.complete(body["messages"], model, body.get("temperature", 0), body.get("max_tokens", 2048))
+                entry["response"] = {"status_code": 200, "body": {
+                    "object": "chat.completion",
+                    "model": model,
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": response['content']},
+                                 "finish_reason": response['finish_reason']}],
+                    "usage": {"prompt_tokens": response['prompt_tokens'], "completion_tokens": response['completion_tokens'],
+                              "total_tokens": response['prompt_tokens'] + response['completion_tokens']}
+                }}
+            except LLMRequestError as error:
+                entry["response"] = {"status_code": error.status_code or 500, "body": {"message": str(error)}}
+            responses_file.write(json.dumps(entry) + "\n")
+    print("Wrote batch responses to " + responses_filepath)
+
+
+def run_mistral_batch_job(client, requests_filepath, responses_filepath, model="codestral-latest", poll_interval=60):
+    """
+    Function to upload a JSONL batch request file to the Mistral batch endpoint, wait for the job and download the responses
+    :param client: Mistral client
+    :param requests_filepath: Filepath of the JSONL batch request file
+    :param responses_filepath: Filepath to write the JSONL batch response file to
+    :param model: The MistralAI Model to run the batch job with
+    :param poll_interval: Seconds between checks of the job status
+    :return: None
+    """
+    with open(requests_filepath, "rb") as my_file:
+        uploaded_file = client.files.upload(file={"file_name": os.path.basename(requests_filepath), "content": my_file}, purpose="batch")
+    job = client.batch.jobs.create(input_files=[uploaded_file.id], model=model, endpoint="/v1/chat/completions")
+    print("Created batch job " + job.id)
+
+    # Wait for the job to finish
+    while job.status in ["QUEUED", "RUNNING"]:
+        time.sleep(poll_interval)
+        job = client.batch.jobs.get(job_id=job.id)
+        print("Batch job " + job.id + ": " + job.status + " (" + str(job.succeeded_requests) + "/" + str(job.total_requests) + " succeeded)")
+    if job.status != "SUCCESS":
+        raise LLMRequestError("Batch job " + job.id + " finished with status " + job.status)
+
+    # Download the response file
+    with open(responses_filepath, "wb") as my_file:
+        my_file.write(client.files.download(file_id=job.output_file).read())
+    print("Downloaded batch responses to " + responses_filepath)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 4 and sys.argv[1] == "export":
+        # Phase 1 - write the batch request file of a dataset
+        export_batch_requests(read_dataset(sys.argv[2], silent=False), sys.argv[3])
+    elif len(sys.argv) == 5 and sys.argv[1] == "ingest":
+        # Phase 2 - join the batch response file back to the dataset and score the results
+        ingest_batch_responses(read_dataset(sys.argv[2], silent=False), sys.argv[3], sys.argv[4])
+    elif len(sys.argv) == 4 and sys.argv[1] == "fake":
+        # Answer a batch request file locally with the fake backend
+        from fake_backend import FakeBackend
+        run_fake_batch_job(sys.argv[2], sys.argv[3], FakeBackend(latency_seconds=0))
+    else:
+        print(__doc__)
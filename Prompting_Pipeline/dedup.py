@@ -0,0 +1,130 @@
+"""
+This python file removes duplicate function pairs before they are prompted and scored
+The scraped datasets can contain the same Java 8 / Java 11 pair more than once (across branches, repository pairs or the
+same/diff parameter splits). Pairs are grouped by a hash of their normalised source code, only the first data item of each
+group is prompted and scored, and its results are then copied to the other data items of the group
+Within one run_program call the duplicates are found with find_duplicate_clusters, across runs (e.g. the same_params and diff_params
+splits, which are run one after the other) a PairResultCache stores the results of every pair so a later run copies them instead
+Usage: python dedup.py dataset.pkl [dataset.pkl ...] (reports the duplicate clusters across the datasets)
+"""
+import sys, json, hashlib, threading
+from Shared_Files.utils import read_dataset, normalized_pair_key, pair_key
+from Shared_Files.disk_cache import DiskLRUCache
+
+
+def find_duplicate_clusters(indexed_items):
+    """
+    Function to group data items which hold the same (normalised) function pair
+    :param indexed_items: Array of (index, data item) tuples
+    :return: Array of the (index, data item) tuples to process (the first of each group, in the given order),
+        and a dictionary of representative index -> array of its duplicate (index, data item) tuples
+    """
+    representatives = []
+    representative_of = {}
+    duplicates = {}
+    for index, data_item in indexed_items:
+        key = normalized_pair_key(data_item)
+        if key not in representative_of:
+            representative_of[key] = index
+            representatives.append((index, data_item))
+        else:
+            duplicates.setdefault(representative_of[key], []).append((index, data_item))
+    return representatives, duplicates
+
+
+def fan_out(data_item, duplicate_item, baseline_scores=None):
+    """
+    Function to copy the results of a processed data item to one of its duplicates
+    :param data_item: Processed data item (with the generated string and comparisons)
+    :param duplicate_item: Duplicate data item to copy the results to
+    :param baseline_scores: Optional dictionary of stored Java 8 vs Java 11 scores, used if the duplicate has its own stored score
+    :return: None
+    """
+    duplicate_item['generated_java_11_string'] = data_item['generated_java_11_string']
+    duplicate_item['java_11_11_comparison'] = dict(data_item['java_11_11_comparison'])
+    if baseline_scores is not None and pair_key(duplicate_item) in baseline_scores:
+        duplicate_item['java_8_11_comparison'] = baseline_scores[pair_key(duplicate_item)]
+    else:
+        duplicate_item['java_8_11_comparison'] = dict(data_item['java_8_11_comparison'])
+
+
+class PairResultCache:
+    """
+    On-disk results of the processed function pairs, keyed by their normalised pair key, shared by run_program calls
+    The results depend on the prompt settings, so each combination of settings (model, template, max_tokens...) uses its own namespace
+    """
+
+    def __init__(self, directory, namespace, max_bytes=512 * 1024 * 1024):
+        """
+        :param directory: Directory to store the results in (created if it does not exist)
+        :param namespace: String describing the prompt settings the results were produced with, e.g. 'codestral-latest/default'
+        :param max_bytes: Maximum total size of the stored results before the least recently used are evicted
+        """
+        self.store = DiskLRUCache(directory, max_bytes)
+        self.namespace = namespace
+        self.lock = threading.Lock()
+        self.hits = 0
+
+    def make_key(self, data_item):
+        """
+        Function to build the key of a function pair
+        :param data_item: Data item from the dataset
+        :return: Hex string of the SHA-256 hash of the namespace and the normalised pair key
+        """
+        return hashlib.sha256((self.namespace + "\0" + normalized_pair_key(data_item)).encode("utf-8")).hexdigest()
+
+    def get(self, data_item):
+        """
+        Function to read the stored results of a function pair
+        :param data_item: Data item from the dataset
+        :return: Dictionary with the generated string and comparisons (can be passed to fan_out), or None if the pair has not been processed
+        """
+        results = self.store.get(self.make_key(data_item))
+        if results is not None:
+            with self.lock:
+                self.hits += 1
+        return results
+
+    def put(self, data_item):
+        """
+        Function to store the results of a processed function pair
+        :param data_item: Processed data item (with the generated string and comparisons)
+        :return: None
+        """
+        self.store.put(self.make_key(data_item), {'generated_java_11_string': data_item['generated_java_11_string'],
+                                                  'java_11_11_comparison': dict(data_item['java_11_11_comparison']),
+                                                  'java_8_11_comparison': dict(data_item['java_8_11_comparison'])})
+
+
+def report_duplicate_clusters(representatives, duplicates, filepath=None):
+    """
+    Function to output the duplicate clusters to the console (and optionally to a JSON file)
+    :param representatives: Array of the (index, data item) tuples which are processed
+    :param duplicates: Dictionary of representative index -> array of its duplicate (index, data item) tuples
+    :param filepath: Optional filepath of a JSON file to write the clusters to
+    :return: Array of the clusters, each an array of {'index', 'name'} dictionaries (the representative first)
+    """
+    names = {index: data_item['name'] for index, data_item in representatives}
+    clusters = [[{'index': index, 'name': names[index]}] + [{'index': duplicate_index, 'name': duplicate_item['name']}
+                                                             for duplicate_index, duplicate_item in duplicates[index]]
+                for index, data_item in representatives if index in duplicates]
+    duplicate_count = sum(len(cluster) - 1 for cluster in clusters)
+
+    print("Duplicate pairs: " + str(len(representatives)) + " unique pairs, " + str(duplicate_count) + " duplicates in "
+          + str(len(clusters)) + " clusters")
+    # Output the largest clusters
+    for cluster in sorted(clusters, key=len, reverse=True)[:10]:
+        print("    " + str(len(cluster)) + " copies: " + ", ".join(item['name'] + " (" + str(item['index']) + ")" for item in cluster))
+
+    if filepath is not None:
+        with open(filepath, "w", encoding="utf-8") as my_file:
+            json.dump(clusters, my_file, indent=1)
+    return clusters
+
+
+if __name__ == '__main__':
+    # Report the duplicate pairs across the datasets given on the command line (indexes count through the combined datasets)
+    combined = []
+    for filepath in sys.argv[1:]:
+        combined = combined + read_dataset(filepath, silent=False)
+    report_duplicate_clusters(*find_duplicate_clusters(list(enumerate(combined))))
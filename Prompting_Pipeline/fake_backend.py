@@ -0,0 +1,279 @@
+"""
+This python file holds a deterministic stand-in for the LLM, used to benchmark the prompting pipeline offline
+FakeBackend implements the same interface as the real backends (in-process), and serve_chat_completions exposes
+any backend as a local HTTP server speaking the OpenAI style /chat/completions shape (for OpenAICompatibleBackend)
+Latency, errors and 429 (rate limit) responses are drawn from a random generator seeded by the request itself,
+so a run produces the same outcomes regardless of how the requests are interleaved between threads
+"""
+import json, random, hashlib, itertools, threading, time, tempfile, os
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from llm_clients import LLMBackend, LLMRequestError, ClientPool
+from rate_limiter import estimate_token_count
+
+
+def extract_java_8_code(messages):
+    """
+    Function to recover the Java 8 code from a prompt built by get_prompt_messages
+    :param messages: Array of dictionaries which represents a role based prompt
+    :return: The Java 8 code between the <Java> and </Java> tags
+    """
+    content = messages[-1]['content']
+    return content[content.find("<Java>\n") + 7:content.rfind("</Java>")]
+
+
+def echo_transform(java_8_string):
+    """
+    Default transform which returns the Java 8 code unchanged (so every generated function is valid Java)
+    :param java_8_string: Java 8 code from the prompt
+    :return: The "migrated" Java code
+    """
+    return java_8_string
+
+
+def canned_outputs_from_dataset(dataset, field='java_11_function'):
+    """
+    Function to build a dictionary of canned outputs from a dataset or a results dataset
+    :param dataset: Dataset (that has already been de-serialized)
+    :param field: 'java_11_function' to answer with the true Java 11 code, or 'generated_java_11_string' to replay stored results
+    :return: Dictionary of Java 8 code -> Java code to answer with
+    """
+    outputs = {}
+    for data_item in dataset:
+        answer = data_item[field]['string'] if field == 'java_11_function' else data_item[field]
+        outputs[data_item['java_8_function']['string']] = answer
+    return outputs
+
+
+class FakeBackend(LLMBackend):
+    """
+    In-process stand-in LLM with configurable latency, failures and outputs
+    """
+
+    def __init__(self, latency_distribution="lognormal", latency_seconds=0.5, latency_spread=0.5, error_rate=0.0,
+                 throttle_rate=0.0, retry_after=1, canned_outputs=None, transform=echo_transform, seed=0, seconds_per_token=0.0,
+                 trailing_text=""):
+        """
+        :param latency_distribution: 'constant', 'uniform' or 'lognormal'
+        :param latency_seconds: Constant latency, mean of the uniform latency or median of the lognormal latency
+        :param latency_spread: Relative width of the uniform latency or sigma of the lognormal latency
+        :param error_rate: Fraction of requests which fail with a 500 error
+        :param throttle_rate: Fraction of requests which are rejected with a 429 error
+        :param retry_after: Value of the Retry-After header sent with 429 errors (in seconds)
+        :param canned_outputs: Optional dictionary of Java 8 code -> Java code to answer with
+        :param transform: Function applied to the Java 8 code when there is no canned output
+        :param seed: Seed mixed into every request's random generator
+        :param seconds_per_token: Time taken to generate each token after the first (used when streaming)
+        :param trailing_text: Text written after the closing code fence (like the explanations models often add)
+        """
+        self.latency_distribution = latency_distribution
+        self.latency_seconds = latency_seconds
+        self.latency_spread = latency_spread
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.canned_outputs = canned_outputs or {}
+        self.transform = transform
+        self.seed = seed
+        self.seconds_per_token = seconds_per_token
+        self.trailing_text = trailing_text
+        # Number of times each request has been seen, so a retried request gets a fresh (but reproducible) outcome
+        self.attempts = {}
+        self.lock = threading.Lock()
+
+    def request_random(self, messages, model):
+        """
+        Function to build the random generator for a request from its content and attempt number
+        :param messages: Array of dictionaries which represents a role based prompt
+        :param model: Name of the model
+        :return: random.Random instance
+        """
+        request = json.dumps([self.seed, model, messages], sort_keys=True)
+        with self.lock:
+            attempt = self.attempts.get(request, 0)
+            self.attempts[request] = attempt + 1
+        digest = hashlib.sha256((request + str(attempt)).encode("utf-8")).digest()
+        return random.Random(int.from_bytes(digest[:8], "little"))
+
+    def sample_latency(self, generator):
+        """
+        Function to draw the latency of a request
+        :param generator: random.Random instance of the request
+        :return: Latency in seconds
+        """
+        if self.latency_distribution == "constant":
+            return self.latency_seconds
+        if self.latency_distribution == "uniform":
+            return generator.uniform(self.latency_seconds * (1 - self.latency_spread), self.latency_seconds * (1 + self.latency_spread))
+        return self.latency_seconds * generator.lognormvariate(0, self.latency_spread)
+
+    def build_response(self, messages, max_tokens):
+        """
+        Function to build the response text for a prompt, truncated to max_tokens
+        :param messages: Array of dictionaries which represents a role based prompt
+        :param max_tokens: Maximum number of tokens to generate
+        :return: The response text, its finish reason, and the number of prompt and completion tokens
+        """
+        java_8_string = extract_java_8_code(messages)
+        java_code = self.canned_outputs.get(java_8_string)
+        if java_code is None:
+            java_code = self.transform(java_8_string)
+        # Answer in the same shape as the Mistral API (a fenced Java code block)
+        content = "```java\n" + java_code.rstrip("\n") + "\n```" + self.trailing_text
+
+        # Truncate the response if it is longer than the token budget (roughly 4 characters per token)
+        finish_reason = "stop"
+        if estimate_token_count(content) > max_tokens:
+            content = content[:max_tokens * 4]
+            finish_reason = "length"
+        prompt_tokens = sum(estimate_token_count(message['content']) for message in messages)
+        return content, finish_reason, prompt_tokens, estimate_token_count(content)
+
+    def start_request(self, messages, model):
+        """
+        Function to wait for the (first token) latency of a request and inject its failures
+        :param messages: Array of dictionaries which represents a role based prompt
+        :param model: Name of the model
+        :return: None
+        """
+        generator = self.request_random(messages, model)
+        time.sleep(self.sample_latency(generator))
+
+        # Inject failures (429 first, so the throttle rate is independent of the error rate)
+        if generator.random() < self.throttle_rate:
+            raise LLMRequestError("Fake rate limit", 429, {"Retry-After": str(self.retry_after)})
+        if generator.random() < self.error_rate:
+            raise LLMRequestError("Fake server error", 500)
+
+    def complete(self, messages, model, temperature, max_tokens):
+        self.start_request(messages, model)
+        content, finish_reason, prompt_tokens, completion_tokens = self.build_response(messages, max_tokens)
+        time.sleep(completion_tokens * self.seconds_per_token)
+        return {
+            'content': content,
+            'finish_reason': finish_reason,
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'status_code': 200
+        }
+
+    def stream(self, messages, model, temperature, max_tokens):
+        self.start_request(messages, model)
+        content, finish_reason, prompt_tokens, completion_tokens = self.build_response(messages, max_tokens)
+        # Send the response in chunks of roughly 4 tokens
+        for start in range(0, len(content), 16):
+            if start:
+                time.sleep(estimate_token_count(content[start:start + 16]) * self.seconds_per_token)
+            last = start + 16 >= len(content)
+            yield {
+                'content': content[start:start + 16],
+                'finish_reason': finish_reason if last else None,
+                'prompt_tokens': prompt_tokens if last else None,
+                'completion_tokens': completion_tokens if last else None
+            }
+
+
+def create_fake_pool(size=1, **backend_options):
+    """
+    Function to create a pool backed by a FakeBackend (the keyword options are passed to FakeBackend)
+    Every slot of the pool shares the same FakeBackend so the per-request outcomes stay deterministic
+    :param size: Number of requests which can use the pool at the same time
+    :return: ClientPool of FakeBackend instances
+    """
+    backend = FakeBackend(**backend_options)
+    return ClientPool(lambda: backend, size)
+
+
+def serve_chat_completions(backend, host="127.0.0.1", port=0):
+    """
+    Function to serve a backend as a local OpenAI style chat completions server (in a background thread)
+    :param backend: Backend to answer the requests with (e.g. a FakeBackend)
+    :param host: Host to listen on
+    :param port: Port to listen on (0 picks a free port)
+    :return: The running server, its base URL is "http://host:" + str(server.server_address[1]) + "/v1"
+    """
+    class ChatCompletionsHandler(BaseHTTPRequestHandler):
+        # HTTP/1.1 keeps the connection alive between requests
+        protocol_version = "HTTP/1.1"
+
+        def send_json(self, status_code, body, headers=None):
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(status_code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            if not self.path.endswith("/chat/completions"):
+                self.send_json(404, {"error": {"message": "Not found"}})
+                return
+            request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            if request.get("stream"):
+                self.send_stream(request)
+                return
+            try:
+                response = backend.complete(request["messages"], request.get("model"), request.get("temperature", 0), request.get("max_tokens", 2048))
+            except LLMRequestError as error:
+                self.send_json(error.status_code or 500, {"error": {"message": str(error)}}, error.headers)
+                return
+            self.send_json(200, {
+                "object": "chat.completion",
+                "model": request.get("model"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": response['content']},
+                             "finish_reason": response['finish_reason']}],
+                "usage": {"prompt_tokens": response['prompt_tokens'], "completion_tokens": response['completion_tokens'],
+                          "total_tokens": response['prompt_tokens'] + response['completion_tokens']}
+            })
+
+        def send_stream(self, request):
+            # Stream the response as server-sent events, the connection is closed afterwards (no Content-Length is known)
+            chunks = backend.stream(request["messages"], request.get("model"), request.get("temperature", 0), request.get("max_tokens", 2048))
+            try:
+                first_chunk = next(chunks, None)
+            except LLMRequestError as error:
+                self.send_json(error.status_code or 500, {"error": {"message": str(error)}}, error.headers)
+                return
+            self.close_connection = True
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            try:
+                for chunk in itertools.chain([first_chunk] if first_chunk is not None else [], chunks):
+                    data = {"object": "chat.completion.chunk", "model": request.get("model"),
+                            "choices": [{"index": 0, "delta": {"content": chunk['content']}, "finish_reason": chunk['finish_reason']}]}
+                    if chunk['completion_tokens'] is not None:
+                        data["usage"] = {"prompt_tokens": chunk['prompt_tokens'], "completion_tokens": chunk['completion_tokens'],
+                                         "total_tokens": chunk['prompt_tokens'] + chunk['completion_tokens']}
+                    self.wfile.write(("data: " + json.dumps(data) + "\n\n").encode("utf-8"))
+                    self.wfile.flush()
+                self.wfile.write(b"data: [DONE]\n\n")
+            except (BrokenPipeError, ConnectionResetError):
+                # The client cancelled the request
+                chunks.close()
+
+        def log_message(self, format, *args):
+            # Do not write every request to the console
+            pass
+
+    server = ThreadingHTTPServer((host, port), ChatCompletionsHandler)
+    threading.Thread(target=server.serve_forever, name="fake-chat-completions", daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    # Benchmark the prompting pipeline against the fake backend at several concurrency levels
+    from Shared_Files.utils import read_dataset
+    from prompting_pipeline import run_program, make_prompt_function
+
+    dataset = read_dataset('./../Shared_Files/synthetic_dataset.pkl', silent=False)
+    output_directory = tempfile.mkdtemp()
+    for max_workers in [1, 4, 16]:
+        print("\nBenchmarking with " + str(max_workers) + " workers")
+        client_pool = create_fake_pool(size=max_workers, latency_seconds=0.5, canned_outputs=canned_outputs_from_dataset(dataset))
+        start = time.monotonic()
+        run_program([dict(data_item) for data_item in dataset], make_prompt_function(client_pool, "fake-model"),
+                    os.path.join(output_directory, "fake_results_" + str(max_workers) + ".pkl"), max_workers=max_workers, monitor_interval=None)
+        print(str(max_workers) + " workers: " + str(round(len(dataset) / (time.monotonic() - start), 2)) + " items/sec")
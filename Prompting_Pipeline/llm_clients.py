@@ -0,0 +1,311 @@
+"""
+This python file holds the LLM backends used by the prompting pipeline
+Every backend exposes the same complete() function and returns a dictionary representation of the response,
+and a stream() generator which yields the response in chunks as it is generated (closing the generator cancels the request)
+Backends are created once per run and handed out to the prompting workers through a ClientPool,
+so the clients (and their keep-alive connections) are reused instead of being rebuilt for every function
+"""
+import os, json, queue, threading
+from contextlib import contextmanager
+import httpx
+import requests
+from mistralai import Mistral
+from mistralai.models import SDKError
+
+
+class LLMRequestError(Exception):
+    """
+    Exception raised by a backend when a request to the LLM fails
+    """
+
+    def __init__(self, message, status_code=None, headers=None):
+        """
+        :param message: Description of the failure
+        :param status_code: HTTP status code of the failed request (None if no response was received)
+        :param headers: Dictionary of the response headers (used to read rate limit information)
+        """
+        super().__init__(message)
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+class LLMBackend:
+    """
+    Interface for an LLM provider, subclasses implement complete() for a single provider
+    """
+
+    def complete(self, messages, model, temperature, max_tokens):
+        """
+        Function to send a role based prompt to the LLM and wait for the full response
+        :param messages: Array of dictionaries which represents a role based prompt
+        :param model: Name of the model to prompt
+        :param temperature: Sampling temperature
+        :param max_tokens: Maximum number of tokens to generate
+        :return: Dictionary with the 'content', 'finish_reason', 'prompt_tokens', 'completion_tokens' and 'status_code'
+        """
+        raise NotImplementedError
+
+    def stream(self, messages, model, temperature, max_tokens):
+        """
+        Generator which sends a role based prompt to the LLM and yields the response as it is generated
+        Closing the generator early cancels the request. Backends without streaming support yield the full response as one chunk
+        :param messages: Array of dictionaries which represents a role based prompt
+        :param model: Name of the model to prompt
+        :param temperature: Sampling temperature
+        :param max_tokens: Maximum number of tokens to generate
+        :return: Yields dictionaries with the new 'content', and the 'finish_reason', 'prompt_tokens' and 'completion_tokens' once known (else None)
+        """
+        response = self.complete(messages, model, temperature, max_tokens)
+        yield {
+            'content': response['content'],
+            'finish_reason': response['finish_reason'],
+            'prompt_tokens': response['prompt_tokens'],
+            'completion_tokens': response['completion_tokens']
+        }
+
+    def close(self):
+        """
+        Function to release any resources held by the backend
+        :return: None
+        """
+        pass
+
+
+class MistralBackend(LLMBackend):
+    """
+    Backend which prompts the Mistral API through the mistralai SDK
+    """
+
+    def __init__(self, api_key, http_client=None):
+        """
+        :param api_key: Mistral API key
+        :param http_client: httpx.Client to send requests through (allows connections to be shared between backends)
+        """
+        self.client = Mistral(api_key=api_key, client=http_client)
+
+    def complete(self, messages, model, temperature, max_tokens):
+        try:
+            response = self.client.chat.complete(
+                model=model,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens
+            )
+        except SDKError as error:
+            raise LLMRequestError(str(error), error.status_code, dict(error.raw_response.headers))
+        except httpx.TransportError as error:
+            raise LLMRequestError(str(error))
+
+        return {
+            'content': response.choices[0].message.content,
+            'finish_reason': response.choices[0].finish_reason,
+            'prompt_tokens': response.usage.prompt_tokens,
+            'completion_tokens': response.usage.completion_tokens,
+            'status_code': 200
+        }
+
+    def stream(self, messages, model, temperature, max_tokens):
+        try:
+            event_stream = self.client.chat.stream(
+                model=model,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens
+            )
+        except SDKError as error:
+            raise LLMRequestError(str(error), error.status_code, dict(error.raw_response.headers))
+        except httpx.TransportError as error:
+            raise LLMRequestError(str(error))
+
+        # Leaving the context manager closes the response, which cancels the request if the generator was closed early
+        with event_stream:
+            try:
+                for event in event_stream:
+                    chunk = event.data
+                    usage = chunk.usage
+                    choice = chunk.choices[0] if chunk.choices else None
+                    content = choice.delta.content if choice is not None else None
+                    yield {
+                        'content': content if isinstance(content, str) else "",
+                        'finish_reason': choice.finish_reason if choice is not None else None,
+                        'prompt_tokens': usage.prompt_tokens if usage is not None else None,
+                        'completion_tokens': usage.completion_tokens if usage is not None else None
+                    }
+            except httpx.TransportError as error:
+                raise LLMRequestError(str(error))
+
+
+class OpenAICompatibleBackend(LLMBackend):
+    """
+    Backend for any server which implements the OpenAI style /chat/completions endpoint
+    (other providers, self-hosted models or a local stand-in server)
+    """
+
+    def __init__(self, base_url, api_key=None, timeout=120):
+        """
+        :param base_url: Base URL of the API, e.g. http://127.0.0.1:8000/v1
+        :param api_key: API key sent as a bearer token (None to send no key)
+        :param timeout: Request timeout in seconds
+        """
+        self.url = base_url.rstrip("/") + "/chat/completions"
+        self.timeout = timeout
+        # A session keeps the connection alive between requests
+        self.session = requests.Session()
+        if api_key:
+            self.session.headers["Authorization"] = "Bearer " + api_key
+
+    def complete(self, messages, model, temperature, max_tokens):
+        body = {
+            "model": model,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens
+        }
+        try:
+            response = self.session.post(self.url, json=body, timeout=self.timeout)
+        except requests.RequestException as error:
+            raise LLMRequestError(str(error))
+
+        if response.status_code != 200:
+            raise LLMRequestError("Request failed - Status: " + str(response.status_code), response.status_code, dict(response.headers))
+
+        response_json = response.json()
+        usage = response_json.get("usage") or {}
+        return {
+            'content': response_json["choices"][0]["message"]["content"],
+            'finish_reason': response_json["choices"][0].get("finish_reason"),
+            'prompt_tokens': usage.get("prompt_tokens"),
+            'completion_tokens': usage.get("completion_tokens"),
+            'status_code': response.status_code
+        }
+
+    def stream(self, messages, model, temperature, max_tokens):
+        body = {
+            "model": model,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "stream": True,
+            # Ask for the token usage in the final chunk
+            "stream_options": {"include_usage": True}
+        }
+        try:
+            response = self.session.post(self.url, json=body, timeout=self.timeout, stream=True)
+        except requests.RequestException as error:
+            raise LLMRequestError(str(error))
+
+        # Closing the response drops the connection, which cancels the request if the generator was closed early
+        with response:
+            if response.status_code != 200:
+                raise LLMRequestError("Request failed - Status: " + str(response.status_code), response.status_code, dict(response.headers))
+            # Server-sent events are always UTF-8
+            response.encoding = "utf-8"
+            try:
+                # Read the server-sent events, each 'data:' line holds one chunk of the response
+                for line in response.iter_lines(decode_unicode=True):
+                    if not line or not line.startswith("data:"):
+                        continue
+                    data = line[5:].strip()
+                    if data == "[DONE]":
+                        return
+                    chunk = json.loads(data)
+                    usage = chunk.get("usage") or {}
+                    choice = chunk["choices"][0] if chunk.get("choices") else {}
+                    yield {
+                        'content': (choice.get("delta") or {}).get("content") or "",
+                        'finish_reason': choice.get("finish_reason"),
+                        'prompt_tokens': usage.get("prompt_tokens"),
+                        'completion_tokens': usage.get("completion_tokens")
+                    }
+            except requests.RequestException as error:
+                raise LLMRequestError(str(error))
+
+    def close(self):
+        self.session.close()
+
+
+class ClientPool:
+    """
+    Thread-safe pool of backends which is created once per run and shared by all the prompting workers
+    """
+
+    def __init__(self, backend_factory, size=1, on_close=None):
+        """
+        :param backend_factory: Function which takes no arguments and returns a new backend
+        :param size: Number of backends in the pool (the number of requests which can use the pool at the same time)
+        :param on_close: Optional function to call once all backends are closed (to release shared resources)
+        """
+        self.size = size
+        self.on_close = on_close
+        self.backends = [backend_factory() for _ in range(size)]
+        self.available = queue.Queue()
+        for backend in self.backends:
+            self.available.put(backend)
+
+    @contextmanager
+    def borrow(self):
+        """
+        Context manager which takes a backend from the pool (waiting if all are in use) and returns it afterwards
+        :return: A backend from the pool
+        """
+        backend = self.available.get()
+        try:
+            yield backend
+        finally:
+            self.available.put(backend)
+
+    def close(self):
+        """
+        Function to close every backend in the pool
+        :return: None
+        """
+        for backend in self.backends:
+            backend.close()
+        if self.on_close is not None:
+            self.on_close()
+
+
+def create_mistral_pool(api_key, size=1, timeout=120):
+    """
+    Function to create a pool of Mistral backends which share one keep-alive connection pool
+    :param api_key: Mistral API key
+    :param size: Number of backends (and keep-alive connections) in the pool
+    :param timeout: Request timeout in seconds
+    :return: ClientPool of MistralBackend instances
+    """
+    http_client = httpx.Client(
+        limits=httpx.Limits(max_connections=size, max_keepalive_connections=size),
+        timeout=timeout
+    )
+    return ClientPool(lambda: MistralBackend(api_key, http_client), size, on_close=http_client.close)
+
+
+def create_openai_compatible_pool(base_url, api_key=None, size=1, timeout=120):
+    """
+    Function to create a pool of backends for an OpenAI style chat completions server
+    :param base_url: Base URL of the API, e.g. http://127.0.0.1:8000/v1
+    :param api_key: API key sent as a bearer token (None to send no key)
+    :param size: Number of backends (each with its own keep-alive session) in the pool
+    :param timeout: Request timeout in seconds
+    :return: ClientPool of OpenAICompatibleBackend instances
+    """
+    return ClientPool(lambda: OpenAICompatibleBackend(base_url, api_key, timeout), size)
+
+
+# Pool shared by every call to prompt_mistral_api, created the first time it is needed
+shared_mistral_pool = None
+shared_mistral_pool_lock = threading.Lock()
+
+
+def get_shared_mistral_pool(size=8):
+    """
+    Function to get (creating it if needed) the process wide Mistral pool
+    The API key is read from the environment variable 'MISTRAL_API_KEY'
+    :param size: Number of backends in the pool (only used when the pool is first created)
+    :return: ClientPool of MistralBackend instances
+    """
+    global shared_mistral_pool
+    with shared_mistral_pool_lock:
+        if shared_mistral_pool is None:
+            shared_mistral_pool = create_mistral_pool(os.environ["MISTRAL_API_KEY"], size)
+        return shared_mistral_pool
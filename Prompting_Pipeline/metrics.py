@@ -0,0 +1,146 @@
+"""
+This python file records per-item metrics for a prompting run
+Every data item gets a record (queue wait, rate limit wait, request latency, scoring time, tokens, HTTP status, retries...)
+which is written to a JSONL sidecar file once the item is finished, and a latency/throughput summary is output at the end of the run
+The record of the item a thread is currently prompting is kept in a thread local, so request_generation can fill in
+the request details without changing the prompt_function contract
+"""
+import json, math, threading, time
+
+# Thread local holding the record of the data item the current thread is working on
+active = threading.local()
+
+
+def set_active_record(record):
+    """
+    Function to set (or clear with None) the record of the data item the current thread is working on
+    :param record: Metrics record dictionary
+    :return: None
+    """
+    active.record = record
+
+
+def get_active_record():
+    """
+    Function to get the record of the data item the current thread is working on
+    :return: Metrics record dictionary, or None if the thread is not working on a data item
+    """
+    return getattr(active, 'record', None)
+
+
+def percentile(values, percent):
+    """
+    Function to calculate a percentile using the nearest rank method
+    :param values: Array of numbers
+    :param percent: Percentile to calculate (0-100)
+    :return: The percentile, or None if there are no values
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(0, math.ceil(percent / 100 * len(ordered)) - 1)
+    return ordered[rank]
+
+
+class RunMetrics:
+    """
+    Collection of the per-item metric records of a run, written to a JSONL sidecar file
+    """
+
+    def __init__(self, filepath):
+        """
+        :param filepath: Filepath of the JSONL sidecar file (records are appended, so resumed runs add to it)
+        """
+        self.filepath = filepath
+        self.records = []
+        self.lock = threading.Lock()
+        self.start_time = time.monotonic()
+        self.file = open(filepath, "a", encoding="utf-8")
+
+    def new_record(self, index, name):
+        """
+        Function to create the record of a data item
+        :param index: Index of the data item in the dataset
+        :param name: Name of the function
+        :return: Metrics record dictionary
+        """
+        return {
+            'index': index,
+            'name': name,
+            'enqueued_at': time.monotonic(),
+            'queue_wait': None,
+            'rate_limit_wait': None,
+            'generation_time': None,
+            'request_latency': None,
+            'time_to_first_token': None,
+            'time_to_code_complete': None,
+            'scoring_time': None,
+            'prompt_tokens': None,
+            'completion_tokens': None,
+            'status_code': None,
+            'max_tokens': None,
+            'truncations': 0,
+            'retries': 0,
+            'cache_hit': False,
+            # True for a duplicate function pair whose results were copied from its representative or the result cache (it was never prompted or scored)
+            'deduplicated': False,
+            'error': None
+        }
+
+    def write(self, record):
+        """
+        Function to append a finished record to the sidecar file
+        :param record: Metrics record dictionary
+        :return: None
+        """
+        with self.lock:
+            self.records.append(record)
+            self.file.write(json.dumps({key: value for key, value in record.items() if key != 'enqueued_at'}) + "\n")
+            self.file.flush()
+
+    def summary(self):
+        """
+        Function to output the latency and throughput summary of the run to the console
+        :return: None
+        """
+        elapsed = time.monotonic() - self.start_time
+        with self.lock:
+            all_records = list(self.records)
+        # Deduplicated items were never prompted or scored, so only the prompted items are used for the timings, tokens and status codes
+        records = [record for record in all_records if not record.get('deduplicated')]
+
+        print("Run metrics for " + str(len(all_records)) + " items (written to " + self.filepath + ")")
+        deduplicated = len(all_records) - len(records)
+        if deduplicated:
+            print("    deduplicated           " + str(deduplicated) + " items share the result of a duplicate or an earlier run (not prompted or scored themselves), "
+                  + "the timings, tokens and status codes below are for the " + str(len(records)) + " prompted items")
+        for metric in ['queue_wait', 'rate_limit_wait', 'generation_time', 'request_latency', 'time_to_first_token', 'time_to_code_complete',
+                       'scoring_time']:
+            values = [record[metric] for record in records if record[metric] is not None]
+            if values:
+                print("    " + metric.ljust(22) + " p50 " + str(round(percentile(values, 50), 3)) + "s, p95 " + str(round(percentile(values, 95), 3))
+                      + "s, p99 " + str(round(percentile(values, 99), 3)) + "s, max " + str(round(max(values), 3)) + "s")
+
+        # Token throughput only counts requests which were actually sent to the LLM
+        prompt_tokens = sum(record['prompt_tokens'] or 0 for record in records)
+        completion_tokens = sum(record['completion_tokens'] or 0 for record in records)
+        print("    tokens                 " + str(prompt_tokens) + " prompt, " + str(completion_tokens) + " completion, "
+              + str(round(completion_tokens / elapsed, 2)) + " completion tokens/sec, "
+              + str(round((prompt_tokens + completion_tokens) / elapsed, 2)) + " total tokens/sec")
+
+        # Count the status codes, cache hits, retries and failures
+        status_counts = {}
+        for record in records:
+            status_counts[str(record['status_code'])] = status_counts.get(str(record['status_code']), 0) + 1
+        print("    status codes           " + str(status_counts))
+        print("    cache hits             " + str(sum(1 for record in records if record['cache_hit']))
+              + ", retries " + str(sum(record['retries'] for record in records))
+              + ", truncated responses " + str(sum(record['truncations'] for record in records))
+              + ", failures " + str(sum(1 for record in all_records if record['error'] is not None)))
+
+    def close(self):
+        """
+        Function to close the sidecar file
+        :return: None
+        """
+        self.file.close()
@@ -0,0 +1,261 @@
+"""
+This python file holds a small staged streaming pipeline used by run_program
+Each stage is a pool of worker threads which takes items from a bounded queue, processes them and passes
+the results on to the queue of the next stage. A full queue blocks the stage before it (backpressure),
+and the queue depth of every stage is sampled so the bottleneck stage can be identified
+"""
+import queue, threading, time
+
+# Sentinel placed on a queue to tell the workers of a stage that no more items will arrive
+STOP = object()
+
+
+class PipelineStage:
+    """
+    A pool of worker threads which share one bounded input queue
+    """
+
+    def __init__(self, name, handler, workers=1, queue_size=16, batch_size=1):
+        """
+        :param name: Name of the stage (used when reporting)
+        :param handler: Function which processes an item and returns the item to pass on (None to pass nothing on),
+            when batch_size > 1 the handler takes an array of items and returns an array of items to pass on
+        :param workers: Number of worker threads
+        :param queue_size: Maximum number of items waiting in the input queue
+        :param batch_size: Maximum number of queued items handed to the handler at once
+        """
+        self.name = name
+        self.handler = handler
+        self.workers = workers
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.next_stage = None
+        self.pipeline = None
+        self.threads = []
+        # Set when this stage (or a stage after it) failed, the stage then stops taking items
+        self.aborted = threading.Event()
+
+        # Statistics used to report how busy the stage was
+        self.lock = threading.Lock()
+        self.processed = 0
+        self.busy_seconds = 0
+        self.max_depth = 0
+        self.depth_total = 0
+        self.depth_samples = 0
+
+    def start(self):
+        """
+        Function to start the worker threads of the stage
+        :return: None
+        """
+        for number in range(self.workers):
+            thread = threading.Thread(target=self._work, name=self.name + "-" + str(number), daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def put(self, item):
+        """
+        Function to add an item to the input queue, blocking while the queue is full
+        :param item: Item to add
+        :return: None
+        """
+        while True:
+            if self.aborted.is_set():
+                raise self.pipeline.error
+            try:
+                self.queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def _get(self):
+        """
+        Function to take the next item from the input queue (None once the stage has been aborted)
+        :return: The next item, STOP or None
+        """
+        while not self.aborted.is_set():
+            try:
+                return self.queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return None
+
+    def _take_batch(self):
+        """
+        Function to take up to batch_size items from the input queue, waiting for at least one
+        :return: Array of items, or None if the stage should stop
+        """
+        item = self._get()
+        if item is None or item is STOP:
+            # Put the sentinel back so the other workers of the stage also stop
+            if item is STOP:
+                self.queue.put(STOP)
+            return None
+
+        batch = [item]
+        while len(batch) < self.batch_size:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is STOP:
+                self.queue.put(STOP)
+                break
+            batch.append(item)
+        return batch
+
+    def _work(self):
+        """
+        Function run by every worker thread, processing items until the stage is stopped
+        :return: None
+        """
+        while True:
+            batch = self._take_batch()
+            if batch is None:
+                return
+            start = time.monotonic()
+            try:
+                if self.batch_size > 1:
+                    outputs = self.handler(batch)
+                else:
+                    output = self.handler(batch[0])
+                    outputs = [] if output is None else [output]
+            except Exception as error:
+                self.pipeline.fail(error, self)
+                return
+            with self.lock:
+                self.processed += len(batch)
+                self.busy_seconds += time.monotonic() - start
+
+            # Pass the outputs on to the next stage (blocking if its queue is full)
+            if self.next_stage is not None:
+                try:
+                    for output in outputs:
+                        self.next_stage.put(output)
+                except Exception:
+                    return
+
+    def sample_depth(self):
+        """
+        Function to record the current depth of the input queue
+        :return: The current depth
+        """
+        depth = self.queue.qsize()
+        with self.lock:
+            self.max_depth = max(self.max_depth, depth)
+            self.depth_total += depth
+            self.depth_samples += 1
+        return depth
+
+    def stop(self):
+        """
+        Function to tell the workers no more items will arrive and wait for them to finish the queued items
+        :return: None
+        """
+        try:
+            self.put(STOP)
+        except Exception:
+            # The stage has been aborted, its workers stop without the sentinel
+            pass
+        for thread in self.threads:
+            thread.join()
+
+
+class Pipeline:
+    """
+    A chain of pipeline stages, fed with items from the calling thread
+    """
+
+    def __init__(self, stages, monitor_interval=30, sample_interval=0.5):
+        """
+        :param stages: Array of PipelineStages, in the order the items flow through them
+        :param monitor_interval: Seconds between queue depth updates written to the console (None for no updates)
+        :param sample_interval: Seconds between queue depth samples (used for the final report)
+        """
+        self.stages = stages
+        self.monitor_interval = monitor_interval
+        self.sample_interval = sample_interval
+        self.lock = threading.Lock()
+        self.error = None
+        self.finished = threading.Event()
+
+        # Link each stage to the stage after it
+        for stage, next_stage in zip(stages, stages[1:] + [None]):
+            stage.pipeline = self
+            stage.next_stage = next_stage
+
+    def fail(self, error, failed_stage):
+        """
+        Function to stop the pipeline after a stage raised an exception
+        The failed stage and the stages before it stop taking items, the stages after it finish the items
+        they were already given (so completed work is not lost)
+        :param error: The exception (re-raised by run)
+        :param failed_stage: The stage which raised the exception
+        :return: None
+        """
+        with self.lock:
+            if self.error is None:
+                self.error = error
+            for stage in self.stages[:self.stages.index(failed_stage) + 1]:
+                stage.aborted.set()
+
+    def queue_depths(self):
+        """
+        Function to build a string of the current queue depth of every stage
+        :return: String such as "generation 3/16, scoring 16/16, writing 0/16"
+        """
+        return ", ".join(stage.name + " " + str(stage.sample_depth()) + "/" + str(stage.queue_size) for stage in self.stages)
+
+    def _monitor(self):
+        """
+        Function run by the monitor thread, sampling the queue depths and periodically writing them to the console
+        :return: None
+        """
+        last_output = time.monotonic()
+        while not self.finished.wait(self.sample_interval):
+            depths = self.queue_depths()
+            if self.monitor_interval is not None and time.monotonic() - last_output >= self.monitor_interval:
+                print("Queue depths: " + depths)
+                last_output = time.monotonic()
+
+    def run(self, items):
+        """
+        Function to push every item through the pipeline and wait for all of the stages to finish
+        :param items: Iterable of items for the first stage
+        :return: None
+        """
+        start = time.monotonic()
+        for stage in self.stages:
+            stage.start()
+        monitor = threading.Thread(target=self._monitor, name="pipeline-monitor", daemon=True)
+        monitor.start()
+
+        try:
+            # Feed the first stage, this blocks whenever the first queue is full
+            for item in items:
+                self.stages[0].put(item)
+        finally:
+            # Stop the stages in order, so each stage finishes the items still queued for it
+            for stage in self.stages:
+                stage.stop()
+            self.finished.set()
+            monitor.join()
+
+        if self.error is not None:
+            raise self.error
+        self.report(time.monotonic() - start)
+
+    def report(self, elapsed):
+        """
+        Function to output the statistics of every stage to the console
+        :param elapsed: Number of seconds the pipeline ran for
+        :return: None
+        """
+        print("Pipeline finished in " + str(round(elapsed, 2)) + "s")
+        for stage in self.stages:
+            average_depth = stage.depth_total / stage.depth_samples if stage.depth_samples else 0
+            utilisation = stage.busy_seconds / (elapsed * stage.workers) * 100 if elapsed else 0
+            print("    " + stage.name.ljust(12) + str(stage.processed).rjust(6) + " items, " + str(stage.workers) + " workers, "
+                  + str(round(utilisation, 1)) + "% busy, queue depth avg " + str(round(average_depth, 1))
+                  + " max " + str(stage.max_depth) + "/" + str(stage.queue_size))
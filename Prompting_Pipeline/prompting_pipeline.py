@@ -1,9 +1,19 @@
-from mistralai import Mistral
-from codebleu import calc_codebleu
 # pip install mistralai, tree-sitter-java==0.23.2
 # pip installed codebleu==0.7.1(via github link)
     # pip install git+https://github.com/k4black/codebleu.git
+import time, json, threading
 from Shared_Files.utils import *
+from rate_limiter import RateLimiter, estimate_token_count
+from llm_clients import create_mistral_pool, get_shared_mistral_pool, LLMRequestError
+from response_cache import ResponseCache
+from result_journal import ResultJournal
+from baseline_scores import load_baseline_scores
+from scoring import ScoringPool
+from pipeline_stages import Pipeline, PipelineStage
+from metrics import RunMetrics, set_active_record, get_active_record
+from retry import RetryPolicy
+from scheduler import LengthAwareScheduler
+from dedup import find_duplicate_clusters, fan_out, report_duplicate_clusters, PairResultCache
 
 
 def store_result_pickle(results_array, filepath):
@@ -23,95 +33,463 @@ def store_result_pickle(results_array, filepath):
         print("Stored candidate functions to " + filepath)
 
 
-def get_prompt_messages(string):
+# Prompt templates which can be compared in a sweep, '{java_8_string}' in the user prompt is replaced by the Java 8 function
+PROMPT_TEMPLATES = {
+    "default": {
+        "system": "You are a senior Java engineer. Convert Java 8 code to Java 11 while preserving behavior."
+                  "Change any syntax in the Java 8 code that was removed or deprecated by Java 11."
+                  "Output ONLY the Java 11 method.",
+        "user": "Migrate the following Java 8 method (encapsulated within the <Java> and </Java> tags) to Java 11.\n\n"
+                "<Java>\n{java_8_string}</Java>"
+    },
+    "removed_apis": {
+        "system": "You are a senior Java engineer. Convert Java 8 code to Java 11 while preserving behavior."
+                  "Replace any APIs that were removed from the JDK in Java 11 (JAXB, JAX-WS, JAF, CORBA, JTA and Nashorn) with supported alternatives."
+                  "Output ONLY the Java 11 method in a ```java code block.",
+        "user": "Migrate the following Java 8 method (encapsulated within the <Java> and </Java> tags) to Java 11.\n\n"
+                "<Java>\n{java_8_string}</Java>"
+    }
+}
+
+
+def get_prompt_messages(string, template="default"):
     """
     Function to generate the role based prompt based on the input string
     :param string: Java 8 Function to include in the prompt
+    :param template: Name of the prompt template to use (a key of PROMPT_TEMPLATES)
     :return: prompt_messages - an array of dictionaries which represents a role based prompt
     """
     prompt_messages = [
         # Formulate the system prompt
-        {"role": "system", "content":
-            "You are a senior Java engineer. Convert Java 8 code to Java 11 while preserving behavior."
-            "Change any syntax in the Java 8 code that was removed or deprecated by Java 11."
-            "Output ONLY the Java 11 method."
-         },
+        {"role": "system", "content": PROMPT_TEMPLATES[template]["system"]},
         # Formulate the user prompt and inject the java 8 string between the <Java>...</Java> tags
-        {"role": "user", "content":
-            "Migrate the following Java 8 method (encapsulated within the <Java> and </Java> tags) to Java 11.\n\n"
-            "<Java>\n" + string + "</Java>"
-         },
+        {"role": "user", "content": PROMPT_TEMPLATES[template]["user"].replace("{java_8_string}", string)},
     ]
     # Return the array of prompt messages
     return prompt_messages
 
 
-def prompt_mistral_api(java_8_string, function_name, model="codestral-latest"):
+def extract_java_code(response_message):
     """
-    Function to prompt the mistral API using an input string and model choice
+    Function to isolate the generated Java code from the LLM response
+    :param response_message: The full textual response from the LLM
+    :return: A string of the Generated Java 11 Function
+    """
+    # Isolate the Java 11 code which is placed within '''java ... '''
+    code_end = find_code_block_end(response_message)
+    if code_end != -1:
+        # Ignore anything the model wrote after the closing fence
+        return response_message[response_message.find("```java\n") + 8:code_end - 4]
+    return response_message[response_message.find("```java\n") + 8:len(response_message) - 4]
+
+
+def find_code_block_end(response_message):
+    """
+    Function to find where the Java code block of a (partial) LLM response closes
+    :param response_message: The textual response from the LLM received so far
+    :return: Position just after the closing ''', or -1 if the code block has not closed yet
+    """
+    start = response_message.find("```java\n")
+    if start == -1:
+        return -1
+    end = response_message.find("\n```", start + 8)
+    return -1 if end == -1 else end + 4
+
+
+def stream_generation(backend, prompt_messages, model, temperature, max_tokens, record=None):
+    """
+    Function to stream a response from a backend, cancelling the request as soon as the Java code block closes
+    (anything the model writes after the method, such as an explanation, is never generated)
+    :param backend: Backend to send the prompt to
+    :param prompt_messages: Array of dictionaries which represents a role based prompt
+    :param model: The model to send the prompt to
+    :param temperature: Sampling temperature
+    :param max_tokens: Maximum number of tokens to generate
+    :param record: Optional metrics record to store the time to first token and the time to code complete to
+    :return: Dictionary of the response (in the same shape as LLMBackend.complete)
+    """
+    request_start = time.monotonic()
+    content = ""
+    finish_reason = prompt_tokens = completion_tokens = None
+    chunks = backend.stream(prompt_messages, model, temperature, max_tokens)
+    try:
+        for chunk in chunks:
+            if not content and chunk['content'] and record is not None:
+                record['time_to_first_token'] = time.monotonic() - request_start
+            content += chunk['content']
+            finish_reason = chunk['finish_reason'] or finish_reason
+            if chunk['prompt_tokens'] is not None:
+                prompt_tokens = chunk['prompt_tokens']
+            if chunk['completion_tokens'] is not None:
+                completion_tokens = chunk['completion_tokens']
+
+            code_end = find_code_block_end(content)
+            if code_end != -1:
+                # The code is complete, drop anything after the closing fence and stop reading (closing the stream cancels the request)
+                if record is not None:
+                    record['time_to_code_complete'] = time.monotonic() - request_start
+                content = content[:code_end]
+                finish_reason = "stop"
+                break
+    finally:
+        chunks.close()
+
+    # A cancelled stream does not report its token usage, so estimate it
+    if prompt_tokens is None:
+        prompt_tokens = sum(estimate_token_count(message['content']) for message in prompt_messages)
+    if completion_tokens is None:
+        completion_tokens = estimate_token_count(content)
+    return {
+        'content': content,
+        'finish_reason': finish_reason,
+        'prompt_tokens': prompt_tokens,
+        'completion_tokens': completion_tokens,
+        'status_code': 200
+    }
+
+
+def request_generation(java_8_string, function_name, client_pool, model, temperature=0, max_tokens=2048, cache=None, template="default",
+                       max_tokens_limit=8192, stream=False):
+    """
+    Function to prompt an LLM using a backend borrowed from a client pool
+    If the response was cut off by max_tokens (finish_reason 'length') it is requested again with double the budget, up to max_tokens_limit
     :param java_8_string: The Java 8 string to include in the prompt
-    :param model: The MistralAI Model to send the prompt to
+    :param function_name: Name of the function being migrated (for logging)
+    :param client_pool: ClientPool of backends to send the prompt through
+    :param model: The model to send the prompt to
+    :param temperature: Sampling temperature
+    :param max_tokens: Maximum number of tokens to generate
+    :param cache: Optional ResponseCache to read responses from and store new responses to
+    :param template: Name of the prompt template to use (a key of PROMPT_TEMPLATES)
+    :param max_tokens_limit: Largest max_tokens a truncated response is requested again with
+    :param stream: Stream the response and stop generating once the Java code block closes
     :return: A string of the Generated Java 11 Function (post extraction)
     """
-    print("Prompting Mistral API: " + function_name)
+    # Generate the prompt messages array using the function above.
+    prompt_messages = get_prompt_messages(java_8_string, template)
+    # Metrics record of the data item being prompted (None when called outside of run_program)
+    record = get_active_record()
+    # A scheduler may have chosen the max_tokens of this data item
+    if record is not None and record['max_tokens'] is not None:
+        max_tokens = record['max_tokens']
 
-    # Initialise the MistralAPI client using the API key from the environment variable 'MISTRAL_API_KEY'
-    client = Mistral(api_key=os.environ["MISTRAL_API_KEY"])
+    while True:
+        # If an identical request has been made before, reuse the cached response instead of prompting the LLM
+        response = None
+        if cache is not None:
+            cache_key = ResponseCache.make_key(model, prompt_messages, temperature, max_tokens)
+            response = cache.get(cache_key)
+            if response is not None and record is not None:
+                record['cache_hit'] = True
 
-    # Generate the prompt messages array using the function above.
-    prompt_messages = get_prompt_messages(java_8_string)
-
-    # Prompt the mistral API and store the response in to 'response'
-    response = client.chat.complete(
-        model=model,
-        messages=prompt_messages,
-        temperature=0,
-        max_tokens=2048
-    )
-
-    # Extract textual data from the response
-    response_message = response.choices[0].message.content
-    # Isolate the Java 11 code which is placed within '''java ... '''
-    generated_code = response_message[response_message.find("```java\n") + 8:len(response_message) - 4]
+        if response is None:
+            print("Prompting " + model + ": " + function_name)
+            # Borrow a backend from the pool and prompt the LLM, the backend is returned to the pool afterwards
+            with client_pool.borrow() as backend:
+                request_start = time.monotonic()
+                try:
+                    if stream:
+                        response = stream_generation(backend, prompt_messages, model, temperature, max_tokens, record)
+                    else:
+                        response = backend.complete(prompt_messages, model, temperature, max_tokens)
+                except LLMRequestError as error:
+                    if record is not None:
+                        record['status_code'] = error.status_code
+                    raise
+            # Record the latency, token usage and status of the request
+            if record is not None:
+                record['request_latency'] = time.monotonic() - request_start
+                record['prompt_tokens'] = response['prompt_tokens']
+                record['completion_tokens'] = response['completion_tokens']
+                record['status_code'] = response['status_code']
+            if cache is not None:
+                cache.put(cache_key, response)
+
+        # Request a response which was cut off by max_tokens again with a larger budget
+        if response['finish_reason'] != "length" or max_tokens >= max_tokens_limit:
+            break
+        max_tokens = min(max_tokens_limit, max_tokens * 2)
+        print("Response for " + function_name + " was truncated, requesting it again with max_tokens " + str(max_tokens))
+        if record is not None:
+            record['truncations'] += 1
+            record['max_tokens'] = max_tokens
 
     # Return the string representation of the isolated java code
-    return generated_code
+    return extract_java_code(response['content'])
+
+
+def make_prompt_function(client_pool, model, temperature=0, max_tokens=2048, cache=None, template="default", max_tokens_limit=8192, stream=False):
+    """
+    Function to build a prompt function (for run_program) which sends its prompts through a client pool
+    :param client_pool: ClientPool of backends to send the prompts through
+    :param model: The model to send the prompts to
+    :param temperature: Sampling temperature
+    :param max_tokens: Maximum number of tokens to generate
+    :param cache: Optional ResponseCache shared by every prompt
+    :param template: Name of the prompt template to use (a key of PROMPT_TEMPLATES)
+    :param max_tokens_limit: Largest max_tokens a truncated response is requested again with
+    :param stream: Stream the responses and stop generating once the Java code block closes
+    :return: Function which takes the Java 8 string and function name and returns the generated Java 11 string
+    """
+    def prompt_function(java_8_string, function_name):
+        return request_generation(java_8_string, function_name, client_pool, model, temperature, max_tokens, cache, template, max_tokens_limit,
+                                  stream)
+    # Let run_program estimate the prompt tokens with the same template the prompts are sent with
+    prompt_function.template = template
+    return prompt_function
 
 
-def run_program(dataset, prompt_function, output_filepath):
+def prompt_mistral_api(java_8_string, function_name, model="codestral-latest", stream=False):
+    """
+    Function to prompt the mistral API using an input string and model choice
+    The client is taken from a pool shared by every call, using the API key from the environment variable 'MISTRAL_API_KEY'
+    :param java_8_string: The Java 8 string to include in the prompt
+    :param model: The MistralAI Model to send the prompt to
+    :param stream: Stream the response and stop generating once the Java code block closes
+    :return: A string of the Generated Java 11 Function (post extraction)
+    """
+    return request_generation(java_8_string, function_name, get_shared_mistral_pool(), model, stream=stream)
+
+
+def estimate_prompt_tokens(java_8_string, template="default"):
+    """
+    Function to estimate the total number of tokens a prompt will use (used by the tokens per minute limit)
+    :param java_8_string: The Java 8 string to include in the prompt
+    :param template: Name of the prompt template the prompt is sent with (a key of PROMPT_TEMPLATES)
+    :return: Estimated number of prompt tokens plus the expected number of generated tokens
+    """
+    prompt_tokens = sum(estimate_token_count(message['content']) for message in get_prompt_messages(java_8_string, template))
+    # The migrated function is expected to be roughly the same size as the Java 8 function
+    return prompt_tokens + estimate_token_count(java_8_string)
+
+
+def run_program(dataset, prompt_function, output_filepath, max_workers=1, requests_per_second=None, tokens_per_minute=None, journal_filepath=None,
+                baseline_scores=None, scoring_workers=None, scoring_batch_size=4, queue_size=16, monitor_interval=30, metrics_filepath=None,
+                rate_limiter=None, scoring_pool=None, retry_policy=None, scheduler=None, deduplicate=True, skip_failed=False,
+                result_cache=None):
     """
     Function to run the prompting pipeline over the whole dataset
+    The data items stream through three stages with bounded queues between them: generation (network-bound threads),
+    scoring (CPU-bound processes) and writing (the result journal), so the stages overlap and a slow stage holds the others back
+    Each completed data item is appended to a journal straight away, so if the run is interrupted
+    calling run_program again with the same arguments skips the items that were already completed
     :param dataset: Dataset to process through the LLM
-    :param prompt_function: Function to use to prompt the LLM (allows some other LLMs to be plugged into this function)
+    :param prompt_function: Function to use to prompt the LLM (allows some other LLMs to be plugged into this function). Its 'template'
+        attribute (set by make_prompt_function) is the prompt template used to estimate the tokens of each prompt, 'default' if it has none
     :param output_filepath: filepath to store the results dataset to
-    :return:
+    :param max_workers: Number of prompts that can be in flight at the same time (1 prompts the functions one by one)
+    :param requests_per_second: Maximum number of prompts to send per second (None for no limit)
+    :param tokens_per_minute: Maximum number of (estimated) tokens to send per minute (None for no limit)
+    :param journal_filepath: filepath of the result journal (defaults to the output filepath with '.journal' appended)
+    :param baseline_scores: Optional dictionary of stored Java 8 vs Java 11 scores (from load_baseline_scores) to reuse
+    :param scoring_workers: Number of processes used to calculate CodeBLEU scores (defaults to the number of cores)
+    :param scoring_batch_size: Maximum number of data items sent to a scoring process at once
+    :param queue_size: Maximum number of data items waiting in front of each stage
+    :param monitor_interval: Seconds between queue depth updates written to the console (None for no updates)
+    :param metrics_filepath: filepath of the per-item metrics JSONL file (defaults to the output filepath with '.metrics.jsonl' appended)
+    :param rate_limiter: Optional RateLimiter shared with other runs (replaces requests_per_second and tokens_per_minute)
+    :param scoring_pool: Optional ScoringPool shared with other runs (replaces scoring_workers, it is not closed by this run)
+    :param retry_policy: Optional RetryPolicy (or RetryScope of a shared policy) used to retry failed prompts (defaults to a new policy allowing max_workers prompts in flight)
+    :param scheduler: Optional LengthAwareScheduler which orders the data items and sets the max_tokens of each one (None keeps the dataset order)
+    :param deduplicate: Prompt and score each unique function pair once and copy the results to its duplicates
+    :param skip_failed: Record data items whose prompt fails and carry on, instead of stopping the run. The results of the other items
+        are stored, the failed items are listed in a '.failed.json' file next to the results, and the journal is kept so running again
+        only processes the failed items
+    :param result_cache: Optional PairResultCache shared with other runs (with the same prompt settings), pairs it already holds are copied
+        instead of prompted and scored, and the results of this run are added to it
+    :return: Array of (index, data item, error) tuples of the failed data items (empty unless skip_failed is set)
     """
     print("Starting the Prompt Pipeline")
-    # Prepare data structure to store the dataset with the results included
-    dataset_including_results = []
 
-    # Iterate over each data item in the dataset
-    for data_item in dataset:
+    # Open the journal, this loads any items completed by a previous (interrupted) run
+    if journal_filepath is None:
+        journal_filepath = output_filepath + ".journal"
+    journal = ResultJournal(journal_filepath)
+
+    # Only the data items which are not already in the journal need to be processed
+    remaining = [(index, data_item) for index, data_item in enumerate(dataset) if not journal.is_completed(index, data_item)]
+    # Only the first data item of each duplicate pair is processed, the others receive its results when it is written
+    duplicates = {}
+    if deduplicate:
+        remaining, duplicates = find_duplicate_clusters(remaining)
+        if duplicates:
+            report_duplicate_clusters(remaining, duplicates, output_filepath + ".duplicates.json")
+    # Pairs which an earlier run (e.g. the other split of the web scraped dataset) has already processed are copied from the result cache
+    cached_items = []
+    if result_cache is not None:
+        uncached = []
+        for index, data_item in remaining:
+            results = result_cache.get(data_item)
+            if results is None:
+                uncached.append((index, data_item))
+            else:
+                cached_items.append((index, data_item, results))
+        remaining = uncached
+        print(str(len(cached_items)) + " pairs were copied from the result cache of earlier runs")
+    # Dispatch the longest functions first (the journal keeps the results in dataset order)
+    if scheduler is not None:
+        remaining = scheduler.order(remaining)
+
+    # Record per-item metrics (timings, tokens, status codes) to a JSONL file next to the results
+    if metrics_filepath is None:
+        metrics_filepath = output_filepath + ".metrics.jsonl"
+    metrics = RunMetrics(metrics_filepath)
+
+    # Create a single rate limiter which is shared by all of the prompting threads (unless one is shared between runs)
+    if rate_limiter is None:
+        rate_limiter = RateLimiter(requests_per_second, tokens_per_minute)
+    prompt_template = getattr(prompt_function, 'template', "default")
+    # Create the process pool which calculates the CodeBLEU scores (unless one is shared between runs)
+    shared_scoring_pool = scoring_pool is not None
+    if not shared_scoring_pool:
+        scoring_pool = ScoringPool(scoring_workers)
+    # Failed prompts are retried with backoff, and the number of prompts in flight is lowered while the API throttles
+    if retry_policy is None:
+        retry_policy = RetryPolicy(max_concurrency=max_workers)
+    # Data items whose prompt failed (only collected when skip_failed is set)
+    failed = []
+    failed_lock = threading.Lock()
+    # Number of data items the scoring stage has scored (failed, deduplicated and cached items are never scored)
+    scored_items = 0
+    scored_lock = threading.Lock()
+
+    def write_duplicate_record(duplicate_index, duplicate_item, error=None):
+        # Every duplicate (and every pair copied from the result cache) gets a metrics record too, so the metrics cover every item of the results
+        record = metrics.new_record(duplicate_index, duplicate_item['name'])
+        record['deduplicated'] = True
+        record['error'] = error
+        metrics.write(record)
+
+    def generate(queued_item):
         # Locate function strings in the dataset
+        index, data_item, record = queued_item
         java_8_string = data_item['java_8_function']['string']
         java_11_string = data_item['java_11_function']['string']
+        record['queue_wait'] = time.monotonic() - record['enqueued_at']
+        if scheduler is not None:
+            record['max_tokens'] = scheduler.max_tokens(data_item)
 
-        # Prompt the mistral LLM using the Java 8 function
-        generated_java_11_mistral = prompt_function(java_8_string, data_item['name'])
+        record['rate_limit_wait'] = 0
+
+        def attempt_prompt():
+            # Wait until the rate limits allow another prompt to be sent (every retry counts towards the limits too)
+            start = time.monotonic()
+            rate_limiter.acquire(estimate_prompt_tokens(java_8_string, prompt_template))
+            record['rate_limit_wait'] += time.monotonic() - start
+            return prompt_function(java_8_string, data_item['name'])
+
+        # Prompt the LLM using the Java 8 function (retrying if it fails), making the record available to request_generation
+        start = time.monotonic()
+        set_active_record(record)
+        try:
+            generated_java_11_mistral = retry_policy.call(attempt_prompt, record=record)
+        except Exception as error:
+            # Write the record of the failed item before the failure stops the pipeline
+            record['error'] = repr(error)
+            metrics.write(record)
+            if not skip_failed:
+                raise
+            # Drop the item (and its duplicates) from the pipeline and carry on with the others
+            with failed_lock:
+                failed.append((index, data_item, repr(error)))
+                for duplicate_index, duplicate_item in duplicates.get(index, []):
+                    failed.append((duplicate_index, duplicate_item, repr(error)))
+                    write_duplicate_record(duplicate_index, duplicate_item, repr(error))
+            return None
+        finally:
+            set_active_record(None)
+        record['generation_time'] = time.monotonic() - start
 
         # Add the generated string to the data item
         data_item['generated_java_11_string'] = generated_java_11_mistral
 
-        # Calculate the codebelu comparison between the input Java 8 code and the true Java 11 code and store the metrics to the data item
-        data_item['java_8_11_comparison'] = calc_codebleu(predictions=[java_8_string], references=[java_11_string], lang="java")
-        # Calculate the codebleu comparison between the generated Java 11 code and the true Java 11 code and store the metrics to the data item
-        data_item['java_11_11_comparison'] = calc_codebleu(predictions=[generated_java_11_mistral], references=[java_11_string], lang="java")
+        # The codebleu comparison between the generated Java 11 code and the true Java 11 code always needs to be scored
+        comparisons = [('java_11_11_comparison', generated_java_11_mistral, java_11_string)]
+        # Reuse the stored comparison between the input Java 8 code and the true Java 11 code if there is one
+        if baseline_scores is not None and pair_key(data_item) in baseline_scores:
+            data_item['java_8_11_comparison'] = baseline_scores[pair_key(data_item)]
+        else:
+            comparisons.append(('java_8_11_comparison', java_8_string, java_11_string))
+        return index, data_item, record, comparisons
+
+    def score(batch):
+        nonlocal scored_items
+        # Score the comparisons of every data item in the batch together in one of the scoring processes
+        requests = [((position, comparison), prediction, reference)
+                    for position, (index, data_item, record, comparisons) in enumerate(batch)
+                    for comparison, prediction, reference in comparisons]
+        start = time.monotonic()
+        scores = scoring_pool.score(requests)
+        # Store the metrics to the data items
+        for (position, comparison), codebleu_metrics in scores:
+            batch[position][1][comparison] = codebleu_metrics
+        for index, data_item, record, comparisons in batch:
+            record['scoring_time'] = time.monotonic() - start
+        with scored_lock:
+            scored_items += len(batch)
+        return [(index, data_item, record) for index, data_item, record, comparisons in batch]
 
-        # Append the data item with the results to the new dataset
-        dataset_including_results.append(data_item)
+    def write(queued_item):
+        # Append the data item with the results to the journal, then write its metrics record
+        index, data_item, record = queued_item
+        journal.append(index, data_item)
+        metrics.write(record)
+        if result_cache is not None:
+            result_cache.put(data_item)
+        # Fan the results out to the duplicates of this function pair
+        for duplicate_index, duplicate_item in duplicates.get(index, []):
+            fan_out(data_item, duplicate_item, baseline_scores)
+            journal.append(duplicate_index, duplicate_item)
+            write_duplicate_record(duplicate_index, duplicate_item)
 
-    # Store the dataset containing results to a new pkl file (for further processing)
+    # Store the results copied from the result cache (and fan them out to the duplicates of each pair)
+    for index, data_item, results in cached_items:
+        fan_out(results, data_item, baseline_scores)
+        journal.append(index, data_item)
+        write_duplicate_record(index, data_item)
+        for duplicate_index, duplicate_item in duplicates.get(index, []):
+            fan_out(results, duplicate_item, baseline_scores)
+            journal.append(duplicate_index, duplicate_item)
+            write_duplicate_record(duplicate_index, duplicate_item)
+
+    # Build the pipeline, each stage has its own workers and a bounded queue in front of it
+    pipeline = Pipeline([
+        PipelineStage("generation", generate, workers=max_workers, queue_size=queue_size),
+        PipelineStage("scoring", score, workers=scoring_pool.workers, queue_size=queue_size, batch_size=scoring_batch_size),
+        PipelineStage("writing", write, workers=1, queue_size=queue_size)
+    ], monitor_interval=monitor_interval)
+
+    try:
+        # Each item gets its metrics record as it is queued for generation
+        pipeline.run((index, data_item, metrics.new_record(index, data_item['name'])) for index, data_item in remaining)
+    finally:
+        # Shut down the scoring processes and close the journal (it is kept if the run failed, so it can be resumed)
+        if not shared_scoring_pool:
+            scoring_pool.close()
+        journal.close()
+        metrics.close()
+    scoring_pool.report(scored_items)
+    retry_policy.report()
+    metrics.summary()
+
+    # Compact the journal into the dataset containing results (in dataset order)
+    dataset_including_results = journal.compact(dataset, allow_missing=bool(failed))
+
+    # Store the dataset containing results to a new pkl file (for further processing), then remove the journal
     store_result_pickle(dataset_including_results, output_filepath)
+    if failed:
+        # Keep the journal, so running again only processes the failed items
+        failed.sort(key=lambda failure: failure[0])
+        with open(output_filepath + ".failed.json", "w", encoding="utf-8") as my_file:
+            json.dump([{'index': index, 'name': data_item['name'], 'error': error} for index, data_item, error in failed], my_file, indent=1)
+        print(str(len(failed)) + " data items failed and were left out of the results (listed in " + output_filepath + ".failed.json), "
+              + "the journal " + journal_filepath + " is kept so running again only processes them")
+    else:
+        journal.remove()
+        if os.path.exists(output_filepath + ".failed.json"):
+            # The items which failed in an earlier run have now been processed
+            os.remove(output_filepath + ".failed.json")
+    return failed
 
 
 if __name__ == '__main__':
@@ -120,15 +498,37 @@ if __name__ == '__main__':
     # Declare the Mistral API Key
     os.environ['MISTRAL_API_KEY'] = "QQBs9YH3MvPEZ8U8Zsb1suTjS0EMyZS5"
 
+    # Create the Mistral client pool once for the whole run, every prompting worker shares its connections
+    max_workers = 4
+    client_pool = create_mistral_pool(os.environ['MISTRAL_API_KEY'], size=max_workers)
+    # Responses are cached on disk, so re-running with unchanged prompts and settings does not prompt the API again
+    response_cache = ResponseCache("./../Shared_Files/response_cache")
+    # Responses are streamed, so generation stops as soon as the Java code block is complete
+    prompt_function = make_prompt_function(client_pool, "codestral-latest", cache=response_cache, stream=True)
+    # Send the longest functions first, each with a max_tokens budget sized to the function
+    scheduler = LengthAwareScheduler()
+
     # Run the secondary dataset through the pipeline
     print("Started Processing the Secondary Dataset")
     dataset = read_dataset('./../Shared_Files/synthetic_dataset.pkl', silent=False)
-    run_program(dataset, prompt_mistral_api, "./../Shared_Files/mistral_results_synthetic_ds.pkl")
+    # The Java 8 vs Java 11 scores only depend on the dataset, so they are computed once and stored next to it
+    baseline_scores = load_baseline_scores(dataset, './../Shared_Files/synthetic_dataset.pkl')
+    # Keep a few prompts in flight at once while staying under the Mistral API rate limits
+    run_program(dataset, prompt_function, "./../Shared_Files/mistral_results_synthetic_ds.pkl",
+                max_workers=max_workers, requests_per_second=1, tokens_per_minute=500000, baseline_scores=baseline_scores, scheduler=scheduler)
     print("Program Completed (Uncomment the remaining lines to process the full dataset)")
 
     # Run the initial full dataset through the pipeline
     #print("\n\nStarted Processing the Full Dataset")
     #dataset_same = read_dataset('web_scraped_ds_same_params.pkl', silent=False)
     #dataset_diff = read_dataset('web_scraped_ds_diff_params.pkl', silent=False)
-    #run_program(dataset_same, prompt_mistral_api, "mistral_results_web_scraped_same_params.pkl")
-    #run_program(dataset_diff, prompt_mistral_api, "mistral_results_web_scraped_diff_params.pkl")
+    # Pairs found in both splits are only prompted and scored once, the second split copies them from the result cache
+    #pair_results = PairResultCache("./../Shared_Files/pair_results", "codestral-latest/default")
+    #run_program(dataset_same, prompt_function, "mistral_results_web_scraped_same_params.pkl", max_workers=max_workers, requests_per_second=1, tokens_per_minute=500000,
+    #            baseline_scores=load_baseline_scores(dataset_same, 'web_scraped_ds_same_params.pkl'), scheduler=scheduler, result_cache=pair_results)
+    #run_program(dataset_diff, prompt_function, "mistral_results_web_scraped_diff_params.pkl", max_workers=max_workers, requests_per_second=1, tokens_per_minute=500000,
+    #            baseline_scores=load_baseline_scores(dataset_diff, 'web_scraped_ds_diff_params.pkl'), scheduler=scheduler, result_cache=pair_results)
+
+    # Output the cache statistics and close the client pool and its connections
+    response_cache.report()
+    client_pool.close()
@@ -0,0 +1,91 @@
+"""
+This python file holds the rate limiting utilities used by the prompting pipeline
+A token bucket is used to limit the number of requests sent per second and the number of tokens sent per minute
+"""
+import threading, time
+
+
+def estimate_token_count(text):
+    """
+    Function to roughly estimate the number of tokens in a string (roughly 4 characters per token for code)
+    :param text: String to estimate the number of tokens for
+    :return: Integer estimate of the number of tokens
+    """
+    return len(text) // 4 + 1
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket which refills continuously at a fixed rate, up to a maximum capacity
+    """
+
+    def __init__(self, rate, capacity):
+        """
+        :param rate: Number of tokens added to the bucket every second
+        :param capacity: Maximum number of tokens the bucket can hold (the largest allowed burst)
+        """
+        self.rate = rate
+        self.capacity = capacity
+        # Start with a full bucket so the first requests are not delayed
+        self.tokens = capacity
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        """
+        Function to add the tokens that have accumulated since the last refill (must be called holding the lock)
+        :return: None
+        """
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+    def acquire(self, amount=1):
+        """
+        Function to block until 'amount' tokens are available, then remove them from the bucket
+        :param amount: Number of tokens to take (clamped to the capacity so a large request can still go through)
+        :return: None
+        """
+        amount = min(amount, self.capacity)
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= amount:
+                    # Enough tokens are available, take them and return
+                    self.tokens -= amount
+                    return
+                # Work out how long it will take for the missing tokens to accumulate
+                wait = (amount - self.tokens) / self.rate
+            # Sleep outside the lock so other threads can still check the bucket
+            time.sleep(wait)
+
+
+class RateLimiter:
+    """
+    Combined requests per second and tokens per minute limiter, shared by all prompting workers
+    """
+
+    def __init__(self, requests_per_second=None, tokens_per_minute=None):
+        """
+        :param requests_per_second: Maximum number of requests per second (None for no limit)
+        :param tokens_per_minute: Maximum number of tokens per minute (None for no limit)
+        """
+        self.request_bucket = None
+        self.token_bucket = None
+        if requests_per_second:
+            # Allow a burst of at most one second worth of requests
+            self.request_bucket = TokenBucket(requests_per_second, max(1, requests_per_second))
+        if tokens_per_minute:
+            # Allow a burst of at most one minute worth of tokens
+            self.token_bucket = TokenBucket(tokens_per_minute / 60, tokens_per_minute)
+
+    def acquire(self, tokens=0):
+        """
+        Function to block until a request using 'tokens' tokens is allowed to be sent
+        :param tokens: The (estimated) number of tokens the request will use
+        :return: None
+        """
+        if self.token_bucket is not None and tokens:
+            self.token_bucket.acquire(tokens)
+        if self.request_bucket is not None:
+            self.request_bucket.acquire(1)
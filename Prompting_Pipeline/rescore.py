@@ -0,0 +1,62 @@
+"""
+This python file re-scores an existing results pkl file without prompting the LLM again
+The CodeBLEU comparisons are recalculated from the stored generated Java 11 strings using the scoring process pool,
+which is useful when the CodeBLEU settings change or new metrics are added
+Usage: python rescore.py [results.pkl output.pkl]
+"""
+import sys, os
+from concurrent.futures import ThreadPoolExecutor
+from Shared_Files.utils import read_dataset
+from scoring import ScoringPool
+from prompting_pipeline import store_result_pickle
+
+
+def rescore(results_filepath, output_filepath, scoring_workers=None, batch_size=8):
+    """
+    Function to recalculate the CodeBLEU comparisons of a results dataset and store it to a new file
+    :param results_filepath: Filepath of the existing results pkl file (produced by run_program)
+    :param output_filepath: Filepath to store the re-scored results to
+    :param scoring_workers: Number of processes used to calculate CodeBLEU scores (defaults to the number of cores)
+    :param batch_size: Number of data items sent to a scoring process at once
+    :return: Array of the re-scored data items
+    """
+    # Read the results dataset from the pkl file
+    results = read_dataset(results_filepath, silent=False)
+
+    # Build both comparisons for every data item, keyed by the position of the data item in the results
+    requests = []
+    for position, data_item in enumerate(results):
+        java_11_string = data_item['java_11_function']['string']
+        requests.append(((position, 'java_8_11_comparison'), data_item['java_8_function']['string'], java_11_string))
+        requests.append(((position, 'java_11_11_comparison'), data_item['generated_java_11_string'], java_11_string))
+
+    # Split the comparisons into batches (two comparisons per data item)
+    batches = [requests[start:start + batch_size * 2] for start in range(0, len(requests), batch_size * 2)]
+
+    # Score the batches in parallel, one thread per scoring process keeps every process busy
+    scoring_pool = ScoringPool(scoring_workers)
+    try:
+        with ThreadPoolExecutor(max_workers=scoring_pool.workers) as executor:
+            for scores in executor.map(scoring_pool.score, batches):
+                # Store the new metrics to the data items
+                for (position, comparison), metrics in scores:
+                    results[position][comparison] = metrics
+    finally:
+        scoring_pool.close()
+    scoring_pool.report(len(results))
+
+    # Store the re-scored results to the new pkl file
+    store_result_pickle(results, output_filepath)
+    return results
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 3:
+        # Re-score a single results file given on the command line
+        rescore(sys.argv[1], sys.argv[2])
+    else:
+        # Re-score every stored results file, writing the new scores next to the original file
+        for filepath in ['./../Shared_Files/mistral_results_synthetic_ds.pkl',
+                         './../Shared_Files/mistral_results_web_scraped_same_params.pkl',
+                         './../Shared_Files/mistral_results_web_scraped_diff_params.pkl']:
+            rescore(filepath, os.path.splitext(filepath)[0] + "_rescored.pkl")
@@ -0,0 +1,73 @@
+"""
+This python file holds the on-disk cache of LLM responses used by the prompting pipeline
+Each response is stored in its own pkl file, named by a hash of the model, prompt messages, temperature and max_tokens,
+so re-running the pipeline with unchanged settings reads the responses from disk instead of prompting the LLM again
+"""
+import hashlib, json, threading
+from Shared_Files.disk_cache import DiskLRUCache
+
+
+class ResponseCache:
+    """
+    Thread-safe, content-addressed response cache with least recently used eviction once the size limit is reached
+    """
+
+    def __init__(self, directory, max_bytes=512 * 1024 * 1024):
+        """
+        :param directory: Directory to store the cached responses in (created if it does not exist, it can be shared between processes)
+        :param max_bytes: Maximum total size of the cached responses before the least recently used are evicted
+        """
+        self.directory = directory
+        self.store = DiskLRUCache(directory, max_bytes)
+        self.lock = threading.Lock()
+
+        # Counters used for the hit/miss report (of this process)
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(model, messages, temperature, max_tokens):
+        """
+        Function to build the cache key for a request
+        :param model: Name of the model the prompt is sent to
+        :param messages: Array of dictionaries which represents a role based prompt
+        :param temperature: Sampling temperature
+        :param max_tokens: Maximum number of tokens to generate
+        :return: Hex string of the SHA-256 hash of the request
+        """
+        request = json.dumps([model, messages, temperature, max_tokens], sort_keys=True)
+        return hashlib.sha256(request.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """
+        Function to read a response from the cache
+        :param key: Cache key built with make_key
+        :return: The cached response dictionary, or None if the response is not cached
+        """
+        response = self.store.get(key)
+        with self.lock:
+            if response is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return response
+
+    def put(self, key, response):
+        """
+        Function to store a response in the cache, evicting the least recently used responses if needed
+        :param key: Cache key built with make_key
+        :param response: Response dictionary to store
+        :return: None
+        """
+        self.store.put(key, response)
+
+    def report(self):
+        """
+        Function to output the hit/miss statistics of the cache to the console
+        :return: None
+        """
+        lookups = self.hits + self.misses
+        hit_rate = (self.hits / lookups * 100) if lookups else 0
+        entries, total_bytes = self.store.usage()
+        print("Response cache: " + str(self.hits) + " hits, " + str(self.misses) + " misses (" + str(round(hit_rate, 2)) + "% hit rate), "
+              + str(self.store.evictions) + " evictions, " + str(entries) + " entries using " + str(round(total_bytes / 1024 / 1024, 2)) + " MB")
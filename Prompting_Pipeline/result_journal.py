@@ -0,0 +1,109 @@
+"""
+This python file holds the append-only journal used to make prompting runs crash-safe and resumable
+Each completed data item is appended to the journal as soon as it is finished (as a length prefixed pickle frame),
+so an interrupted run can skip the items that were already completed when it is restarted
+"""
+import os, pickle, struct, threading
+
+# Every frame starts with the length of the pickled record stored as an unsigned 64 bit integer
+FRAME_HEADER = struct.Struct("<Q")
+
+
+class ResultJournal:
+    """
+    Append-only journal of completed data items, keyed by their index in the dataset
+    """
+
+    def __init__(self, filepath):
+        """
+        :param filepath: Filepath of the journal (created if it does not exist, resumed if it does)
+        """
+        self.filepath = filepath
+        self.lock = threading.Lock()
+        # Dictionary of dataset index -> completed data item
+        self.completed = {}
+        self.load()
+        self.file = open(filepath, "ab")
+
+    def load(self):
+        """
+        Function to read the completed items from an existing journal
+        A partially written frame at the end of the journal (from a crash) is discarded
+        :return: None
+        """
+        if not os.path.exists(self.filepath):
+            return
+
+        valid_length = 0
+        with open(self.filepath, "rb") as my_file:
+            while True:
+                header = my_file.read(FRAME_HEADER.size)
+                if len(header) < FRAME_HEADER.size:
+                    break
+                (length,) = FRAME_HEADER.unpack(header)
+                payload = my_file.read(length)
+                if len(payload) < length:
+                    break
+                index, data_item = pickle.loads(payload)
+                self.completed[index] = data_item
+                valid_length = my_file.tell()
+
+        # Cut off any incomplete frame so new frames are appended after the last complete one
+        if valid_length != os.path.getsize(self.filepath):
+            print("Discarding an incomplete record at the end of " + self.filepath)
+            with open(self.filepath, "r+b") as my_file:
+                my_file.truncate(valid_length)
+
+        if self.completed:
+            print("Resuming from " + self.filepath + " with " + str(len(self.completed)) + " completed items")
+
+    def is_completed(self, index, data_item):
+        """
+        Function to check if a data item was already completed in a previous run
+        :param index: Index of the data item in the dataset
+        :param data_item: The data item itself (the name must match the journaled item)
+        :return: Boolean - True if the item is in the journal
+        """
+        return index in self.completed and self.completed[index]['name'] == data_item['name']
+
+    def append(self, index, data_item):
+        """
+        Function to durably append a completed data item to the journal
+        :param index: Index of the data item in the dataset
+        :param data_item: The data item including its results
+        :return: None
+        """
+        payload = pickle.dumps((index, data_item))
+        with self.lock:
+            self.file.write(FRAME_HEADER.pack(len(payload)) + payload)
+            # Flush to disk so the item survives a crash
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.completed[index] = data_item
+
+    def compact(self, dataset, allow_missing=False):
+        """
+        Function to produce the results array, in dataset order, from the journal
+        :param dataset: The dataset the journal was written for
+        :param allow_missing: Leave out the data items which are not in the journal instead of raising an error
+        :return: Array of the data items including their results
+        """
+        missing = [index for index, data_item in enumerate(dataset) if not self.is_completed(index, data_item)]
+        if missing and not allow_missing:
+            raise ValueError(str(len(missing)) + " data items are missing from " + self.filepath)
+        return [self.completed[index] for index, data_item in enumerate(dataset) if self.is_completed(index, data_item)]
+
+    def close(self):
+        """
+        Function to close the journal file
+        :return: None
+        """
+        self.file.close()
+
+    def remove(self):
+        """
+        Function to close and delete the journal (once its results have been stored)
+        :return: None
+        """
+        self.close()
+        os.remove(self.filepath)
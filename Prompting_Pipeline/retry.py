@@ -0,0 +1,364 @@
+"""
+This python file holds the retry layer used by the prompting pipeline
+A failed prompt (429 rate limit, 5xx server error or a dropped connection) is retried with jittered exponential backoff,
+honouring the Retry-After and rate limit reset headers sent by the API. Retries are limited by a per-run budget,
+a circuit breaker pauses every request after a run of consecutive failures, and the number of prompts in flight
+is lowered when the API throttles (additive increase, multiplicative decrease) instead of hammering the API
+"""
+import random, re, threading, time
+from email.utils import parsedate_to_datetime
+from llm_clients import LLMRequestError
+
+# Status codes which are worth retrying (None is a request which received no response, e.g. a dropped connection)
+RETRYABLE_STATUS_CODES = [None, 408, 409, 425, 429, 500, 502, 503, 504, 529]
+
+# Headers which give the number of seconds until the rate limit resets (checked after Retry-After)
+RESET_HEADERS = ['retry-after-ms', 'x-ratelimit-reset-requests', 'x-ratelimit-reset-tokens', 'x-ratelimit-reset', 'ratelimit-reset',
+                 'ratelimitbysize-reset']
+
+
+class RetryBudgetExhausted(LLMRequestError):
+    """
+    Exception raised when a prompt fails after the retry budget of the run has been used up
+    """
+
+
+def parse_duration(value):
+    """
+    Function to parse a duration header value in seconds, e.g. '2', '0.5', '20ms', '1s' or '6m0s'
+    :param value: String value of the header
+    :return: Number of seconds, or None if the value could not be parsed
+    """
+    value = value.strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = re.findall(r"([\d.]+)(ms|h|m|s)", value)
+    if not parts or "".join(number + unit for number, unit in parts) != value:
+        return None
+    return sum(float(number) * {"ms": 0.001, "s": 1, "m": 60, "h": 3600}[unit] for number, unit in parts)
+
+
+def retry_after_seconds(headers):
+    """
+    Function to read how long the API asked the client to wait from the headers of a failed response
+    :param headers: Dictionary of the response headers
+    :return: Number of seconds to wait, or None if the headers do not say
+    """
+    headers = {name.lower(): value for name, value in (headers or {}).items()}
+    if 'retry-after' in headers:
+        seconds = parse_duration(headers['retry-after'])
+        if seconds is None:
+            # Retry-After may also be an HTTP date
+            try:
+                seconds = parsedate_to_datetime(headers['retry-after']).timestamp() - time.time()
+            except (TypeError, ValueError):
+                seconds = None
+        if seconds is not None:
+            return max(0.0, seconds)
+    for name in RESET_HEADERS:
+        if name in headers:
+            seconds = parse_duration(headers[name])
+            if seconds is not None:
+                return max(0.0, seconds / 1000 if name == 'retry-after-ms' else seconds)
+    return None
+
+
+class AdaptiveConcurrency:
+    """
+    Limit on the number of prompts in flight which is halved when the API throttles and grows back by one as prompts succeed
+    """
+
+    def __init__(self, max_limit, min_limit=1, decrease_interval=5):
+        """
+        :param max_limit: Maximum (and starting) number of prompts in flight
+        :param min_limit: Minimum number of prompts in flight
+        :param decrease_interval: Seconds after a decrease during which further throttling does not decrease the limit again
+        """
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.decrease_interval = decrease_interval
+        self.limit = max_limit
+        self.in_flight = 0
+        self.successes = 0
+        self.last_decrease = None
+        self.lowest_limit = max_limit
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        """
+        Function to block until another prompt is allowed to be in flight
+        :return: None
+        """
+        with self.condition:
+            while self.in_flight >= self.limit:
+                self.condition.wait()
+            self.in_flight += 1
+
+    def release(self):
+        """
+        Function to mark a prompt as no longer in flight
+        :return: None
+        """
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+
+    def on_success(self):
+        """
+        Function to grow the limit by one after a full limit's worth of successful prompts
+        :return: None
+        """
+        with self.condition:
+            self.successes += 1
+            if self.successes >= self.limit and self.limit < self.max_limit:
+                self.limit += 1
+                self.successes = 0
+                self.condition.notify_all()
+
+    def on_throttle(self):
+        """
+        Function to halve the limit when the API throttles (once per decrease interval, as the in-flight prompts fail together)
+        :return: None
+        """
+        with self.condition:
+            now = time.monotonic()
+            if self.last_decrease is not None and now - self.last_decrease < self.decrease_interval:
+                return
+            self.last_decrease = now
+            self.successes = 0
+            if self.limit > self.min_limit:
+                self.limit = max(self.min_limit, self.limit // 2)
+                self.lowest_limit = min(self.lowest_limit, self.limit)
+                print("Throttled by the API, lowering the concurrency to " + str(self.limit))
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker which stops every request for a cooldown after a run of consecutive failures,
+    then lets a single probe request through and only closes again once the probe succeeds
+    """
+
+    def __init__(self, failure_threshold=5, cooldown=30):
+        """
+        :param failure_threshold: Number of consecutive failures which opens the breaker
+        :param cooldown: Seconds the breaker stays open before a probe request is let through
+        """
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.trips = 0
+        self.condition = threading.Condition()
+
+    def before_request(self):
+        """
+        Function to block while the breaker is open (or another thread is probing)
+        :return: None
+        """
+        with self.condition:
+            while self.opened_at is not None:
+                remaining = self.opened_at + self.cooldown - time.monotonic()
+                if remaining <= 0 and not self.probing:
+                    # Half open, this request is the probe
+                    self.probing = True
+                    return
+                self.condition.wait(remaining if remaining > 0 else None)
+
+    def record_success(self):
+        """
+        Function to close the breaker after a successful request
+        :return: None
+        """
+        with self.condition:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+            self.condition.notify_all()
+
+    def record_failure(self):
+        """
+        Function to count a failed request, opening the breaker once the threshold is reached (or the probe failed)
+        :return: None
+        """
+        with self.condition:
+            self.failures += 1
+            if self.probing or (self.opened_at is None and self.failures >= self.failure_threshold):
+                if self.opened_at is None:
+                    self.trips += 1
+                    print("Circuit breaker opened after " + str(self.failures) + " consecutive failures, pausing requests for "
+                          + str(self.cooldown) + "s")
+                self.opened_at = time.monotonic()
+                self.probing = False
+                self.condition.notify_all()
+
+
+class RetryPolicy:
+    """
+    Retry layer shared by all the prompting workers of a run
+    """
+
+    def __init__(self, max_attempts=6, base_delay=1, max_delay=60, retry_budget=100, max_concurrency=1, breaker_threshold=5,
+                 breaker_cooldown=30, seed=None):
+        """
+        :param max_attempts: Maximum number of attempts per prompt (including the first)
+        :param base_delay: Backoff delay in seconds before the first retry (doubled for every further retry)
+        :param max_delay: Maximum backoff delay in seconds
+        :param retry_budget: Maximum number of retries across the whole run
+        :param max_concurrency: Maximum number of prompts in flight (lowered automatically while the API throttles)
+        :param breaker_threshold: Number of consecutive failures which opens the circuit breaker
+        :param breaker_cooldown: Seconds the circuit breaker pauses requests for
+        :param seed: Optional seed of the backoff jitter
+        """
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_budget = retry_budget
+        self.concurrency = AdaptiveConcurrency(max_concurrency)
+        self.breaker = CircuitBreaker(breaker_threshold, breaker_cooldown)
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.retries = 0
+        # Time before which no request is sent (set from the Retry-After header of a 429 response)
+        self.paused_until = 0
+
+    def backoff_delay(self, attempt, error):
+        """
+        Function to work out how long to wait before retrying a failed prompt
+        Full jitter exponential backoff, but never shorter than the wait asked for by the API
+        :param attempt: Number of the attempt which failed (starting at 1)
+        :param error: LLMRequestError of the failed attempt
+        :return: Number of seconds to wait
+        """
+        with self.lock:
+            delay = self.random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+        requested = retry_after_seconds(error.headers)
+        if requested is not None:
+            delay = max(delay, min(requested, self.max_delay))
+        return delay
+
+    def wait_for_pause(self):
+        """
+        Function to block while requests are paused because the API asked the client to wait
+        :return: None
+        """
+        while True:
+            with self.lock:
+                remaining = self.paused_until - time.monotonic()
+            if remaining <= 0:
+                return
+            time.sleep(remaining)
+
+    def call(self, function, *args, record=None):
+        """
+        Function to call a prompt function, retrying it while it fails with a retryable LLMRequestError
+        :param function: Function to call
+        :param args: Arguments to call the function with
+        :param record: Optional metrics record, its 'retries' count is increased for every retry
+        :return: The return value of the function
+        """
+        attempt = 0
+        while True:
+            attempt += 1
+            self.breaker.before_request()
+            self.wait_for_pause()
+            self.concurrency.acquire()
+            try:
+                result = function(*args)
+            except LLMRequestError as error:
+                self.concurrency.release()
+                if error.status_code not in RETRYABLE_STATUS_CODES or not getattr(error, "retryable", True):
+                    # The API answered (or the error is final, e.g. a failed batch response), so retrying will not help
+                    self.breaker.record_success()
+                    raise
+                self.breaker.record_failure()
+                if error.status_code == 429:
+                    self.concurrency.on_throttle()
+                if attempt >= self.max_attempts:
+                    raise
+                with self.lock:
+                    if self.retries >= self.retry_budget:
+                        raise RetryBudgetExhausted("Retry budget of " + str(self.retry_budget) + " retries used up: " + str(error),
+                                                   error.status_code, error.headers) from error
+                    self.retries += 1
+
+                delay = self.backoff_delay(attempt, error)
+                if error.status_code == 429 and retry_after_seconds(error.headers) is not None:
+                    # The API asked every request to wait, not just this one
+                    with self.lock:
+                        self.paused_until = max(self.paused_until, time.monotonic() + delay)
+                if record is not None:
+                    record['retries'] += 1
+                print("Request failed (" + str(error.status_code) + "), retrying in " + str(round(delay, 2)) + "s (attempt "
+                      + str(attempt + 1) + " of " + str(self.max_attempts) + ")")
+                time.sleep(delay)
+            except Exception:
+                # Any other exception is not a failure of the API, so it does not count towards the circuit breaker
+                self.concurrency.release()
+                self.breaker.record_success()
+                raise
+            else:
+                self.concurrency.release()
+                self.concurrency.on_success()
+                self.breaker.record_success()
+                return result
+
+    def report(self):
+        """
+        Function to output the retry statistics to the console
+        :return: None
+        """
+        print("Retries: " + str(self.retries) + " of a budget of " + str(self.retry_budget) + ", circuit breaker opened " + str(self.breaker.trips)
+              + " times, concurrency " + str(self.concurrency.limit) + " (lowest " + str(self.concurrency.lowest_limit) + ", max "
+              + str(self.concurrency.max_limit) + ")")
+
+
+class RetryScope:
+    """
+    View of a RetryPolicy shared by several runs (e.g. the cells of a sweep) which counts the retries of one run
+    Prompts are retried by the shared policy, so the budget, circuit breaker and concurrency limit stay shared,
+    but report() only reports the retries of this run and the circuit breaker trips since it started
+    """
+
+    def __init__(self, policy):
+        """
+        :param policy: The shared RetryPolicy
+        """
+        self.policy = policy
+        self.lock = threading.Lock()
+        self.retries = 0
+        # Trips of the shared breaker before this run started, so only the trips during the run are reported
+        self.trips_at_start = policy.breaker.trips
+
+    @property
+    def breaker_trips(self):
+        return self.policy.breaker.trips - self.trips_at_start
+
+    def call(self, function, *args, record=None):
+        """
+        Function to call a prompt function through the shared policy, counting the retries it took
+        :param function: Function to call
+        :param args: Arguments to call the function with
+        :param record: Optional metrics record, its 'retries' count is increased for every retry
+        :return: The return value of the function
+        """
+        if record is None:
+            record = {'retries': 0}
+        retries_before = record['retries']
+        try:
+            return self.policy.call(function, *args, record=record)
+        finally:
+            with self.lock:
+                self.retries += record['retries'] - retries_before
+
+    def report(self):
+        """
+        Function to output the retry statistics of this run to the console
+        :return: None
+        """
+        policy = self.policy
+        print("Retries: " + str(self.retries) + " in this run (" + str(policy.retries) + " of the shared budget of " + str(policy.retry_budget)
+              + " used), shared circuit breaker opened " + str(self.breaker_trips) + " times during this run, concurrency "
+              + str(policy.concurrency.limit) + " (lowest " + str(policy.concurrency.lowest_limit) + ", max " + str(policy.concurrency.max_limit) + ")")
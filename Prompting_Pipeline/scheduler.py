@@ -0,0 +1,59 @@
+"""
+This python file holds the length-aware scheduler used by the prompting pipeline
+The number of tokens the LLM will generate for a function is estimated from the length of the Java 8 function
+(its number of lines and its prompt token count), which is used to set max_tokens for every data item
+and to dispatch the longest functions first, so a few very long functions do not finish last and dominate the tail latency
+"""
+import math
+from rate_limiter import estimate_token_count
+
+# Extra tokens for the ```java ... ``` fence and any text around the code
+RESPONSE_OVERHEAD_TOKENS = 32
+
+
+class LengthAwareScheduler:
+    """
+    Scheduler which orders the data items longest-first and gives each one a max_tokens budget sized to the function
+    """
+
+    def __init__(self, tokens_per_line=12, headroom=2.0, min_max_tokens=256, max_max_tokens=8192, round_to=64):
+        """
+        :param tokens_per_line: Estimated number of tokens per line of Java code
+        :param headroom: Multiplier applied to the estimated output size (Java 11 code can be longer than the Java 8 code)
+        :param min_max_tokens: Smallest max_tokens given to a data item
+        :param max_max_tokens: Largest max_tokens given to a data item (also the limit when a truncated response is re-requested)
+        :param round_to: max_tokens is rounded up to a multiple of this (so similar functions share a budget)
+        """
+        self.tokens_per_line = tokens_per_line
+        self.headroom = headroom
+        self.min_max_tokens = min_max_tokens
+        self.max_max_tokens = max_max_tokens
+        self.round_to = round_to
+
+    def estimate_output_tokens(self, data_item):
+        """
+        Function to estimate the number of tokens the LLM will generate for a data item
+        :param data_item: Data item containing the Java 8 function
+        :return: Estimated number of output tokens
+        """
+        java_8_function = data_item['java_8_function']
+        # The migrated function is expected to be roughly the same size as the Java 8 function, take the larger of both estimates
+        return max(java_8_function['length'] * self.tokens_per_line, estimate_token_count(java_8_function['string']))
+
+    def max_tokens(self, data_item):
+        """
+        Function to choose the max_tokens budget of a data item
+        :param data_item: Data item containing the Java 8 function
+        :return: Integer max_tokens
+        """
+        budget = self.estimate_output_tokens(data_item) * self.headroom + RESPONSE_OVERHEAD_TOKENS
+        budget = math.ceil(budget / self.round_to) * self.round_to
+        return int(min(self.max_max_tokens, max(self.min_max_tokens, budget)))
+
+    def order(self, indexed_items):
+        """
+        Function to order the data items longest-first (ties keep their dataset order)
+        :param indexed_items: Array of (index, data item) tuples
+        :return: New array of (index, data item) tuples
+        """
+        return sorted(indexed_items, key=lambda indexed_item: -self.estimate_output_tokens(indexed_item[1]))
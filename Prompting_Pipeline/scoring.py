@@ -0,0 +1,85 @@
+"""
+This python file holds the CodeBLEU scoring pool used by the prompting pipeline
+CodeBLEU parses every function with tree-sitter and extracts its dataflow, which is CPU-bound,
+so comparisons are grouped into batches and scored by a pool of worker processes (one per core by default)
+The worker processes are started on demand from the scoring threads while the generation and writing threads are running,
+so they are never forked from the pipeline process (a fork copies locks held by the other threads, e.g. in the HTTP client
+pool, logging or the journal). They are forked from a single-threaded forkserver instead (or spawned where that is not available)
+"""
+import os, time, threading, multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from codebleu import calc_codebleu
+
+
+def score_batch(batch):
+    """
+    Function which is run inside a worker process to score a batch of comparisons
+    :param batch: Array of (key, prediction, reference) tuples, the key is used to match the score to its data item
+    :return: Array of (key, codebleu metrics) tuples
+    """
+    return [(key, calc_codebleu(predictions=[prediction], references=[reference], lang="java"))
+            for key, prediction, reference in batch]
+
+
+def worker_context():
+    """
+    Function to choose how the worker processes are started: from a forkserver (which imports codebleu once, so each worker
+    starts already loaded), or spawned as fresh interpreters where there is no forkserver (Windows)
+    :return: multiprocessing context
+    """
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload(["codebleu"])
+        return context
+    return multiprocessing.get_context("spawn")
+
+
+class ScoringPool:
+    """
+    Process pool which scores batches of comparisons, shared by the threads of the scoring stage
+    """
+
+    def __init__(self, workers=None):
+        """
+        :param workers: Number of worker processes (defaults to the number of cores)
+        """
+        self.workers = workers or os.cpu_count()
+        self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=worker_context())
+        # Counters used for the throughput report
+        self.lock = threading.Lock()
+        self.scored = 0
+        self.start_time = None
+
+    def score(self, batch):
+        """
+        Function to score a batch of comparisons in one of the worker processes, blocking until it is scored
+        :param batch: Array of (key, prediction, reference) tuples
+        :return: Array of (key, codebleu metrics) tuples
+        """
+        with self.lock:
+            if self.start_time is None:
+                self.start_time = time.monotonic()
+        results = self.executor.submit(score_batch, batch).result()
+        with self.lock:
+            self.scored += len(results)
+        return results
+
+    def report(self, item_count):
+        """
+        Function to output the scoring throughput to the console
+        :param item_count: Number of data items the scored comparisons belong to
+        :return: None
+        """
+        if self.start_time is None:
+            print("Scoring: nothing was scored")
+            return
+        elapsed = max(time.monotonic() - self.start_time, 1e-9)
+        print("Scoring: " + str(item_count) + " items (" + str(self.scored) + " comparisons) in " + str(round(elapsed, 2)) + "s using "
+              + str(self.workers) + " processes - " + str(round(item_count / elapsed, 2)) + " items/sec")
+
+    def close(self):
+        """
+        Function to shut down the worker processes
+        :return: None
+        """
+        self.executor.shutdown()
@@ -0,0 +1,165 @@
+"""
+This python file splits the evaluation of one or more datasets across several machines
+The shard command hash-partitions the data items into N shards (a data item always lands in the same shard) and writes a manifest
+which records the original position and pair key of every data item. Each machine runs run_program on a single shard,
+then the merge command checks every shard result is complete and reassembles the results in the original order,
+one results file per source dataset (as expected by output_averaged_results.py)
+Usage: python sharding.py shard <shard count> <output directory> dataset.pkl [dataset.pkl ...]
+       python sharding.py run <manifest.json> <shard number>
+       python sharding.py merge <manifest.json> results.pkl [results.pkl ...] (one results file per source dataset)
+"""
+import sys, os, json, pickle
+from Shared_Files.utils import read_dataset, pair_key
+from baseline_scores import load_baseline_scores
+from prompting_pipeline import run_program, store_result_pickle
+
+
+def shard_of(data_item, shard_count):
+    """
+    Function to choose the shard of a data item from the hash of its function pair (stable between runs and machines)
+    :param data_item: Data item from the dataset
+    :param shard_count: Number of shards
+    :return: Shard number (0 to shard_count - 1)
+    """
+    return int(pair_key(data_item), 16) % shard_count
+
+
+def shard_filepath(manifest_filepath, shard, suffix=""):
+    """
+    Function to get the filepath of a shard (or of its results) from the manifest filepath
+    :param manifest_filepath: Filepath of the manifest
+    :param shard: Dictionary of the shard from the manifest
+    :param suffix: Text added to the filename before the extension (e.g. '_results')
+    :return: Filepath
+    """
+    stem = os.path.splitext(shard['file'])[0]
+    return os.path.join(os.path.dirname(os.path.abspath(manifest_filepath)), stem + suffix + ".pkl")
+
+
+def read_manifest(manifest_filepath):
+    """
+    Function to read a shard manifest
+    :param manifest_filepath: Filepath of the manifest
+    :return: Dictionary of the manifest
+    """
+    with open(manifest_filepath, "r", encoding="utf-8") as my_file:
+        return json.load(my_file)
+
+
+def shard_datasets(dataset_filepaths, shard_count, output_directory):
+    """
+    Function to split one or more datasets into hash-partitioned shards and write the manifest
+    :param dataset_filepaths: Array of dataset filepaths (combined in this order)
+    :param shard_count: Number of shards
+    :param output_directory: Directory to store the shard pkl files and the manifest to
+    :return: Filepath of the manifest
+    """
+    os.makedirs(output_directory, exist_ok=True)
+    manifest = {"shard_count": shard_count, "sources": [], "shards": []}
+    shards = [{"file": "shard_" + str(number) + "_of_" + str(shard_count) + ".pkl", "positions": [], "keys": []} for number in range(shard_count)]
+    shard_items = [[] for _ in range(shard_count)]
+
+    # Assign every data item of every source dataset to its shard, recording where it came from
+    for source_number, filepath in enumerate(dataset_filepaths):
+        dataset = read_dataset(filepath, silent=False)
+        manifest["sources"].append({"file": os.path.basename(filepath), "items": len(dataset)})
+        for position, data_item in enumerate(dataset):
+            key = pair_key(data_item)
+            number = shard_of(data_item, shard_count)
+            shards[number]["positions"].append([source_number, position])
+            shards[number]["keys"].append(key)
+            shard_items[number].append(data_item)
+
+    # Store each shard as a dataset pkl file
+    for shard, items in zip(shards, shard_items):
+        with open(os.path.join(output_directory, shard["file"]), "wb") as my_file:
+            pickle.dump(items, my_file)
+        shard["items"] = len(items)
+        print("Shard " + shard["file"] + ": " + str(len(items)) + " data items")
+    manifest["shards"] = shards
+
+    manifest_filepath = os.path.join(output_directory, "manifest.json")
+    with open(manifest_filepath, "w", encoding="utf-8") as my_file:
+        json.dump(manifest, my_file)
+    print("Wrote the manifest of " + str(shard_count) + " shards to " + manifest_filepath)
+    return manifest_filepath
+
+
+def run_shard(manifest_filepath, shard_number, prompt_function, **run_options):
+    """
+    Function to run the prompting pipeline on a single shard, storing the results next to the shard
+    :param manifest_filepath: Filepath of the manifest
+    :param shard_number: Number of the shard to run
+    :param prompt_function: Function to use to prompt the LLM
+    :param run_options: Keyword arguments passed on to run_program (e.g. max_workers, requests_per_second)
+    :return: Filepath of the shard results
+    """
+    shard = read_manifest(manifest_filepath)["shards"][shard_number]
+    dataset_filepath = shard_filepath(manifest_filepath, shard)
+    dataset = read_dataset(dataset_filepath, silent=False)
+    results_filepath = shard_filepath(manifest_filepath, shard, "_results")
+    run_options.setdefault("baseline_scores", load_baseline_scores(dataset, dataset_filepath))
+    run_program(dataset, prompt_function, results_filepath, **run_options)
+    return results_filepath
+
+
+def merge_shards(manifest_filepath, output_filepaths):
+    """
+    Function to check the results of every shard are complete and reassemble them in the original order
+    :param manifest_filepath: Filepath of the manifest
+    :param output_filepaths: Array of filepaths to store the results to, one per source dataset (in the order they were sharded)
+    :return: Array of the results datasets, one per source dataset
+    """
+    manifest = read_manifest(manifest_filepath)
+    if len(output_filepaths) != len(manifest["sources"]):
+        raise ValueError("Expected " + str(len(manifest["sources"])) + " output filepaths (one per source dataset), got " + str(len(output_filepaths)))
+
+    # Check every shard has a complete set of results before merging anything
+    problems = []
+    shard_results = []
+    for shard in manifest["shards"]:
+        results_filepath = shard_filepath(manifest_filepath, shard, "_results")
+        if not os.path.exists(results_filepath):
+            problems.append(shard["file"] + ": results file " + results_filepath + " is missing")
+            continue
+        results = read_dataset(results_filepath)
+        if len(results) != shard["items"]:
+            problems.append(shard["file"] + ": expected " + str(shard["items"]) + " results, found " + str(len(results)))
+            continue
+        mismatched = [position for position, (data_item, key) in enumerate(zip(results, shard["keys"])) if pair_key(data_item) != key]
+        if mismatched:
+            problems.append(shard["file"] + ": " + str(len(mismatched)) + " results do not match the sharded data items (first at position "
+                            + str(mismatched[0]) + ")")
+            continue
+        shard_results.append((shard, results))
+    if problems:
+        raise ValueError("Cannot merge the shards:\n" + "\n".join(problems))
+
+    # Place every result back at its original position
+    merged = [[None] * source["items"] for source in manifest["sources"]]
+    for shard, results in shard_results:
+        for (source_number, position), data_item in zip(shard["positions"], results):
+            merged[source_number][position] = data_item
+
+    for results, filepath in zip(merged, output_filepaths):
+        store_result_pickle(results, filepath)
+    return merged
+
+
+if __name__ == '__main__':
+    if len(sys.argv) >= 5 and sys.argv[1] == "shard":
+        shard_datasets(sys.argv[4:], int(sys.argv[2]), sys.argv[3])
+    elif len(sys.argv) == 4 and sys.argv[1] == "run":
+        # Run a single shard against the Mistral API (the API key is read from the 'MISTRAL_API_KEY' environment variable)
+        from llm_clients import create_mistral_pool
+        from prompting_pipeline import make_prompt_function
+        from scheduler import LengthAwareScheduler
+        max_workers = 4
+        client_pool = create_mistral_pool(os.environ['MISTRAL_API_KEY'], size=max_workers)
+        run_shard(sys.argv[2], int(sys.argv[3]), make_prompt_function(client_pool, "codestral-latest", stream=True),
+                  max_workers=max_workers, requests_per_second=1, tokens_per_minute=500000, scheduler=LengthAwareScheduler())
+        client_pool.close()
+    elif len(sys.argv) >= 4 and sys.argv[1] == "merge":
+        merge_shards(sys.argv[2], sys.argv[3:])
+    else:
+        print(__doc__)
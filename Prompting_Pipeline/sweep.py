@@ -0,0 +1,133 @@
+"""
+This python file runs a sweep over a matrix of (model, prompt template, max_tokens) settings
+The dataset is loaded once, the baseline scores are loaded once and every cell of the matrix shares one scoring process pool,
+one rate limiter and one retry policy (whose concurrency limit caps the prompts in flight across every cell), so the cells run side by side instead of one run_program call after another
+Each cell writes its own results file and a combined summary of the average CodeBLEU scores is written to a CSV file
+"""
+import os, csv, itertools, math
+from concurrent.futures import ThreadPoolExecutor
+from Shared_Files.utils import read_dataset
+from rate_limiter import RateLimiter
+from scoring import ScoringPool
+from retry import RetryPolicy, RetryScope
+from baseline_scores import load_baseline_scores
+from prompting_pipeline import run_program, make_prompt_function
+
+# CodeBLEU metrics included in the summary
+SUMMARY_METRICS = ['codebleu', 'ngram_match_score', 'weighted_ngram_match_score', 'syntax_match_score', 'dataflow_match_score']
+
+
+def cell_name(model, template, max_tokens):
+    """
+    Function to build the name of a sweep cell (used for its results filename)
+    :param model: Model name
+    :param template: Prompt template name
+    :param max_tokens: Maximum number of tokens to generate
+    :return: String name of the cell, safe to use in a filename
+    """
+    name = model + "__" + template + "__" + str(max_tokens)
+    return "".join(character if character.isalnum() or character in "-_." else "_" for character in name)
+
+
+def summarise_results(results):
+    """
+    Function to calculate the average CodeBLEU scores of a results dataset (in the same way as get_avg_stats)
+    Functions with a dataflow match score of 0 are skipped, as CodeBLEU failed to scan them
+    :param results: Results dataset produced by run_program
+    :return: Dictionary of summary values
+    """
+    scored = [data_item for data_item in results if data_item['java_11_11_comparison']['dataflow_match_score'] != 0]
+    summary = {'functions': len(results), 'scored_functions': len(scored),
+               'complete_matches': sum(1 for data_item in scored if data_item['java_11_11_comparison']['codebleu'] == 1)}
+    for metric in SUMMARY_METRICS:
+        summary[metric] = sum(data_item['java_11_11_comparison'][metric] for data_item in scored) / len(scored) if scored else 0
+        summary['baseline_' + metric] = sum(data_item['java_8_11_comparison'][metric] for data_item in scored) / len(scored) if scored else 0
+    return summary
+
+
+def run_sweep(dataset, dataset_filepath, client_pool, models, templates, max_tokens_options, output_directory, total_concurrency=8,
+              requests_per_second=None, tokens_per_minute=None, scoring_workers=None, cache=None):
+    """
+    Function to run every cell of a (model, prompt template, max_tokens) matrix over one loaded dataset
+    :param dataset: Dataset (that has already been de-serialized)
+    :param dataset_filepath: Filepath of the dataset (its baseline scores are stored next to it)
+    :param client_pool: ClientPool used by every cell (the model is chosen per request)
+    :param models: Array of model names
+    :param templates: Array of prompt template names (keys of PROMPT_TEMPLATES)
+    :param max_tokens_options: Array of max_tokens values
+    :param output_directory: Directory to store the results of each cell and the combined summary to
+    :param total_concurrency: Maximum number of prompts in flight across all of the cells (each cell runs an equal share of the workers)
+    :param requests_per_second: Maximum number of prompts per second across all of the cells (None for no limit)
+    :param tokens_per_minute: Maximum number of (estimated) tokens per minute across all of the cells (None for no limit)
+    :param scoring_workers: Number of processes used to calculate CodeBLEU scores (defaults to the number of cores)
+    :param cache: Optional ResponseCache shared by every cell
+    :return: Array of summary dictionaries, one per cell
+    """
+    os.makedirs(output_directory, exist_ok=True)
+    cells = list(itertools.product(models, templates, max_tokens_options))
+    print("Running a sweep of " + str(len(cells)) + " cells over " + str(len(dataset)) + " data items")
+
+    # Everything which does not depend on the cell is created once and shared
+    baseline_scores = load_baseline_scores(dataset, dataset_filepath)
+    rate_limiter = RateLimiter(requests_per_second, tokens_per_minute)
+    scoring_pool = ScoringPool(scoring_workers)
+    # One retry policy, so at most total_concurrency prompts are in flight across every cell
+    # and throttling seen by any cell lowers the concurrency of the whole sweep
+    retry_policy = RetryPolicy(max_concurrency=total_concurrency)
+    # Each cell only starts its share of the generation workers, instead of every cell starting total_concurrency threads which mostly wait
+    cell_workers = max(1, math.ceil(total_concurrency / len(cells)))
+
+    def run_cell(cell):
+        model, template, max_tokens = cell
+        prompt_function = make_prompt_function(client_pool, model, max_tokens=max_tokens, cache=cache, template=template)
+
+        # Each cell works on shallow copies of the data items, the function dictionaries themselves are shared
+        cell_dataset = [dict(data_item) for data_item in dataset]
+        output_filepath = os.path.join(output_directory, cell_name(model, template, max_tokens) + ".pkl")
+        # The retries of this cell are counted separately from those of the other cells sharing the policy
+        retry_scope = RetryScope(retry_policy)
+        run_program(cell_dataset, prompt_function, output_filepath, max_workers=cell_workers, baseline_scores=baseline_scores,
+                    rate_limiter=rate_limiter, scoring_pool=scoring_pool, retry_policy=retry_scope, monitor_interval=None)
+
+        summary = {'model': model, 'template': template, 'max_tokens': max_tokens, 'results_file': output_filepath,
+                   'retries': retry_scope.retries, 'breaker_trips_during_cell': retry_scope.breaker_trips}
+        summary.update(summarise_results(read_dataset(output_filepath)))
+        return summary
+
+    try:
+        with ThreadPoolExecutor(max_workers=len(cells)) as executor:
+            summaries = list(executor.map(run_cell, cells))
+    finally:
+        scoring_pool.close()
+
+    # Write the combined summary of every cell to a CSV file
+    summary_filepath = os.path.join(output_directory, "sweep_summary.csv")
+    with open(summary_filepath, mode='w', newline='', encoding='utf-8') as my_file:
+        writer = csv.DictWriter(my_file, fieldnames=list(summaries[0].keys()))
+        writer.writeheader()
+        writer.writerows(summaries)
+
+    # Output the summary in a tabulated format
+    print("\nSweep summary (written to " + summary_filepath + ")")
+    print("Model".ljust(25) + "Template".ljust(15) + "Max Tokens".ljust(12) + "CodeBLEU".ljust(12) + "Baseline".ljust(12) + "Scored")
+    print("-" * 85)
+    for summary in summaries:
+        print(summary['model'].ljust(25) + summary['template'].ljust(15) + str(summary['max_tokens']).ljust(12)
+              + str(round(summary['codebleu'], 4)).ljust(12) + str(round(summary['baseline_codebleu'], 4)).ljust(12)
+              + str(summary['scored_functions']) + "/" + str(summary['functions']))
+    return summaries
+
+
+if __name__ == '__main__':
+    from llm_clients import create_mistral_pool
+    from response_cache import ResponseCache
+
+    # Compare two Mistral models and both prompt templates on the secondary dataset
+    total_concurrency = 4
+    dataset_filepath = './../Shared_Files/synthetic_dataset.pkl'
+    client_pool = create_mistral_pool(os.environ['MISTRAL_API_KEY'], size=total_concurrency)
+    run_sweep(read_dataset(dataset_filepath, silent=False), dataset_filepath, client_pool,
+              models=["codestral-latest", "mistral-large-latest"], templates=["default", "removed_apis"], max_tokens_options=[2048],
+              output_directory="./../Shared_Files/sweep_results", total_concurrency=total_concurrency,
+              requests_per_second=1, tokens_per_minute=500000, cache=ResponseCache("./../Shared_Files/response_cache"))
+    client_pool.close()
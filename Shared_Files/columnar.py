@@ -0,0 +1,324 @@
+"""
+This python file holds a columnar, memory-mapped storage format for the dataset and results pkl files
+A dataset is stored as a directory (next to the pkl file, e.g. synthetic_dataset.columns) with one column per field,
+nested dictionaries are flattened into dotted column names such as 'java_8_function.length' or 'java_11_11_comparison.codebleu'
+Numeric columns are stored as a packed array, string columns as a packed array of offsets plus the concatenated UTF-8 data,
+and any other values are pickled per row. Only the columns which are asked for are mapped and decoded,
+so statistics which only need lengths or scores never touch the Java source strings
+read_dataset (with columns) and open_dataset convert a pkl file on first use, and again whenever the pkl file changes
+(the manifest records the size and modification time of the pkl file it was converted from)
+Usage: python columnar.py [dataset.pkl ...]
+"""
+import os, sys, json, mmap, pickle, array, glob
+from collections.abc import Mapping
+
+# Version of the layout, stored in the manifest
+FORMAT_VERSION = 1
+
+
+def columnar_filepath(filepath):
+    """
+    Function to get the directory used to store the columnar version of a pkl file
+    :param filepath: Filepath of the pkl file
+    :return: Filepath of the columnar directory
+    """
+    return os.path.splitext(filepath)[0] + ".columns"
+
+
+def flatten_data_item(data_item, prefix=""):
+    """
+    Function to flatten a (nested) data item into a dictionary of dotted column names
+    :param data_item: Dictionary (or record) to flatten
+    :param prefix: Column name prefix of the nested dictionary
+    :return: Dictionary of column name -> value
+    """
+    columns = {}
+    for key, value in data_item.items():
+        if isinstance(value, Mapping):
+            columns.update(flatten_data_item(value, prefix + key + "."))
+        else:
+            columns[prefix + key] = value
+    return columns
+
+
+def column_type(values):
+    """
+    Function to choose how a column is stored
+    :param values: Array of the values in the column
+    :return: 'int', 'float', 'str' or 'pickle'
+    """
+    if all(type(value) is int for value in values):
+        return "int"
+    if all(type(value) in (int, float) for value in values):
+        return "float"
+    if all(type(value) is str for value in values):
+        return "str"
+    return "pickle"
+
+
+def write_variable_column(directory, column, encoded_values):
+    """
+    Function to write a column of variable length values as an offsets file and a data file
+    :param directory: Columnar directory
+    :param column: Column name
+    :param encoded_values: Array of bytes, one per row
+    :return: None
+    """
+    offsets = array.array('q', [0])
+    with open(os.path.join(directory, column + ".data"), "wb") as my_file:
+        for encoded in encoded_values:
+            my_file.write(encoded)
+            offsets.append(offsets[-1] + len(encoded))
+    with open(os.path.join(directory, column + ".offsets"), "wb") as my_file:
+        offsets.tofile(my_file)
+
+
+def source_signature(filepath):
+    """
+    Function to describe the version of a pkl file, used to detect a columnar version which is out of date
+    :param filepath: Filepath of the pkl file
+    :return: Dictionary with the 'size' and the modification time ('mtime_ns') of the file
+    """
+    stat = os.stat(filepath)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def write_columnar(dataset, directory, source=None):
+    """
+    Function to store a dataset in the columnar format
+    :param dataset: Dataset (that has already been de-serialized)
+    :param directory: Directory to store the columns in (replaced if it already exists)
+    :param source: Optional source_signature of the pkl file the dataset was read from (stored in the manifest)
+    :return: None
+    """
+    rows = [flatten_data_item(data_item) for data_item in dataset]
+    column_names = list(rows[0].keys()) if rows else []
+    for position, row in enumerate(rows):
+        if list(row.keys()) != column_names:
+            raise ValueError("Data item " + str(position) + " does not have the same fields as the first data item")
+
+    os.makedirs(directory, exist_ok=True)
+    # Remove the manifest first, so a half-written directory is never read
+    manifest_filepath = os.path.join(directory, "manifest.json")
+    if os.path.exists(manifest_filepath):
+        os.remove(manifest_filepath)
+
+    manifest = {"version": FORMAT_VERSION, "rows": len(rows), "source": source, "columns": {}}
+    for column in column_names:
+        values = [row[column] for row in rows]
+        kind = column_type(values)
+        if kind == "int":
+            with open(os.path.join(directory, column + ".data"), "wb") as my_file:
+                array.array('q', values).tofile(my_file)
+        elif kind == "float":
+            with open(os.path.join(directory, column + ".data"), "wb") as my_file:
+                array.array('d', values).tofile(my_file)
+        elif kind == "str":
+            write_variable_column(directory, column, [value.encode("utf-8") for value in values])
+        else:
+            write_variable_column(directory, column, [pickle.dumps(value) for value in values])
+        manifest["columns"][column] = kind
+
+    with open(manifest_filepath, "w", encoding="utf-8") as my_file:
+        json.dump(manifest, my_file, indent=1)
+
+
+def map_file(filepath):
+    """
+    Function to memory map a column file for reading
+    :param filepath: Filepath of the column file
+    :return: mmap of the file (or empty bytes if the file is empty)
+    """
+    with open(filepath, "rb") as my_file:
+        if os.fstat(my_file.fileno()).st_size == 0:
+            return b""
+        return mmap.mmap(my_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def read_column(directory, column, kind):
+    """
+    Function to read the values of a single column
+    :param directory: Columnar directory
+    :param column: Column name
+    :param kind: How the column is stored ('int', 'float', 'str' or 'pickle')
+    :return: Array of the values in the column
+    """
+    data = map_file(os.path.join(directory, column + ".data"))
+    try:
+        if kind in ("int", "float"):
+            values = array.array('q' if kind == "int" else 'd')
+            values.frombytes(data)
+            return values.tolist()
+
+        offsets = array.array('q')
+        offsets_data = map_file(os.path.join(directory, column + ".offsets"))
+        offsets.frombytes(offsets_data)
+        if isinstance(offsets_data, mmap.mmap):
+            offsets_data.close()
+        if kind == "str":
+            return [str(data[offsets[row]:offsets[row + 1]], "utf-8") for row in range(len(offsets) - 1)]
+        return [pickle.loads(data[offsets[row]:offsets[row + 1]]) for row in range(len(offsets) - 1)]
+    finally:
+        if isinstance(data, mmap.mmap):
+            data.close()
+
+
+def project_columns(column_names, columns):
+    """
+    Function to select the stored columns matching a projection
+    A projected name selects the column itself and every column nested under it (e.g. 'java_8_function' selects 'java_8_function.length')
+    :param column_names: Array of the stored column names
+    :param columns: Array of projected column names (None for every column)
+    :return: Array of the selected column names (in stored order)
+    """
+    if columns is None:
+        return list(column_names)
+    selected = [name for name in column_names if any(name == column or name.startswith(column + ".") for column in columns)]
+    missing = [column for column in columns if not any(name == column or name.startswith(column + ".") for name in column_names)]
+    if missing:
+        raise KeyError("Columns not found: " + str(missing))
+    return selected
+
+
+class ColumnReader:
+    """
+    Random access to the values of a single memory mapped column, a value is only decoded when its row is read
+    """
+
+    def __init__(self, directory, column, kind):
+        """
+        :param directory: Columnar directory
+        :param column: Column name
+        :param kind: How the column is stored ('int', 'float', 'str' or 'pickle')
+        """
+        self.kind = kind
+        self.data = map_file(os.path.join(directory, column + ".data"))
+        self.offsets = None
+        if kind in ("int", "float"):
+            self.values = memoryview(self.data).cast('q' if kind == "int" else 'd')
+        else:
+            self.offsets_data = map_file(os.path.join(directory, column + ".offsets"))
+            self.offsets = memoryview(self.offsets_data).cast('q')
+
+    def __getitem__(self, row):
+        if self.offsets is None:
+            return self.values[row]
+        encoded = self.data[self.offsets[row]:self.offsets[row + 1]]
+        return str(encoded, "utf-8") if self.kind == "str" else pickle.loads(encoded)
+
+    def close(self):
+        """
+        Function to release the memory maps of the column
+        :return: None
+        """
+        if self.offsets is None:
+            self.values.release()
+        else:
+            self.offsets.release()
+            if isinstance(self.offsets_data, mmap.mmap):
+                self.offsets_data.close()
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+
+
+def read_manifest(directory):
+    """
+    Function to read the manifest of a columnar directory
+    :param directory: Columnar directory
+    :return: Dictionary with the 'version', the number of 'rows' and the 'columns' (column name -> how it is stored)
+    """
+    with open(os.path.join(directory, "manifest.json"), "r", encoding="utf-8") as my_file:
+        manifest = json.load(my_file)
+    if manifest["version"] != FORMAT_VERSION:
+        raise ValueError("Unsupported columnar format version " + str(manifest["version"]) + " in " + directory)
+    return manifest
+
+
+def read_columnar(directory, columns=None):
+    """
+    Function to read a dataset stored in the columnar format back into an array of (nested) data items
+    :param directory: Columnar directory
+    :param columns: Array of the column names to read (None for every column), data items only contain the projected fields
+    :return: Array of data items
+    """
+    manifest = read_manifest(directory)
+    dataset = [{} for _ in range(manifest["rows"])]
+    for column in project_columns(manifest["columns"].keys(), columns):
+        values = read_column(directory, column, manifest["columns"][column])
+        # Rebuild the nested dictionaries from the dotted column name
+        path = column.split(".")
+        for data_item, value in zip(dataset, values):
+            for key in path[:-1]:
+                data_item = data_item.setdefault(key, {})
+            data_item[path[-1]] = value
+    return dataset
+
+
+def project_dataset(dataset, columns):
+    """
+    Function to apply a column projection to a dataset which was loaded in full (so both storage formats return the same shape)
+    :param dataset: Dataset (that has already been de-serialized)
+    :param columns: Array of column names to keep
+    :return: Array of data items only containing the projected fields
+    """
+    projected = []
+    for data_item in dataset:
+        row = flatten_data_item(data_item)
+        projected_item = {}
+        for column in project_columns(row.keys(), columns):
+            path = column.split(".")
+            target = projected_item
+            for key in path[:-1]:
+                target = target.setdefault(key, {})
+            target[path[-1]] = row[column]
+        projected.append(projected_item)
+    return projected
+
+
+def is_columnar_current(filepath):
+    """
+    Function to check whether a pkl file has a columnar version which was converted from the current contents of the pkl file
+    (the size and modification time recorded in the manifest must match, so a pkl file which is replaced or copied over is noticed)
+    :param filepath: Filepath of the pkl file
+    :return: Boolean
+    """
+    manifest_filepath = os.path.join(columnar_filepath(filepath), "manifest.json")
+    if not os.path.exists(manifest_filepath):
+        return False
+    with open(manifest_filepath, "r", encoding="utf-8") as my_file:
+        manifest = json.load(my_file)
+    return manifest.get("version") == FORMAT_VERSION and manifest.get("source") == source_signature(filepath)
+
+
+def convert_dataset(dataset, filepath, source):
+    """
+    Function to store a dataset which was read from a pkl file as the columnar version of that pkl file
+    :param dataset: Dataset (that has already been de-serialized)
+    :param filepath: Filepath of the pkl file the dataset was read from
+    :param source: source_signature of the pkl file, taken before it was read
+    :return: Filepath of the columnar directory
+    """
+    directory = columnar_filepath(filepath)
+    write_columnar(dataset, directory, source)
+    print("Converted " + str(len(dataset)) + " data items from " + filepath + " to " + directory)
+    return directory
+
+
+def convert_pickle(filepath):
+    """
+    Function to convert a dataset or results pkl file to the columnar format (stored next to the pkl file)
+    :param filepath: Filepath of the pkl file
+    :return: Filepath of the columnar directory
+    """
+    source = source_signature(filepath)
+    with open(filepath, "rb") as my_file:
+        dataset = pickle.load(my_file)
+    return convert_dataset(dataset, filepath, source)
+
+
+if __name__ == '__main__':
+    # Convert the pkl files given on the command line, or every pkl file in Shared_Files
+    filepaths = sys.argv[1:] or sorted(filepath for filepath in glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), "*.pkl"))
+                                       if not filepath.endswith("_baseline_scores.pkl"))
+    for filepath in filepaths:
+        convert_pickle(filepath)
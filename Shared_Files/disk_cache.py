@@ -0,0 +1,135 @@
+"""
+This python file holds the on-disk least recently used cache shared by the LLM response cache and the GitHub HTTP cache
+Each value is stored in its own pkl file named by its key, and the index of the entries (their size and when they were last used)
+is kept in a SQLite database inside the cache directory, so several processes can share one cache directory:
+an entry written by one process is found by the others, the size limit applies to the whole directory,
+and an entry evicted by another process is treated as a miss instead of an error
+"""
+import os, pickle, sqlite3, threading, time
+
+# Filename of the index database inside the cache directory
+INDEX_FILENAME = "index.db"
+
+
+class DiskLRUCache:
+    """
+    Thread-safe and process-safe key -> value cache stored in a directory, evicting the least recently used entries once the size limit is reached
+    """
+
+    def __init__(self, directory, max_bytes):
+        """
+        :param directory: Directory to store the entries in (created if it does not exist)
+        :param max_bytes: Maximum total size of the entries before the least recently used are evicted
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        # Number of entries this process has evicted
+        self.evictions = 0
+        self.connection = None
+        self.connection_pid = None
+
+        os.makedirs(directory, exist_ok=True)
+        connection = self._connect()
+        with self.lock:
+            with connection:
+                connection.execute("BEGIN IMMEDIATE")
+                if connection.execute("SELECT COUNT(*) FROM entries").fetchone()[0] == 0:
+                    # Index the entries of a cache directory written before the index existed (by modification time)
+                    for filename in os.listdir(directory):
+                        if filename.endswith(".pkl"):
+                            stat = os.stat(os.path.join(directory, filename))
+                            connection.execute("INSERT OR IGNORE INTO entries (key, size, last_used) VALUES (?, ?, ?)",
+                                               (filename[:-4], stat.st_size, stat.st_mtime))
+
+    def _connect(self):
+        """
+        Function to get the connection to the index database of this process
+        A connection is never used across a fork, a forked process opens its own
+        :return: sqlite3 connection
+        """
+        if self.connection is None or self.connection_pid != os.getpid():
+            # Autocommit mode, the changes which have to be atomic are made in an explicit transaction
+            self.connection = sqlite3.connect(os.path.join(self.directory, INDEX_FILENAME), timeout=60, isolation_level=None,
+                                              check_same_thread=False)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, size INTEGER NOT NULL, last_used REAL NOT NULL)")
+            self.connection_pid = os.getpid()
+        return self.connection
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".pkl")
+
+    def get(self, key):
+        """
+        Function to read an entry from the cache
+        :param key: Key of the entry (a string which is safe to use in a filename)
+        :return: The cached value, or None if the entry is not cached
+        """
+        with self.lock:
+            connection = self._connect()
+            try:
+                # The file is checked rather than an in-memory index, so entries written by other processes are found
+                with open(self._path(key), "rb") as my_file:
+                    size = os.fstat(my_file.fileno()).st_size
+                    value = pickle.load(my_file)
+            except (OSError, EOFError, pickle.UnpicklingError):
+                # The entry is missing (e.g. evicted by another process) or damaged, forget it and treat it as not cached
+                connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+                return None
+            # Mark the entry as the most recently used
+            connection.execute("INSERT INTO entries (key, size, last_used) VALUES (?, ?, ?) ON CONFLICT(key) DO UPDATE SET last_used = excluded.last_used",
+                               (key, size, time.time()))
+            return value
+
+    def put(self, key, value):
+        """
+        Function to store an entry in the cache, evicting the least recently used entries if the cache is over its size limit
+        :param key: Key of the entry (a string which is safe to use in a filename)
+        :param value: Value to store (anything which can be pickled)
+        :return: None
+        """
+        data = pickle.dumps(value)
+        with self.lock:
+            connection = self._connect()
+            # Write to a temporary file and rename it so a half written entry is never read (the name is unique to this process and thread)
+            temporary_path = self._path(key) + "." + str(os.getpid()) + "." + str(threading.get_ident()) + ".tmp"
+            with open(temporary_path, "wb") as my_file:
+                my_file.write(data)
+            os.replace(temporary_path, self._path(key))
+
+            with connection:
+                # The write lock is held while evicting, so two processes never evict for the same overflow
+                connection.execute("BEGIN IMMEDIATE")
+                connection.execute("INSERT OR REPLACE INTO entries (key, size, last_used) VALUES (?, ?, ?)", (key, len(data), time.time()))
+                total_bytes = connection.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+                if total_bytes <= self.max_bytes:
+                    return
+                # Evict the least recently used entries until the cache is within its size limit (never the entry just stored)
+                for old_key, old_size in connection.execute("SELECT key, size FROM entries WHERE key != ? ORDER BY last_used", (key,)).fetchall():
+                    if total_bytes <= self.max_bytes:
+                        break
+                    connection.execute("DELETE FROM entries WHERE key = ?", (old_key,))
+                    total_bytes -= old_size
+                    self.evictions += 1
+                    if os.path.exists(self._path(old_key)):
+                        os.remove(self._path(old_key))
+
+    def usage(self):
+        """
+        Function to read the size of the whole cache directory (including the entries of other processes)
+        :return: Tuple of (number of entries, total bytes)
+        """
+        with self.lock:
+            count, total_bytes = self._connect().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        return count, total_bytes
+
+    def close(self):
+        """
+        Function to close the connection to the index database
+        :return: None
+        """
+        with self.lock:
+            if self.connection is not None and self.connection_pid == os.getpid():
+                self.connection.close()
+            self.connection = None
@@ -0,0 +1,261 @@
+"""
+This python file holds compact record types for the data items of a dataset (FunctionPair, JavaFunction and ComparisonScores)
+Every data item used to be a dictionary of dictionaries which repeats the function name three times and every key string,
+the records use __slots__ instead, intern the function names, and only calculate derived fields (length, params) when they are used
+The records keep dictionary style access (data_item['java_8_function']['string'], keys(), items(), dict(data_item)...),
+so the existing code keeps working, and to_dict() converts them back to plain dictionaries for storing in pkl files
+The dataset builders (build_secondary_dataset.py and find_functions.py) run on their own from their directories and keep building plain
+dictionaries, so the pkl files are unchanged. A script which holds a whole dataset in memory can convert it with to_records after loading it
+Usage: python records.py [dataset.pkl ...] (measures the memory per data item of a loaded pkl file before and after to_records)
+"""
+import sys, glob, os, gc, pickle, tracemalloc
+from collections.abc import MutableMapping
+
+# Metric names of a CodeBLEU comparison (as returned by calc_codebleu)
+COMPARISON_METRICS = ('codebleu', 'ngram_match_score', 'weighted_ngram_match_score', 'syntax_match_score', 'dataflow_match_score')
+
+
+def extract_function_parameters(function_string):
+    """
+    Function to extract function parameters from a java function
+    :param function_string: String representation of a java function
+    :return: Array of strings where each string is an input parameter
+    """
+    # Find the line with first opening curly bracket, concatenating the lines until it is found
+    parameters = ""
+    for line in function_string.split("\n"):
+        parameters = parameters + "\n" + line
+        if "{" in line:
+            break
+
+    # Get the contents inside the '(' and ')' of the signature and split it by the ', '
+    parameters = parameters.split("{")[0]
+    parameters = parameters[parameters.find("(")+1:parameters.find(")")]
+    parameters = parameters.split(", ")
+    if parameters == ['']:
+        return []
+    return parameters
+
+
+class Record(MutableMapping):
+    """
+    Base class which gives a slotted record dictionary style access to its fields
+    Subclasses list the fields in 'fields', a field which is None is treated as missing (unless it is derived)
+    """
+    __slots__ = ()
+    fields = ()
+
+    def __getitem__(self, key):
+        if key not in self.fields:
+            raise KeyError(key)
+        value = getattr(self, key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        if key not in self.fields:
+            raise KeyError(key + " is not a field of " + type(self).__name__)
+        setattr(self, key, value)
+
+    def __delitem__(self, key):
+        self[key] = None
+
+    def __iter__(self):
+        return (key for key in self.fields if getattr(self, key) is not None)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return type(self).__name__ + "(" + ", ".join(key + "=" + repr(value) for key, value in self.items()) + ")"
+
+    def to_dict(self):
+        """
+        Function to convert the record (and any records inside it) to plain dictionaries
+        :return: Dictionary
+        """
+        return {key: value.to_dict() if isinstance(value, Record) else value for key, value in self.items()}
+
+
+class JavaFunction(Record):
+    """
+    A Java function, its length (number of lines) and parameters are only calculated when they are first used
+    Functions scraped from GitHub also have the url of their file (and then expose their params)
+    """
+    __slots__ = ('name', 'string', 'url', '_length', '_params')
+    # Keys in the order of the dictionaries they replace (synthetic functions, and functions scraped from GitHub)
+    synthetic_fields = ('name', 'string', 'length')
+    scraped_fields = ('name', 'length', 'string', 'url', 'params')
+    fields = scraped_fields
+
+    def __init__(self, name, string, length=None, url=None, params=None):
+        """
+        :param name: Name of the function (interned, so every record of the same function shares one string)
+        :param string: Source code of the function
+        :param length: Number of lines of the function (calculated from the source code if None)
+        :param url: URL of the file the function was scraped from (None for synthetic functions)
+        :param params: Array of the function parameters (extracted from the source code if None)
+        """
+        self.name = sys.intern(name)
+        self.string = string
+        self.url = url
+        self._length = length
+        self._params = params
+
+    def __iter__(self):
+        return iter(self.synthetic_fields if self.url is None else self.scraped_fields)
+
+    @property
+    def length(self):
+        if self._length is None:
+            self._length = len(self.string.split('\n'))
+        return self._length
+
+    @length.setter
+    def length(self, value):
+        self._length = value
+
+    @property
+    def params(self):
+        # Only scraped functions expose their parameters (matching the dictionaries they replace)
+        if self.url is None:
+            return None
+        if self._params is None:
+            self._params = extract_function_parameters(self.string)
+        return self._params
+
+    @params.setter
+    def params(self, value):
+        self._params = value
+
+    @classmethod
+    def from_dict(cls, function):
+        """
+        Function to build a JavaFunction from its dictionary representation
+        The stored params are dropped, they are extracted again from the source code if they are used
+        :param function: Dictionary with the 'name', 'string' and optionally 'length' and 'url'
+        :return: JavaFunction
+        """
+        return cls(function['name'], function['string'], function.get('length'), function.get('url'))
+
+
+class ComparisonScores(Record):
+    """
+    The CodeBLEU metrics of a comparison between two functions
+    """
+    __slots__ = COMPARISON_METRICS
+    fields = COMPARISON_METRICS
+
+    def __init__(self, codebleu=None, ngram_match_score=None, weighted_ngram_match_score=None, syntax_match_score=None, dataflow_match_score=None):
+        self.codebleu = codebleu
+        self.ngram_match_score = ngram_match_score
+        self.weighted_ngram_match_score = weighted_ngram_match_score
+        self.syntax_match_score = syntax_match_score
+        self.dataflow_match_score = dataflow_match_score
+
+    @classmethod
+    def from_dict(cls, scores):
+        """
+        Function to build ComparisonScores from the dictionary returned by calc_codebleu
+        :param scores: Dictionary of metric name -> score
+        :return: ComparisonScores
+        """
+        return cls(**{metric: scores[metric] for metric in COMPARISON_METRICS})
+
+
+class FunctionPair(Record):
+    """
+    A data item of the dataset: a Java 8 function, its Java 11 version and (once processed) the generated function and its scores
+    """
+    __slots__ = ('name', 'java_8_function', 'java_11_function', 'generated_java_11_string', 'java_8_11_comparison', 'java_11_11_comparison')
+    fields = __slots__
+
+    def __init__(self, java_8_function, java_11_function, name=None):
+        """
+        :param java_8_function: JavaFunction of the Java 8 implementation
+        :param java_11_function: JavaFunction of the Java 11 implementation
+        :param name: Name of the data item (defaults to the name of the Java 8 function)
+        """
+        self.name = sys.intern(name) if name is not None else java_8_function.name
+        self.java_8_function = java_8_function
+        self.java_11_function = java_11_function
+        self.generated_java_11_string = None
+        self.java_8_11_comparison = None
+        self.java_11_11_comparison = None
+
+    def __setitem__(self, key, value):
+        # Comparisons are stored as ComparisonScores records
+        if key in ('java_8_11_comparison', 'java_11_11_comparison') and value is not None and not isinstance(value, ComparisonScores):
+            value = ComparisonScores.from_dict(value)
+        super().__setitem__(key, value)
+
+    @classmethod
+    def from_dict(cls, data_item):
+        """
+        Function to build a FunctionPair from a data item dictionary (as stored in the dataset and results pkl files)
+        :param data_item: Dictionary data item
+        :return: FunctionPair
+        """
+        function_pair = cls(JavaFunction.from_dict(data_item['java_8_function']), JavaFunction.from_dict(data_item['java_11_function']),
+                            data_item['name'])
+        for key in ('generated_java_11_string', 'java_8_11_comparison', 'java_11_11_comparison'):
+            if key in data_item:
+                function_pair[key] = data_item[key]
+        return function_pair
+
+
+def to_records(dataset):
+    """
+    Function to convert a dataset of dictionaries to an array of FunctionPair records
+    :param dataset: Dataset (that has already been de-serialized)
+    :return: Array of FunctionPair records
+    """
+    return [FunctionPair.from_dict(data_item) for data_item in dataset]
+
+
+def to_dicts(dataset):
+    """
+    Function to convert an array of FunctionPair records to plain dictionaries (for storing in a pkl file)
+    :param dataset: Array of FunctionPair records (or dictionaries, which are returned unchanged)
+    :return: Array of dictionaries
+    """
+    return [data_item.to_dict() if isinstance(data_item, Record) else data_item for data_item in dataset]
+
+
+def measure_memory(filepath):
+    """
+    Function to measure the memory used per data item when a pkl file is loaded as dictionaries and as records
+    :param filepath: Filepath of the dataset or results pkl file
+    :return: Bytes per data item as dictionaries and as records
+    """
+    def traced_bytes(convert):
+        # Collect garbage before starting and before reading the traced memory, so only the loaded data items are counted
+        gc.collect()
+        tracemalloc.start()
+        with open(filepath, "rb") as my_file:
+            dataset = pickle.load(my_file)
+        if convert:
+            # The dictionaries are freed once they are converted, only the records (sharing the same strings) are kept
+            dataset = to_records(dataset)
+        gc.collect()
+        traced = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        return traced, len(dataset)
+
+    # Convert the dataset once beforehand, so the (one off) growth of the interned string table is not counted per data item
+    traced_bytes(True)
+    dictionary_bytes, item_count = traced_bytes(False)
+    record_bytes, item_count = traced_bytes(True)
+    return dictionary_bytes / item_count, record_bytes / item_count
+
+
+if __name__ == '__main__':
+    # Measure the pkl files given on the command line, or every dataset and results pkl file in Shared_Files
+    filepaths = sys.argv[1:] or sorted(filepath for filepath in glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), "*.pkl"))
+                                       if not filepath.endswith("_baseline_scores.pkl"))
+    print("Dataset".ljust(50) + "Dictionaries".ljust(20) + "Records".ljust(20) + "Saving")
+    for filepath in filepaths:
+        dictionary_bytes, record_bytes = measure_memory(filepath)
+        print(os.path.basename(filepath).ljust(50) + (str(round(dictionary_bytes)) + " bytes/item").ljust(20)
+              + (str(round(record_bytes)) + " bytes/item").ljust(20) + str(round((1 - record_bytes / dictionary_bytes) * 100, 1)) + "%")
@@ -1,12 +1,187 @@
-import os, pickle
+import os, pickle, hashlib
+from collections.abc import Sequence
+from Shared_Files.columnar import columnar_filepath, is_columnar_current, read_columnar, project_dataset, project_columns, read_manifest, \
+    ColumnReader, convert_pickle, convert_dataset, source_signature
 
-def read_dataset(filepath, silent=True):
+def read_dataset(filepath, silent=True, columns=None):
+    """
+    Function to read a dataset or results pkl file
+    When columns are given, only those columns are read from the columnar version of the pkl file (see Shared_Files/columnar.py)
+    instead of unpickling the whole file. The columnar version is created the first time, and again whenever the pkl file changes
+    :param filepath: Filepath of the pkl file
+    :param silent: Boolean to decide whether to output the number of loaded data items
+    :param columns: Optional array of (dotted) column names to load, e.g. ['name', 'java_8_function.length']
+    :return: Array of data items (only containing the projected fields if columns are given)
+    """
+    if columns is not None and os.path.exists(filepath) and is_columnar_current(filepath):
+        # Only map and decode the projected columns
+        dataset = read_columnar(columnar_filepath(filepath), columns)
+        if not silent:
+            print("Loaded " + str(len(dataset)) + " data items (" + str(len(columns)) + " columns) from " + columnar_filepath(filepath))
+        return dataset
     if os.path.exists(filepath):
         # If the pickle exists, extract the array of function_pairs
+        source = source_signature(filepath)
         dataset = pickle.load(open(filepath, "rb"))
+        if columns is not None:
+            try:
+                # Store the columnar version, so the next projected read does not unpickle the whole file
+                convert_dataset(dataset, filepath, source)
+            except (ValueError, OSError) as error:
+                print("Could not convert " + filepath + " to the columnar format (" + repr(error) + "), reading the pkl file instead")
+            # Give the same shape as a columnar read
+            dataset = project_dataset(dataset, columns)
         if not silent:
             print("Loaded " + str(len(dataset)) + " data items from " + filepath)
         return dataset
     else:
         print(filepath + " does not exist")
-        quit(1)
\ No newline at end of file
+        quit(1)
+
+
+def pair_key(data_item):
+    """
+    Function to build a content hash which identifies a Java 8 / Java 11 function pair
+    :param data_item: Data item from the dataset
+    :return: Hex string of the SHA-256 hash of the Java 8 and Java 11 source code
+    """
+    pair_string = data_item['java_8_function']['string'] + "\0" + data_item['java_11_function']['string']
+    return hashlib.sha256(pair_string.encode("utf-8")).hexdigest()
+
+
+def normalize_code(code):
+    """
+    Function to normalise the layout of a Java function so copies which only differ in whitespace are treated as equal
+    Line endings are unified, trailing whitespace and surrounding blank lines are removed and the common indentation is stripped
+    :param code: String representation of a java function
+    :return: Normalised string
+    """
+    lines = [line.rstrip() for line in code.replace("\r\n", "\n").replace("\r", "\n").expandtabs(4).split("\n")]
+    while lines and not lines[0]:
+        lines.pop(0)
+    while lines and not lines[-1]:
+        lines.pop()
+    indentation = min((len(line) - len(line.lstrip()) for line in lines if line), default=0)
+    return "\n".join(line[indentation:] for line in lines)
+
+
+def normalized_pair_key(data_item):
+    """
+    Function to build a content hash of the normalised Java 8 / Java 11 function pair (used to find duplicate pairs)
+    :param data_item: Data item from the dataset
+    :return: Hex string of the SHA-256 hash of the normalised Java 8 and Java 11 source code
+    """
+    pair_string = normalize_code(data_item['java_8_function']['string']) + "\0" + normalize_code(data_item['java_11_function']['string'])
+    return hashlib.sha256(pair_string.encode("utf-8")).hexdigest()
+
+
+class LazyDataset(Sequence):
+    """
+    Read-only dataset backed by the memory mapped columnar format, data items are only built when they are accessed
+    It behaves like the list returned by read_dataset (len, indexing, slicing, iteration and '+'), but never holds every item in memory
+    Every access builds a new dictionary, so changes to a data item are not stored back to the dataset
+    """
+
+    def __init__(self, directory, columns=None, rows=None, readers=None):
+        """
+        :param directory: Columnar directory (see Shared_Files/columnar.py)
+        :param columns: Optional array of (dotted) column names to include in the data items
+        :param rows: Optional array of the rows of the directory in this dataset (used by slices and filters)
+        :param readers: Column readers shared with the dataset this one was sliced or filtered from
+        """
+        self.directory = directory
+        self.columns = columns
+        if readers is None:
+            manifest = read_manifest(directory)
+            readers = {column: ColumnReader(directory, column, manifest["columns"][column])
+                       for column in project_columns(manifest["columns"].keys(), columns)}
+            if rows is None:
+                rows = range(manifest["rows"])
+        self.readers = readers
+        self.rows = rows
+        self.paths = {column: column.split(".") for column in readers}
+        self.name_index = None
+
+    def __len__(self):
+        return len(self.rows)
+
+    def build_item(self, row, readers=None):
+        """
+        Function to build the (nested) data item of a row
+        :param row: Row of the columnar directory
+        :param readers: Optional dictionary of the column readers to use (defaults to every column of the dataset)
+        :return: Dictionary data item
+        """
+        data_item = {}
+        for column, reader in (readers or self.readers).items():
+            path = self.paths[column]
+            target = data_item
+            for key in path[:-1]:
+                target = target.setdefault(key, {})
+            target[path[-1]] = reader[row]
+        return data_item
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return LazyDataset(self.directory, self.columns, self.rows[position], self.readers)
+        return self.build_item(self.rows[position])
+
+    def __iter__(self):
+        # Stream the data items from disk one at a time
+        for row in self.rows:
+            yield self.build_item(row)
+
+    def __add__(self, other):
+        return list(self) + list(other)
+
+    def __radd__(self, other):
+        # Allows list based code such as 'data_array = data_array + read_results(path)' to keep working
+        return list(other) + list(self)
+
+    def lookup(self, name):
+        """
+        Function to find the data items of a function by its name (the name index is built on the first lookup)
+        :param name: Name of the function
+        :return: Array of the data items with this name (function names are not unique)
+        """
+        if self.name_index is None:
+            if "name" not in self.readers:
+                raise KeyError("The 'name' column is not included in this dataset")
+            self.name_index = {}
+            for position, row in enumerate(self.rows):
+                self.name_index.setdefault(self.readers["name"][row], []).append(position)
+        return [self[position] for position in self.name_index.get(name, [])]
+
+    def filter(self, predicate, columns=None):
+        """
+        Function to select the data items matching a condition, without building the items which do not match
+        :param predicate: Function which takes a data item and returns True to keep it
+        :param columns: Optional array of the column names the predicate needs (only these are read while filtering)
+        :return: LazyDataset of the matching data items
+        """
+        readers = self.readers if columns is None else {column: self.readers[column] for column in project_columns(self.readers.keys(), columns)}
+        rows = [row for row in self.rows if predicate(self.build_item(row, readers))]
+        return LazyDataset(self.directory, self.columns, rows, self.readers)
+
+    def close(self):
+        """
+        Function to release the memory maps (also closes every dataset sliced or filtered from this one)
+        :return: None
+        """
+        for reader in self.readers.values():
+            reader.close()
+
+
+def open_dataset(filepath, columns=None):
+    """
+    Function to open a dataset or results pkl file as a LazyDataset
+    The pkl file is converted to the columnar format first if it has no up to date columnar version
+    :param filepath: Filepath of the pkl file
+    :param columns: Optional array of (dotted) column names to include in the data items
+    :return: LazyDataset
+    """
+    if not os.path.exists(filepath):
+        raise FileNotFoundError(filepath + " does not exist")
+    if not is_columnar_current(filepath):
+        convert_pickle(filepath)
+    return LazyDataset(columnar_filepath(filepath), columns)